@@ -1,68 +1,64 @@
 #This script queries OpenAlex for a list of authors that have been affiliated with a list of
-#institutions. It also adds the years they were at the institution.
-import requests
+#institutions. It also adds the years they were at the institution, one row per stint (see stints.py).
+import argparse
 import asyncio
 import aiohttp
 import time
 import pandas as pd
-from aiohttp import ClientSession, ClientResponseError
-
-# CONFIG: map a short slug to its OpenAlex institution ID
-INSTITUTIONS = {
-    "mit":      "I63966007"   # Massachusetts Institute of Technology
-    #"ou":       "I8692664",    # University of Oklahoma
-    #"osu":      "I115475287",   # Oklahoma State University
-    #"dartmouth":"I107672454",  # Dartmouth College
-    #"cornell":  "I205783295",  # Cornell University
-    #"harvard":  "I136199984",  # Harvard University
-}
-HEADERS = {
-    "User-Agent": "MyResearchScraper/1.0 (mailto:mm4958@mit.edu)"
-}
+import metrics
+import response_archive
+from fastjson import decode_works_page
+from aiohttp import ClientResponseError
+from endpoints import OPENALEX_API
+from http_client import client_session, get_bytes
+from institutions import INSTITUTIONS, result_path, selected_slugs
+from ratelimit import openalex_limiter
+from stints import segment_stints
+from sync_state import UPDATED_FILTER, last_sync, record_sync, sync_started
+
 YEAR_MIN, YEAR_MAX = 1955, 2025
 CHUNK_SIZE = 10  # years per chunk
-REQUESTS_PER_SECOND = 1
+MAX_IN_FLIGHT = 32  # hard cap; the AIMD controller in ratelimit.py finds the working level
 MAX_REQUESTS = 1000
 PER_PAGE = 100
-request_times = []
+STAGE = "affiliations"  # metrics label
+AFFILIATION_COLUMNS = ["author_id", "name", "inst_1_id", "inst_1_name", "year_start_1", "year_end_1"]
+harvest_started = time.time()
+harvest_baseline = 0  # requests this process had made before the current harvest
 request_count = 0
 request_count_lock = asyncio.Lock()
 
 async def rate_limited_fetch(sem, session, url):
+    # get_bytes retries 429s/5xx with backoff, so one rate-limit hit no longer ends the chunk's cursor walk
     async with sem:
-        start = time.time()
-        async with session.get(url) as resp:
-            resp.raise_for_status()
-            result = await resp.json()
-        elapsed = time.time() - start
-        request_times.append(elapsed)
-
-        # await asyncio.sleep(0.1)
-        return result
+        body = await get_bytes(session, url, service="openalex", stage=STAGE, limiter=openalex_limiter())
+    return decode_works_page(body)
 
-async def fetch_with_cursor(session, sem, inst_id_num, year_start, year_end):
+async def fetch_with_cursor(session, sem, inst_id_num, year_start, year_end, since=None, max_requests=MAX_REQUESTS):
     cursor = "*"
+    since_filter = f",{UPDATED_FILTER}:{since}" if since else ""
     all_results = []
     while cursor:
 
-        if len(request_times) >= MAX_REQUESTS:
-            print(f"Reached maximum requests limit ({MAX_REQUESTS}). Stopping.")
+        made = metrics.value("http_requests_total", service="openalex", stage=STAGE) - harvest_baseline
+        if max_requests is not None and made >= max_requests:
+            print(f"Reached maximum requests limit ({max_requests}). Stopping.")
             break
 
         url = (
-            "https://api.openalex.org/works"
+            f"{OPENALEX_API}/works"
             f"?filter=institutions.id:{inst_id_num},"
-            f"publication_year:{year_start}-{year_end}"
+            f"publication_year:{year_start}-{year_end}{since_filter}"
             f"&per_page={PER_PAGE}&cursor={cursor}"
         )
         try:
             result = await rate_limited_fetch(sem, session, url)
-            all_results.extend(result.get("results", []))
-            cursor = result["meta"].get("next_cursor")
+            all_results.extend(result.results)
+            cursor = result.meta.next_cursor
 
-            # log progress
-            total_requests = len(request_times)
-            total_time = sum(request_times)
+            # log progress (rate over wall time, so it is right with requests in flight)
+            total_requests = int(metrics.value("http_requests_total", service="openalex", stage=STAGE) - harvest_baseline)
+            total_time = time.time() - harvest_started
             avg_rps = total_requests / total_time if total_time > 0 else 0
             print(f"[{year_start}-{year_end}] Total so far: {len(all_results)}, "
                   f"Requests made: {total_requests}, avg {avg_rps:.2f} req/sec")
@@ -70,68 +66,119 @@ async def fetch_with_cursor(session, sem, inst_id_num, year_start, year_end):
         except ClientResponseError as e:
             print(f"[{year_start}-{year_end}] Error {e.status}: {e.message}")
             break
+        except response_archive.NotArchived as e:
+            print(f"[{year_start}-{year_end}] {e}")
+            break
+        except ValueError as e:
+            # a page that does not decode (bad JSON, or a field of the wrong type) ends this chunk, not the harvest
+            print(f"[{year_start}-{year_end}] Undecodable page: {e}")
+            break
+
+    # cursor is only None once the last page came back
+    return all_results, cursor is None
 
-    return all_results
+async def harvest_institution(inst_id_num, since=None, years=(YEAR_MIN, YEAR_MAX), max_requests=MAX_REQUESTS):
+    """Stint table of everyone who published with the institution in the `years` range (inclusive).
 
-async def process_institution(slug, inst_id_num):
+    `max_requests` caps this harvest's pages (None for no cap). Queue workers
+    (workqueue.py) size their year-range shards from a count query instead.
+    """
+    global harvest_started, harvest_baseline
+    harvest_started = time.time()
+    harvest_baseline = metrics.value("http_requests_total", service="openalex", stage=STAGE)
+    year_min, year_max = years
     authors = {}
     inst_url = f"https://openalex.org/{inst_id_num}"
-    sem = asyncio.Semaphore(REQUESTS_PER_SECOND)  # limit concurrent requests
+    sem = asyncio.Semaphore(MAX_IN_FLIGHT)  # limit concurrent requests
 
-    async with aiohttp.ClientSession(headers=HEADERS) as session:
+    async with client_session() as session:
         tasks = []
         # Split years into chunks
-        for start in range(YEAR_MIN, YEAR_MAX + 1, CHUNK_SIZE):
-            end = min(start + CHUNK_SIZE - 1, YEAR_MAX)
-            tasks.append(fetch_with_cursor(session, sem, inst_id_num, start, end))
+        for start in range(year_min, year_max + 1, CHUNK_SIZE):
+            end = min(start + CHUNK_SIZE - 1, year_max)
+            tasks.append(fetch_with_cursor(session, sem, inst_id_num, start, end, since, max_requests))
 
         # Run all chunks in parallel
         all_chunks = await asyncio.gather(*tasks)
 
     # Flatten results
-    all_results = [r for chunk in all_chunks for r in chunk]
+    all_results = [r for chunk, _ in all_chunks for r in chunk]
+    complete = all(done for _, done in all_chunks)
 
-    # Process works
+    # Process works: first-seen name/institution per author, and every year they published there
+    years = set()
     for work in all_results:
-        year = work.get("publication_year")
-        if not isinstance(year, int) or not (YEAR_MIN <= year <= YEAR_MAX):
+        year = work.publication_year
+        if not isinstance(year, int) or not (year_min <= year <= year_max):
             continue
 
-        for auth in work.get("authorships", []):
-            a = auth.get("author", {})
-            aid = a.get("id")
-            name = a.get("display_name", "Unknown")
+        for auth in work.authorships:
+            aid = auth.author.id
+            name = auth.author.display_name
             if not aid:
                 continue
 
-            for inst in auth.get("institutions", []):
-                iid = inst.get("id")
-                iname = inst.get("display_name", "Unknown")
+            for inst in auth.institutions:
+                iid = inst.id
+                iname = inst.display_name
                 if iid and iid.lower() == inst_url.lower():
-                    rec = authors.setdefault(aid, {
-                        "name": name,
-                        "inst_1_id": iid,
-                        "inst_1_name": iname,
-                        "year_start_1": year,
-                        "year_end_1": year
-                    })
-                    rec["year_start_1"] = min(rec["year_start_1"], year)
-                    rec["year_end_1"] = max(rec["year_end_1"], year)
+                    authors.setdefault(aid, (name, iid, iname))
+                    years.add((aid, year))
+
+    occ = pd.DataFrame(list(years), columns=["author_id", "year_start_1"])
+    occ["year_end_1"] = occ["year_start_1"]
+    df = segment_stints(occ, ["author_id"], start="year_start_1", end="year_end_1")
+    info = pd.DataFrame.from_dict(authors, orient="index", columns=["name", "inst_1_id", "inst_1_name"])
+    df = df.join(info, on="author_id")[AFFILIATION_COLUMNS]
+    df.attrs["complete"] = complete
+    return df
+
+def merge_affiliations(old, new):
+    """Fold a delta harvest into the stored table: extend or add stints, add new authors."""
+    both = pd.concat([old, new.astype(str)], ignore_index=True)
+    merged = segment_stints(both, ["author_id"], start="year_start_1", end="year_end_1",
+                            first=["inst_1_id", "inst_1_name"])
+    names = both.drop_duplicates("author_id", keep="last").set_index("author_id")["name"]
+    return merged.assign(name=merged["author_id"].map(names))[AFFILIATION_COLUMNS]
+
+async def process_institution(slug, inst_id_num, incremental=False):
+    out_fn  = result_path(slug, "affiliations")
+    since   = last_sync(slug, "affiliations") if incremental and out_fn.exists() else None
+    started = sync_started()
+    if since:
+        print(f"[{slug}] Incremental refresh: works updated since {since}")
+
+    df = await harvest_institution(inst_id_num, since)
+    complete = df.attrs.get("complete", True)
+
+    if since:
+        # queue touched authors for scripts 2 and 3; script 3 clears the queue once merged
+        changed_fn = result_path(slug, "changed_authors")
+        changed = df[["author_id"]].drop_duplicates()
+        if changed_fn.exists():
+            changed = pd.concat([pd.read_csv(changed_fn, dtype=str), changed]).drop_duplicates()
+        changed.to_csv(changed_fn, index=False)
+        print(f"[{slug}] {len(changed)} authors touched by updated works")
+        df = merge_affiliations(pd.read_csv(out_fn, dtype=str), df)
 
     # dump to CSV
-    df = pd.DataFrame.from_dict(authors, orient="index")
-    df.reset_index(inplace=True)
-    df.rename(columns={"index": "author_id"}, inplace=True)
-    out_fn = f"/home/mm4958/openalex/results/{slug}_only_affiliations.csv"
     df.to_csv(out_fn, index=False)
-    print(f"[{slug}] Saved {len(df)} authors → {out_fn}")
+    print(f"[{slug}] Saved {df['author_id'].nunique()} authors ({len(df)} stints) → {out_fn}")
+    if complete:
+        record_sync(slug, "affiliations", started)
+    else:
+        print(f"[{slug}] Some year chunks stopped early; not advancing the sync date")
 
 # ── ENTRYPOINT ───────────────────────────────────────────────────────────────
 async def main():
+    parser = argparse.ArgumentParser(description="Harvest every author affiliated with each school.")
+    parser.add_argument("slugs", nargs="*", help="institution slugs (default: all registered)")
+    parser.add_argument("--incremental", action="store_true", help="only fetch works updated since the last sync")
+    args = parser.parse_args()
     start_time = time.time()
 
-    for slug, props in INSTITUTIONS.items():
-        await process_institution(slug, props) #once we add more institutions, this needs to be turned into a task so we can run asynchronously, using semaphore to rate limit to 10 req per second
+    for slug in selected_slugs(args.slugs):
+        await process_institution(slug, INSTITUTIONS[slug]["oa_id"], args.incremental) # to run schools side by side use `pipeline.py --processes N`; they share one OpenAlex rate limiter
 
     elapsed_time = time.time() - start_time
     print(f"\n Finished in {elapsed_time/60:.2f} minutes ({elapsed_time:.2f} seconds)")
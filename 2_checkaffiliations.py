@@ -1,54 +1,45 @@
+import argparse
 import pandas as pd
 import aiohttp
 import asyncio
 import time
 from pathlib import Path
-
-# ── CONFIG: Institutions ─────────────────────────────────────────────────────
-INSTITUTIONS = {
-    "mit": {
-        "display": "massachusetts institute of technology",
-        "oa_id":    "https://openalex.org/I63966007",
-        "input":    "/home/mm4958/openalex/results/mit_only_affiliations.csv",
-        "output":   "MIT_author_profiles_extended_f.csv"
-    },
-    "ou": {
-        "display": "university of oklahoma",
-        "oa_id":    "https://openalex.org/I8692664",
-        "input":    "ou_only_affiliations.csv",
-        "output":   "OU_author_profiles_extended_f.csv"
-    },
-    # Add more institutions as needed...
-}
+import deadletter
+import fastjson
+import metrics
+from endpoints import OPENALEX_API
+from http_client import client_session, get_bytes
+from institutions import INSTITUTIONS, oa_url, prefix as school_prefix, result_path, selected_slugs
+from ratelimit import SharedRateLimiter, install as install_limiter, openalex_limiter
+from singleflight import SingleFlight
+from sync_state import record_sync, sync_started
 
 # ── GLOBALS ──────────────────────────────────────────────────────────────────
-RATE_LIMIT = 10  # requests per second
+RATE_LIMIT = 32  # cap on requests in flight; the AIMD controller and rps limiter in ratelimit.py set the pace
 author_cache = {}  # Cache results by OpenAlex ID
+profile_flight = SingleFlight("author_profiles")  # duplicate ids in flight share one request
 MAX_LINES = 100000  # stop after this many authors
+STAGE = "profiles"  # metrics / dead-letter label
+RETRY_RATE_LIMIT = 2  # requests in flight during --retry-failed
+RETRY_RPS = 2         # requests/sec during --retry-failed
+OFFLINE_MISSES = {"NotInSnapshot", "NotArchived"}  # expected gaps in snapshot/replay runs; logged, never dead-lettered
 
 # ── UTILITY ──────────────────────────────────────────────────────────────────
 async def rate_limited_fetch(sem, session, url, max_retries=5, base_delay=1.0):
     async with sem:
-        for attempt in range(1, max_retries + 1):
-            try:
-                await asyncio.sleep(10 / RATE_LIMIT)  # space requests
-                async with session.get(url) as response:
-                    response.raise_for_status()
-                    return await response.json()
-            except aiohttp.ClientResponseError as e:
-                if e.status == 429 and attempt < max_retries:
-                    delay = base_delay * (2 ** (attempt - 1))  # exponential backoff
-                    print(f"429 rate limit hit, retrying in {delay:.1f}s (attempt {attempt}/{max_retries})")
-                    await asyncio.sleep(delay)
-                    continue
-                # for other HTTP errors or last retry, re-raise
-                raise
+        # spaced across all workers by the shared rps limiter; 429s/5xx retried with exponential backoff
+        body = await get_bytes(session, url, service="openalex", stage=STAGE, limiter=openalex_limiter(),
+                               max_retries=max_retries - 1, backoff=base_delay)
+    return fastjson.loads(body)
 
 async def fetch_profile(session, sem, oid):
+    metrics.record_cache("author_profiles", oid in author_cache)
     if oid in author_cache:
         return author_cache[oid]
+    return await profile_flight.do(oid, _fetch_profile, session, sem, oid)
 
-    url = f"https://api.openalex.org/authors/{oid}"
+async def _fetch_profile(session, sem, oid):
+    url = f"{OPENALEX_API}/authors/{oid}"
     try:
         profile = await rate_limited_fetch(sem, session, url)
         author_cache[oid] = profile
@@ -72,120 +63,230 @@ async def fetch_profile(session, sem, oid):
         }
         return author_cache[oid]
     
-async def fetch_and_process(session, sem, row, oa_id, prefix):
-    oid = row["author_id"].rsplit("/", 1)[-1]
+async def prefetch_profiles(author_ids, concurrency=RATE_LIMIT):
+    """Fill author_cache for authors listed by several schools, so each profile is fetched once."""
+    oids = {aid.rsplit("/", 1)[-1] for aid in author_ids} - author_cache.keys()
+    print(f"Prefetching {len(oids)} author profiles")
+    sem = asyncio.Semaphore(concurrency)
+    async with client_session() as session:
+        await asyncio.gather(*(fetch_profile(session, sem, oid) for oid in oids))
+
+async def fetch_and_process(session, sem, row, matcher):
+    oid = row[matcher.author_idx].rsplit("/", 1)[-1]
     profile = await fetch_profile(session, sem, oid)
-    enriched = {**row, **process_profile(row, profile, oa_id, prefix)}
-    return enriched
-
-def process_profile(row, profile, oa_id, prefix):
-    out = {}
-
-    out[f"{prefix}_ID"]         = row.get("inst_1_id")
-    out[f"{prefix}_year_start"] = row.get("year_start_1")
-    out[f"{prefix}_year_end"]   = row.get("year_end_1")
-
-    if "_error" in profile:
-        out.update({
-            "current_institutions": "",
-            "past_institutions":    "",
-            "_has_inst":            False,
-            "_error":               profile.get("_error"),
-            "status":               profile["status"],
-            "message":              profile["message"]
-        })
-        return out
-
-    current = [inst["display_name"] for inst in profile.get("last_known_institutions", [])]
-    past = [
-        aff["institution"]["display_name"]
-        for aff in profile.get("affiliations", [])
-        if aff["institution"]["display_name"] not in current
-    ]
-
-    orcid = profile.get("orcid") or profile.get("ids", {}).get("orcid")
-    orcid = orcid.rsplit("/", 1)[-1] if orcid else None
-
-    has_inst = any(inst.get("id", "").lower() == oa_id.lower()
-                   for inst in profile.get("last_known_institutions", [])) or \
-               any(aff["institution"].get("id", "").lower() == oa_id.lower()
-                   for aff in profile.get("affiliations", []))
-
-    out.update({
-        "current_institutions": "; ".join(current),
-        "past_institutions":    "; ".join(past),
-        "_has_inst":            has_inst,
-        "orcid":                orcid
-    })
-    return out
+    return matcher.process(row, profile)
 
-# ── MAIN ASYNC RUNNER ────────────────────────────────────────────────────────
-async def process_institution(slug, props):
-    disp_lower = props["display"].lower()
-    oa_id      = props["oa_id"]
-    in_csv     = props["input"]
-    out_csv    = Path("/home/mm4958/openalex/results") / props["output"]
-    prefix     = slug.upper()
+class InstitutionMatcher:
+    """Per-school state for process(), computed once rather than per author.
 
-    if not Path(in_csv).exists():
-        print(f"⚠ Skipping {slug}: {in_csv} not found.")
-        return
+    Rows go in and out as plain tuples: the input row's values followed by
+    EXTRA_COLUMNS, ready to be stacked into a DataFrame in one go. The per-year
+    affiliations OpenAlex lists on each profile are collected alongside into
+    `years` as (author_id, institution_id, institution_name, year) tuples.
+    """
+    EXTRA_COLUMNS = ["current_institutions", "past_institutions", "orcid", "works_count", "_has_inst", "_error", "status", "message"]
+    YEAR_COLUMNS  = ["author_id", "institution_id", "institution_name", "year"]
+
+    def __init__(self, oa_id, prefix, input_columns):
+        self.oa_id = oa_id.lower()
+        self.input_columns = list(input_columns)
+        self.author_idx = self.input_columns.index("author_id")
+        # the school's own id/years are copies of the harvested inst_1 columns
+        self.copy_idx = tuple(self.input_columns.index(c) for c in ("inst_1_id", "year_start_1", "year_end_1"))
+        self.columns = self.input_columns + [f"{prefix}_ID", f"{prefix}_year_start", f"{prefix}_year_end"] \
+            + self.EXTRA_COLUMNS
+        self.years = []
+
+    def process(self, row, profile):
+        head = row + tuple(row[i] for i in self.copy_idx)
+
+        if "_error" in profile:
+            return head + ("", "", None, None, False, profile["_error"], profile["status"], profile["message"])
+
+        # one walk over each list: collect names and test membership together
+        oa_id = self.oa_id
+        has_inst = False
+        current = []
+        for inst in profile.get("last_known_institutions") or ():
+            current.append(inst["display_name"])
+            if not has_inst and (inst.get("id") or "").lower() == oa_id:
+                has_inst = True
+        current_set = set(current)
+
+        past = []
+        author_id = row[self.author_idx]
+        years = self.years
+        for aff in profile.get("affiliations") or ():
+            inst = aff["institution"]
+            if inst["display_name"] not in current_set:
+                past.append(inst["display_name"])
+            if not has_inst and (inst.get("id") or "").lower() == oa_id:
+                has_inst = True
+            if inst.get("id"):
+                for year in aff.get("years") or ():
+                    years.append((author_id, inst["id"], inst["display_name"], year))
+
+        orcid = profile.get("orcid") or (profile.get("ids") or {}).get("orcid")
+        orcid = orcid.rsplit("/", 1)[-1] if orcid else None
+
+        return head + ("; ".join(current), "; ".join(past), orcid, profile.get("works_count"), has_inst, None, None, None)
+
+# ── MAIN ASYNC RUNNER ────────────────────────────────────────────────────────
+async def enrich_institution(df, slug, concurrency=RATE_LIMIT, save_errors=True):
+    oa_id      = oa_url(slug)
+    prefix     = school_prefix(slug)
 
-    df = pd.read_csv(in_csv, dtype=str)
     df = df.fillna("")
     total = len(df)
-    print(f"\n=== Processing {props['display']} ({total} authors) ===")
+    print(f"\n=== Processing {INSTITUTIONS[slug]['display']} ({total} authors) ===")
 
-    sem = asyncio.Semaphore(RATE_LIMIT)  # 10 req/sec limiter
-    results = []
-    
-    async with aiohttp.ClientSession() as session:
+    sem = asyncio.Semaphore(concurrency)  # cap requests in flight
+    matcher = InstitutionMatcher(oa_id, prefix, df.columns)
+    has_idx = matcher.columns.index("_has_inst")
+    err_idx = matcher.columns.index("_error")
+    rows = []
+    kept = errors = 0
+
+    async with client_session() as session:
         tasks = [
-            fetch_and_process(session, sem, row, oa_id, prefix)
-            for _, row in df.iterrows()
+            fetch_and_process(session, sem, row, matcher)
+            for row in df.itertuples(index=False, name=None)
         ]
 
-        results = []
-        
         for i, task in enumerate(asyncio.as_completed(tasks), 1):
-            enriched = await task
-            results.append(enriched)
-            
+            row = await task
+            rows.append(row)
+            kept += row[has_idx]
+            errors += row[err_idx] is not None
+
             if i >= MAX_LINES:  # stop early
                 print(f"Reached {MAX_LINES} rows, stopping early.")
                 break
 
             if i % 50 == 0 or i == total:
-                kept = sum(1 for r in results if r.get("_has_inst"))
-                errors = sum(1 for r in results if r.get("_error"))
                 print(f"[{i}/{total}] processed — {kept} kept, {errors} errors")
-            
-        
 
-    errors = [r for r in results if r.get("_error")]
-    print(errors)
-    print(f"Total errors: {len(errors)}")
+    out_df = pd.DataFrame(rows, columns=matcher.columns)
+    err_df = out_df[out_df["_error"].notna()].drop(columns=["orcid", "works_count"])
+    resolved = out_df.loc[out_df["_error"].isna(), "author_id"].tolist()
+    print(f"Total errors: {len(err_df)}")
+    print("Error types:", err_df["_error"].value_counts().to_dict())
+    if save_errors:
+        record_errors(slug, err_df, resolved, matcher.input_columns)
+
+    profiles = out_df[out_df["_has_inst"]].drop(columns=["_has_inst", "_error", "status", "message"])
+    # authors with several stints came through once per stint row
+    years_df = pd.DataFrame(matcher.years, columns=matcher.YEAR_COLUMNS).drop_duplicates()
+    years_df = years_df[years_df["author_id"].isin(profiles["author_id"])]
+    if not save_errors:
+        # the caller records them once for the whole school (workqueue.py merges profile shards)
+        profiles.attrs["errors"] = {"failed": err_df, "resolved": resolved, "input_columns": matcher.input_columns}
+    return profiles, years_df
 
-    from collections import Counter
-    error_types = Counter(r["_error"] for r in errors)
-    print("Error types:", error_types)
+def record_errors(slug, err_df, resolved, input_columns):
+    """Write the school's errors CSV and dead letters; `resolved` authors have since succeeded."""
     #Save errors to a CSV
-    if errors:
-    # ensure all columns are included
-        all_keys = set().union(*[r.keys() for r in errors])
-        pd.DataFrame(errors)[list(all_keys)].to_csv(f"{prefix}_errors.csv", index=False)
-
-    out_df = pd.DataFrame(results)
-    out_df["_has_inst"] = out_df["_has_inst"].fillna(False)
-    out_df = out_df[out_df["_has_inst"]].drop(columns=["_has_inst", "_error"], errors="ignore")
-    out_df.to_csv(out_csv, index=False)
+    if len(err_df):
+        err_df.to_csv(result_path(slug, "errors"), index=False)
+
+    # an author the snapshot/archive never held is not a failed lookup; replaying it live would only
+    # bury the real failures, so it stays in the errors CSV and out of the dead-letter store
+    offline = err_df["_error"].isin(OFFLINE_MISSES)
+    if offline.any():
+        print(f"⚠ {err_df.loc[offline, 'author_id'].nunique()} authors missing offline (not dead-lettered)")
+    err_df = err_df[~offline]
+
+    # keep failures across runs so --retry-failed can replay just these authors
+    deadletter.record_failures(STAGE, slug, [{
+        "key":         r["author_id"],
+        "error_class": r["_error"],
+        "status":      r["status"],
+        "message":     r["message"],
+        "payload":     {c: r[c] for c in input_columns},
+    } for r in err_df.drop_duplicates("author_id").to_dict("records")])
+    deadletter.resolve(STAGE, slug, resolved)
+
+def merge_profiles(old, new):
+    """Replace re-fetched authors' rows (one per stint) in the stored profiles and append new ones."""
+    old = old[~old["author_id"].isin(new["author_id"].unique())]
+    return pd.concat([old, new.astype(str)], ignore_index=True)
+
+def merge_affiliation_years(old, new):
+    """Swap in re-fetched authors' affiliation years wholesale."""
+    old = old[~old["author_id"].isin(new["author_id"].unique())]
+    return pd.concat([old, new.astype(str)], ignore_index=True)
+
+def save_profiles(slug, profiles, years_df, merge=False):
+    out_csv   = result_path(slug, "profiles")
+    years_csv = result_path(slug, "affiliation_years")
+    if merge and out_csv.exists():
+        profiles = merge_profiles(pd.read_csv(out_csv, dtype=str), profiles)
+    if merge and years_csv.exists():
+        years_df = merge_affiliation_years(pd.read_csv(years_csv, dtype=str), years_df)
+    profiles.to_csv(out_csv, index=False)
+    years_df.to_csv(years_csv, index=False)
+    return profiles
+
+async def process_institution(slug, incremental=False):
+    in_csv     = result_path(slug, "affiliations")
+    out_csv    = result_path(slug, "profiles")
+    changed_fn = result_path(slug, "changed_authors")
+    started    = sync_started()
+
+    if not Path(in_csv).exists():
+        print(f"⚠ Skipping {slug}: {in_csv} not found.")
+        return
+
+    df = pd.read_csv(in_csv, dtype=str)
+    incremental = incremental and out_csv.exists() and changed_fn.exists()
+    if incremental:
+        # only authors touched since the last harvest need a fresh profile
+        changed = pd.read_csv(changed_fn, dtype=str)["author_id"]
+        df = df[df["author_id"].isin(changed)]
+        print(f"[{slug}] Incremental refresh: {len(df)} changed authors")
+        if df.empty:
+            return
+
+    out_df, years_df = await enrich_institution(df, slug)
+    out_df = save_profiles(slug, out_df, years_df, merge=incremental)
+    record_sync(slug, "profiles", started)
     print(f"✓ Done! Saved {len(out_df)} profiles to {out_csv.name}")
 
+async def retry_failed(slug):
+    """Replay only dead-lettered authors, gently, and merge them into the stored profiles."""
+    out_csv = result_path(slug, "profiles")
+    failed = deadletter.pending(STAGE, slug)
+    if not failed:
+        print(f"[{slug}] No failed lookups to retry.")
+        return
+
+    df = pd.DataFrame([f["payload"] for f in failed])
+    in_csv = result_path(slug, "affiliations")
+    if in_csv.exists():
+        # the payload holds one stint; replay every stint of the failed authors
+        affiliations = pd.read_csv(in_csv, dtype=str)
+        df = pd.concat([affiliations[affiliations["author_id"].isin(df["author_id"])],
+                        df[~df["author_id"].isin(affiliations["author_id"])]], ignore_index=True)
+    print(f"[{slug}] Retrying {len(df)} failed lookups at {RETRY_RPS} req/sec")
+    out_df, years_df = await enrich_institution(df, slug, concurrency=RETRY_RATE_LIMIT)
+    out_df = save_profiles(slug, out_df, years_df, merge=True)
+    print(f"✓ Done! {len(deadletter.pending(STAGE, slug))} still failing; saved {len(out_df)} profiles to {out_csv.name}")
+
 # ── ENTRYPOINT ───────────────────────────────────────────────────────────────
 async def main():
+    parser = argparse.ArgumentParser(description="Fetch OpenAlex profiles for each school's authors.")
+    parser.add_argument("slugs", nargs="*", help="institution slugs (default: all registered)")
+    parser.add_argument("--incremental", action="store_true", help="only re-fetch authors touched by the last incremental harvest")
+    parser.add_argument("--retry-failed", action="store_true", help="only replay lookups in the dead-letter store, at a gentler rate")
+    args = parser.parse_args()
     start_time = time.time()
-    for slug, props in INSTITUTIONS.items():
-        await process_institution(slug, props)
+    if args.retry_failed:
+        install_limiter(SharedRateLimiter(RETRY_RPS))
+    for slug in selected_slugs(args.slugs):
+        if args.retry_failed:
+            await retry_failed(slug)
+        else:
+            await process_institution(slug, args.incremental)
         
     elapsed_time = time.time() - start_time
     print(f"\n Finished in {elapsed_time/60:.2f} minutes ({elapsed_time:.2f} seconds)")
@@ -1,133 +1,218 @@
 #This file gets the institutional lifespan of each author. We need to implement async/aiohttp instead of multithreading. Also author caching.
+#Each author–institution relationship becomes one span per stint, split where the years have a long gap (stints.py).
 
-import requests
-import time
+import argparse
+import asyncio
+import bisect
+import math
 import pandas as pd
+from fastjson import decode_works_page
 from collections import defaultdict
-from urllib3.util.retry import Retry
-from requests.adapters import HTTPAdapter
-
-# ── CONFIG: one entry per institution ─────────────────────────────────────────
-INSTITUTIONS = {
-    "mit": {
-        "input_profiles_csv": "/home/mm4958/openalex/results/MIT_author_profiles_extended_f.csv",
-        "output_spans_csv":   "MIT_author_institution_year_spans.csv"
-    },
-    "ou": {
-        "input_profiles_csv": "OU_author_profiles_extended_f.csv",
-        "output_spans_csv":   "OU_author_institution_year_spans.csv"
-    },
-    "osu": {
-        "input_profiles_csv": "OSU_author_profiles_extended_f.csv",
-        "output_spans_csv":   "OSU_author_institution_year_spans.csv"
-    },
-    "dartmouth": {
-        "input_profiles_csv": "DART_author_profiles_extended_f.csv",
-        "output_spans_csv":   "DART_author_institution_year_spans.csv"
-    },
-    "cornell": {
-        "input_profiles_csv": "CORN_author_profiles_extended_f.csv",
-        "output_spans_csv":   "CORN_author_institution_year_spans.csv"
-    },
-    "harvard": {
-        "input_profiles_csv": "HARV_author_profiles_extended_f.csv",
-        "output_spans_csv":   "HARV_author_institution_year_spans.csv"
-    },
-}
+from endpoints import OPENALEX_API
+from http_client import client_session, get_bytes
+from institutions import result_path, selected_slugs
+from ratelimit import openalex_limiter
+from stints import segment_stints
+from sync_state import UPDATED_FILTER, last_sync, record_sync, sync_started
 
 # how many works per page (max 200)
 PER_PAGE      = 200
-# polite pause between pages (seconds)
-REQUEST_DELAY = 0.5
-
-# ── SETUP SESSION WITH RETRIES ───────────────────────────────────────────────
-session = requests.Session()
-retry_strategy = Retry(
-    total=3,
-    backoff_factor=1,
-    status_forcelist=[429, 500, 502, 503, 504],
-    allowed_methods=["GET"],
-)
-adapter = HTTPAdapter(max_retries=retry_strategy)
-session.mount("https://", adapter)
-session.mount("http://", adapter)
-
-def get_json_with_retries(url, timeout=10):
-    resp = session.get(url, timeout=timeout)
-    resp.raise_for_status()
-    return resp.json()
-
-# ── MAIN LOOP: generate institution-year spans per institution ──────────────
-for slug, paths in INSTITUTIONS.items():
-    input_csv  = paths["input_profiles_csv"]
-    output_csv = paths["output_spans_csv"]
-
-    try:
-        authors_df = pd.read_csv(input_csv, dtype=str)
-    except FileNotFoundError:
-        print(f"⚠ Skipping {slug.upper()}: {input_csv} not found.")
-        continue
-
-    name_map    = dict(zip(authors_df["author_id"], authors_df.get("name", "")))
-    author_urls = authors_df["author_id"].tolist()
-    total = len(author_urls)
-    print(f"\n--- Processing {slug.upper()} ({total} authors) ---")
-
-    inst_years = defaultdict(set)
-
-    for author_url in author_urls:
-        author_id = author_url.rstrip("/").split("/")[-1]
-        print(f"→ Fetching works for author {author_id}")
-        page = 1
-
-        while True:
+# cap on author groups crawled at once; the AIMD controller in ratelimit.py sets the working level
+CONCURRENCY   = 32
+# ids per pipe-joined authorships.author.id filter (OpenAlex allows up to 100)
+MAX_IDS_PER_QUERY   = 50
+# assumed works_count for authors whose profile row doesn't carry one
+DEFAULT_WORKS_COUNT = 50
+STAGE         = "spans"  # metrics label
+SPAN_COLUMNS  = ["author_id", "name", "institution_id", "institution_name", "year_start", "year_end"]
+
+async def get_works_page(session, url):
+    body = await get_bytes(session, url, service="openalex", stage=STAGE, limiter=openalex_limiter())
+    return decode_works_page(body)
+
+# ── SPAN BUILDER: institution-year spans for one school's authors ────────────
+def load_affiliation_years(slug):
+    """Per-year affiliations script 2 saved from the author profiles, or None."""
+    fn = result_path(slug, "affiliation_years")
+    return pd.read_csv(fn, dtype=str) if fn.exists() else None
+
+def spans_from_affiliation_years(authors_df, years_df):
+    """Segment (author, institution, year) rows into stint spans without touching the API."""
+    years = years_df[years_df["author_id"].isin(authors_df["author_id"])]
+    spans = segment_stints(years.assign(year_start=years["year"], year_end=years["year"]),
+                           ["author_id", "institution_id"], first=["institution_name"])
+    name_map = dict(zip(authors_df["author_id"], authors_df.get("name", "")))
+    spans["name"] = spans["author_id"].map(name_map).fillna("")
+    return spans[SPAN_COLUMNS]
+
+def build_spans(authors_df, since=None, affiliation_years=None):
+    """Spans for authors_df, crawling works only for authors the profile years don't cover."""
+    if affiliation_years is not None:
+        covered = authors_df["author_id"].isin(affiliation_years["author_id"])
+        print(f"Spans from profile affiliation years for {covered.sum()} authors, crawling works for {(~covered).sum()}")
+        crawled = crawl_spans(authors_df[~covered], since=since)
+        spans = pd.concat([spans_from_affiliation_years(authors_df[covered], affiliation_years), crawled],
+                          ignore_index=True)
+        spans.attrs["complete"] = crawled.attrs["complete"]
+        return spans
+    return crawl_spans(authors_df, since=since)
+
+def pack_authors(works_counts):
+    """Group author ids so each group's works fill as few pages as possible.
+
+    Best-fit decreasing: every group holds ceil(works / PER_PAGE) pages
+    worth of works. Each author goes into the group with the least room
+    left that still fits it, capped at MAX_IDS_PER_QUERY ids. Authors too
+    big for any open group start a new one, and its leftover space on the
+    last page is filled by smaller authors.
+    """
+    groups, open_groups = [], []  # open_groups: sorted (room left, group index)
+    for author, n in sorted(works_counts.items(), key=lambda kv: -kv[1]):
+        n = max(int(n), 1)
+        i = bisect.bisect_left(open_groups, (n, -1))
+        if i < len(open_groups):
+            room, g = open_groups.pop(i)
+            groups[g].append(author)
+            room -= n
+        else:
+            g = len(groups)
+            groups.append([author])
+            room = math.ceil(n / PER_PAGE) * PER_PAGE - n
+        if room > 0 and len(groups[g]) < MAX_IDS_PER_QUERY:
+            bisect.insort(open_groups, (room, g))
+    return groups
+
+async def crawl_group(session, sem, author_urls, since_filter, inst_years):
+    """Cursor through the works of several authors at once and credit each one's institutions.
+
+    Returns False if a page failed and the group's works are incomplete.
+    """
+    by_short = {url.rstrip("/").split("/")[-1]: url for url in author_urls}
+    cursor = "*"
+    async with sem:
+        print(f"→ Fetching works for {len(by_short)} authors")
+        while cursor:
             works_url = (
-                "https://api.openalex.org/works"
-                f"?filter=authorships.author.id:{author_id}"
-                f"&per_page={PER_PAGE}&page={page}"
+                f"{OPENALEX_API}/works"
+                f"?filter=authorships.author.id:{'|'.join(by_short)}{since_filter}"
+                f"&per_page={PER_PAGE}&cursor={cursor}"
             )
             try:
-                data = get_json_with_retries(works_url)
+                data = await get_works_page(session, works_url)
             except Exception as e:
-                print(f"   ! Failed to fetch page {page} for {author_id}: {e}")
-                break
+                print(f"   ! Failed to fetch works for {', '.join(by_short)}: {e}")
+                return False
 
-            results = data.get("results", [])
-            if not results:
-                break
-
-            for work in results:
-                year = work.get("publication_year")
+            for work in data.results:
+                year = work.publication_year
                 if not isinstance(year, int):
                     continue
 
-                for auth in work.get("authorships", []):
-                    if auth.get("author", {}).get("id", "").endswith(author_id):
-                        for inst in auth.get("institutions", []):
-                            inst_id   = inst.get("id")
-                            inst_name = inst.get("display_name", "")
-                            if inst_id:
-                                inst_years[(author_url, inst_id, inst_name)].add(year)
-                        break  # proceed to next work
-
-            if len(results) < PER_PAGE:
-                break
-
-            page += 1
-            time.sleep(REQUEST_DELAY)
-
-    # Build and save the spans DataFrame
-    records = []
-    for (author_url, inst_id, inst_name), years in inst_years.items():
-        records.append({
-            "author_id":        author_url,
-            "name":             name_map.get(author_url, ""),
-            "institution_id":   inst_id,
-            "institution_name": inst_name,
-            "year_start":       min(years),
-            "year_end":         max(years),
-        })
-
-    out_df = pd.DataFrame(records)
-    out_df.to_csv(f"/home/mm4958/openalex/results/{output_csv}", index=False)
-    print(f"✓ Done for {slug.upper()}: wrote {len(out_df)} rows to {output_csv}")
+                for auth in work.authorships:
+                    author_url = by_short.get((auth.author.id or "").rsplit("/", 1)[-1])
+                    if author_url is None:
+                        continue
+                    for inst in auth.institutions:
+                        if inst.id:
+                            inst_years[(author_url, inst.id, inst.display_name or "")].add(year)
+
+            cursor = data.meta.next_cursor if data.results else None
+    return True
+
+async def crawl_all(groups, since_filter, inst_years):
+    sem = asyncio.Semaphore(CONCURRENCY)
+    async with client_session() as session:
+        return await asyncio.gather(*(crawl_group(session, sem, group, since_filter, inst_years) for group in groups))
+
+def crawl_spans(authors_df, since=None):
+    since_filter = f",{UPDATED_FILTER}:{since}" if since else ""
+    name_map    = dict(zip(authors_df["author_id"], authors_df.get("name", "")))
+    counts = pd.to_numeric(authors_df["works_count"], errors="coerce") if "works_count" in authors_df \
+        else pd.Series(float("nan"), index=authors_df.index)
+    groups = pack_authors(dict(zip(authors_df["author_id"], counts.fillna(DEFAULT_WORKS_COUNT))))
+
+    inst_years = defaultdict(set)
+    complete = True
+    if groups:
+        print(f"Packed {len(authors_df)} authors into {len(groups)} works queries")
+        complete = all(asyncio.run(crawl_all(groups, since_filter, inst_years)))
+
+    # One row per (author, institution, year) seen, then one span per stint
+    occ = pd.DataFrame([(author_url, inst_id, inst_name, year)
+                        for (author_url, inst_id, inst_name), years in inst_years.items() for year in years],
+                       columns=["author_id", "institution_id", "institution_name", "year_start"])
+    occ["year_end"] = occ["year_start"]
+    spans = segment_stints(occ, ["author_id", "institution_id"], first=["institution_name"])
+    spans["name"] = spans["author_id"].map(name_map).fillna("")
+    spans = spans[SPAN_COLUMNS]
+    spans.attrs["complete"] = complete  # False if any works query failed
+    return spans
+
+def merge_spans(old, new):
+    """Extend stored stints with years seen in newly fetched works, or add new stints."""
+    both = pd.concat([old, new.astype(str)], ignore_index=True)
+    return segment_stints(both, ["author_id", "institution_id"], first=["name", "institution_name"])[SPAN_COLUMNS]
+
+def refresh_spans(slug, authors_df, output_csv, affiliation_years=None):
+    """Incremental run: crawl only authors queued by script 1 and merge into the stored spans.
+
+    Authors already in the spans table only fetch works updated since the last
+    sync; authors new to it get their full history. Authors whose profile
+    affiliation years were just refreshed by script 2 skip the crawl entirely.
+    """
+    changed_fn = result_path(slug, "changed_authors")
+    since      = last_sync(slug, "spans")
+    old_spans  = pd.read_csv(output_csv, dtype=str)
+    changed    = authors_df[authors_df["author_id"].isin(pd.read_csv(changed_fn, dtype=str)["author_id"])]
+    known      = changed["author_id"].isin(old_spans["author_id"])
+    print(f"Incremental refresh: {known.sum()} known authors since {since}, {(~known).sum()} new authors")
+
+    if affiliation_years is not None:
+        covered   = changed["author_id"].isin(affiliation_years["author_id"])
+        from_years = spans_from_affiliation_years(changed[covered], affiliation_years)
+        changed, known = changed[~covered], known[~covered]
+    else:
+        from_years = pd.DataFrame(columns=SPAN_COLUMNS)
+    crawls = [crawl_spans(changed[known], since=since), crawl_spans(changed[~known])]
+    out_df = merge_spans(old_spans, pd.concat([from_years, *crawls]))
+    out_df.attrs["complete"] = all(c.attrs["complete"] for c in crawls)
+    if out_df.attrs["complete"]:
+        changed_fn.unlink()  # queue consumed
+    return out_df
+
+# ── MAIN LOOP: generate institution-year spans per institution ──────────────
+def main():
+    parser = argparse.ArgumentParser(description="Build institution-year spans for each school's authors.")
+    parser.add_argument("slugs", nargs="*", help="institution slugs (default: all registered)")
+    parser.add_argument("--incremental", action="store_true", help="only crawl authors touched by the last incremental harvest")
+    parser.add_argument("--crawl-works", action="store_true", help="ignore profile affiliation years and crawl every author's works")
+    args = parser.parse_args()
+
+    for slug in selected_slugs(args.slugs):
+        input_csv  = result_path(slug, "profiles")
+        output_csv = result_path(slug, "spans")
+        started    = sync_started()
+
+        try:
+            authors_df = pd.read_csv(input_csv, dtype=str)
+        except FileNotFoundError:
+            print(f"⚠ Skipping {slug.upper()}: {input_csv} not found.")
+            continue
+
+        years_df = None if args.crawl_works else load_affiliation_years(slug)
+        print(f"\n--- Processing {slug.upper()} ({len(authors_df)} authors) ---")
+        if args.incremental and output_csv.exists() and last_sync(slug, "spans") \
+                and result_path(slug, "changed_authors").exists():
+            out_df = refresh_spans(slug, authors_df, output_csv, years_df)
+        else:
+            out_df = build_spans(authors_df, affiliation_years=years_df)
+        out_df.to_csv(output_csv, index=False)
+        print(f"✓ Done for {slug.upper()}: wrote {len(out_df)} rows to {output_csv.name}")
+        if out_df.attrs.get("complete", True):
+            record_sync(slug, "spans", started)
+        else:
+            # the next --incremental run re-crawls the same queue from the same date
+            print(f"⚠ {slug.upper()}: some works queries failed; not advancing the sync date")
+
+if __name__ == "__main__":
+    main()
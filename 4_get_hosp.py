@@ -1,139 +1,258 @@
 #This file gets the nearest hospital to each author's institution. We need to implement multithreaded calls to the API on 2 cores (the basic one and the fallback one). Also async/aiohttp. Make sure
 #To check the rate limits for the two APIs in this case: arcgis open data and nominatin.
-import requests
+import asyncio
 import pandas as pd
 import numpy as np
-import time
 import math
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from urllib3.util.retry import Retry
-from requests.adapters import HTTPAdapter
+import fastjson
 from sklearn.neighbors import BallTree
+from endpoints import NOMINATIM_URL, OPENALEX_API
+from http_client import client_session, get_bytes
+from institutions import result_path, selected_slugs
+from ratelimit import nominatim_limiter, openalex_limiter
+from singleflight import SingleFlight
 
-# Need to create to all schools
 # ── CONFIG ────────────────────────────────────────────────────────────────
-INPUT_CSV     = "/home/mm4958/openalex/results/MIT_author_institution_year_spans.csv"
-OUTPUT_CSV    = "/home/mm4958/openalex/results/with_nearest_hospital_v4.csv"
 HOSPITALS_URL = (
     "https://opendata.arcgis.com/datasets/"
     "f36521f6e07f4a859e838f0ad7536898_0.csv"
 )
-OA_BASE       = "https://api.openalex.org/institutions/"
-NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
-REQUEST_DELAY = 0.1   # seconds between API calls
-GEOCODE_DELAY = 1.0   # seconds for Nominatim
-
-# ── SETUP HTTP SESSION WITH RETRIES ─────────────────────────────────────────
-session = requests.Session()
-retry_strategy = Retry(total=3, backoff_factor=1, status_forcelist=[429,500,502,503,504])
-adapter = HTTPAdapter(max_retries=retry_strategy)
-session.mount("https://", adapter)
-session.mount("http://", adapter)
-
-def fetch_json(url, timeout=10):
-    r = session.get(url, timeout=timeout)
-    r.raise_for_status()
-    return r.json()
-
-def fetch_inst_coord(inst_id):
+OA_BASE       = f"{OPENALEX_API}/institutions/"
+CONCURRENCY   = 32    # cap on OpenAlex institution lookups in flight (AIMD sets the working level)
+EARTH_RADIUS_KM = 6371.0
+# Hospital open/close columns, first one present wins. The HIFLD list has none,
+# in which case every hospital counts as operating in every year.
+HOSP_OPEN_COLS  = ["open_year", "year_opened", "opened", "open_date"]
+HOSP_CLOSE_COLS = ["close_year", "year_closed", "closed", "close_date"]
+
+institution_flight = SingleFlight("institutions")  # duplicate ids in flight share one request
+
+async def fetch_institution(session, url):
+    body = await get_bytes(session, url, service="openalex", stage="geocode", limiter=openalex_limiter())
+    return fastjson.decode_institution(body)
+
+async def fetch_inst_coord(session, sem, inst_id):
     """Fetch latitude and longitude for a given OpenAlex institution ID."""
     key = inst_id.rstrip("/").split("/")[-1]
-    try:
-        js = fetch_json(f"{OA_BASE}{key}")
-        geo = js.get("location", {}).get("geo", {})
-        lat = geo.get("latitude")
-        lon = geo.get("longitude")
-        if lat is not None and lon is not None:
-            return inst_id, (float(lat), float(lon))
-    except Exception:
-        pass
-    return inst_id, (None, None)
-
-# ── LOAD PANEL DATA ───────────────────────────────────────────────────────
-df = pd.read_csv(INPUT_CSV, dtype=str)
-unique_insts = df["institution_id"].unique()
-id_to_name = df.set_index("institution_id")["institution_name"].to_dict()
+    # spellings of one id (URL vs bare, trailing slash) share a single request
+    return inst_id, await institution_flight.do(key.upper(), _fetch_coord, session, sem, key)
+
+async def _fetch_coord(session, sem, key):
+    async with sem:
+        try:
+            geo = (await fetch_institution(session, f"{OA_BASE}{key}")).geo
+            lat = geo.latitude
+            lon = geo.longitude
+            if lat is not None and lon is not None:
+                return float(lat), float(lon)
+        except Exception:
+            pass
+    return None, None
+
+async def geocode_name(session, name):
+    """Nominatim free-text lookup; (lat, lon) or None."""
+    body = await get_bytes(session, NOMINATIM_URL, service="nominatim", stage="geocode",
+                           params={"q": name, "format": "json", "limit": 1}, limiter=nominatim_limiter())
+    res = fastjson.loads(body)
+    return (float(res[0]["lat"]), float(res[0]["lon"])) if res else None
+
+def hospital_years(frame, candidates):
+    """Parse the first available open/close column into float years (NaN = unknown)."""
+    for col in candidates:
+        if col in frame.columns:
+            years = pd.to_numeric(frame[col], errors="coerce")
+            dates = pd.to_datetime(frame[col], errors="coerce", format="mixed")
+            return years.where(years.between(1000, 3000), dates.dt.year).astype(float).values
+    return np.full(len(frame), np.nan)
+
+def _fmt_year(y):
+    return "" if np.isnan(y) else int(y)
+
+def build_period_trees(hosp):
+    """Split the year axis at every open/close boundary and index each period.
+
+    Returns (edges, trees): period i covers years [edges[i], edges[i+1]) and
+    trees[i] = (BallTree, positions into hosp) for the hospitals operating then.
+    """
+    opens  = np.nan_to_num(hosp["open_year"].values, nan=-np.inf)
+    closes = np.nan_to_num(hosp["close_year"].values, nan=np.inf)  # inclusive
+    bounds = np.unique(np.concatenate([opens[np.isfinite(opens)],
+                                       closes[np.isfinite(closes)] + 1]))
+    edges = np.concatenate([[-np.inf], bounds])
+    coords = np.deg2rad(hosp[["latitude","longitude"]].values)
+
+    trees = {}
+    for i, start in enumerate(edges):
+        active = np.flatnonzero((opens <= start) & (closes + 1 > start))
+        if len(active):
+            trees[i] = (BallTree(coords[active], metric="haversine"), active)
+    return edges, trees
+
+def nearest_operating_hospital(spans, inst_coords, hosp, edges, trees):
+    """Nearest hospital operating at any point of each span, one row per span.
+
+    Spans are exploded into the periods they overlap, each (institution, period)
+    pair is queried once against that period's tree, and the closest hit per
+    span wins. Spans without years are matched against every period.
+    """
+    n = len(spans)
+    starts = pd.to_numeric(spans["year_start"], errors="coerce").values
+    ends   = pd.to_numeric(spans["year_end"], errors="coerce").values
+    first = np.where(np.isnan(starts), 0, np.searchsorted(edges, starts, "right") - 1)
+    last  = np.where(np.isnan(ends), len(edges) - 1, np.searchsorted(edges, ends, "right") - 1)
+    last  = np.maximum(first, last)
+
+    coord_rows = {k: v for k, v in inst_coords.items() if v[0] is not None and v[1] is not None}
+    inst_ids = list(coord_rows)
+    inst_pos = spans["institution_id"].map({k: i for i, k in enumerate(inst_ids)})
+    has_coord = inst_pos.notna().values
+    inst_pos = inst_pos.fillna(-1).astype(int).values
+    inst_rad = np.deg2rad(np.array([coord_rows[k] for k in inst_ids], dtype=float).reshape(-1, 2))
+
+    # explode spans into (span row, period) pairs
+    counts = np.where(has_coord, last - first + 1, 0)
+    rows = np.repeat(np.arange(n), counts)
+    periods = np.repeat(first, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+    pairs = pd.DataFrame({"row": rows, "inst": inst_pos[rows], "period": periods})
+
+    # one batched tree query per period over the institutions that need it
+    pair_dist = np.full(len(pairs), np.inf)
+    pair_hosp = np.full(len(pairs), -1)
+    for period, grp in pairs.groupby("period"):
+        if period not in trees:
+            continue
+        tree, active = trees[period]
+        uniq, inv = np.unique(grp["inst"].values, return_inverse=True)
+        dist_rad, idx = tree.query(inst_rad[uniq], k=1)
+        pair_dist[grp.index] = dist_rad[inv, 0]
+        pair_hosp[grp.index] = active[idx[inv, 0]]
+
+    out = pd.DataFrame({"closest_hospital": "", "hospital_lat": "", "hospital_lon": "",
+                        "distance_km": "", "hospital_open_year": "", "hospital_close_year": ""},
+                       index=range(n), dtype=object)
+    pairs["dist"], pairs["hosp"] = pair_dist, pair_hosp
+    best = pairs[pairs["hosp"] >= 0]
+    best = best.loc[best.groupby("row")["dist"].idxmin()]
+    rec = hosp.iloc[best["hosp"].values]
+    out.loc[best["row"].values, "closest_hospital"]    = rec["hospital_name"].values
+    out.loc[best["row"].values, "hospital_lat"]        = rec["latitude"].values
+    out.loc[best["row"].values, "hospital_lon"]        = rec["longitude"].values
+    out.loc[best["row"].values, "distance_km"]         = best["dist"].values * EARTH_RADIUS_KM
+    out.loc[best["row"].values, "hospital_open_year"]  = rec["open_year"].map(_fmt_year).values
+    out.loc[best["row"].values, "hospital_close_year"] = rec["close_year"].map(_fmt_year).values
+    return out
 
 # ── PARALLEL GEOCODING via OpenAlex ─────────────────────────────────────────
-inst_coords = {}
-print(f"Geocoding {len(unique_insts)} institutions via OpenAlex...")
-with ThreadPoolExecutor(max_workers=10) as executor:
-    futures = {executor.submit(fetch_inst_coord, iid): iid for iid in unique_insts}
-    for i, fut in enumerate(as_completed(futures), start=1):
-        inst_id, coord = fut.result()
-        inst_coords[inst_id] = coord
-        print(f"[Geo {i}/{len(unique_insts)}]")
-        time.sleep(REQUEST_DELAY)
-
-# ── FALLBACK GEOCODING via Nominatim for missing coords ──────────────────── #We should parallelize this
-print("Fallback geocoding missing institutions via Nominatim...")
-for inst_id, (lat, lon) in list(inst_coords.items()):
-    if lat is None or lon is None:
-        name = id_to_name.get(inst_id, "")
-        if name:
-            print(f"  [Fallback] Geocoding '{name}'")
-            try:
-                res = session.get(NOMINATIM_URL, params={
-                    "q": name,
-                    "format": "json",
-                    "limit": 1
-                }, headers={"User-Agent":"AcademicHealthPanel/1.0"}).json()
-                if res:
-                    lat = float(res[0]["lat"])
-                    lon = float(res[0]["lon"])
-                    inst_coords[inst_id] = (lat, lon)
-                    print(f"    → {lat:.4f}, {lon:.4f}")
-                else:
-                    print("    → No result")
-            except Exception as e:
-                print(f"    → Error: {e}")
-            time.sleep(GEOCODE_DELAY)
+async def geocode_all(unique_insts, id_to_name):
+    inst_coords = {}
+    sem = asyncio.Semaphore(CONCURRENCY)
+    async with client_session() as session:
+        print(f"Geocoding {len(unique_insts)} institutions via OpenAlex...")
+        tasks = [fetch_inst_coord(session, sem, iid) for iid in unique_insts]
+        for i, fut in enumerate(asyncio.as_completed(tasks), start=1):
+            inst_id, coord = await fut
+            inst_coords[inst_id] = coord
+            print(f"[Geo {i}/{len(unique_insts)}]")
+
+        # ── FALLBACK GEOCODING via Nominatim for missing coords ──────────────
+        # Sequential on purpose: Nominatim's usage policy allows 1 request/sec.
+        # Institutions sharing a name are looked up once.
+        print("Fallback geocoding missing institutions via Nominatim...")
+        by_name = {}
+        for inst_id, (lat, lon) in list(inst_coords.items()):
+            if lat is None or lon is None:
+                name = id_to_name.get(inst_id, "")
+                name_key = " ".join(str(name).split()).casefold()
+                if name_key in by_name:
+                    if by_name[name_key]:
+                        inst_coords[inst_id] = by_name[name_key]
+                    continue
+                if name:
+                    print(f"  [Fallback] Geocoding '{name}'")
+                    by_name[name_key] = None
+                    try:
+                        coord = await geocode_name(session, name)
+                        by_name[name_key] = coord
+                        if coord:
+                            inst_coords[inst_id] = coord
+                            print(f"    → {coord[0]:.4f}, {coord[1]:.4f}")
+                        else:
+                            print("    → No result")
+                    except Exception as e:
+                        print(f"    → Error: {e}")
+    return inst_coords
+
+def geocode_institutions(df):
+    """Coordinates for every institution in the spans panel, one row per institution."""
+    unique_insts = df["institution_id"].unique()
+    id_to_name = df.set_index("institution_id")["institution_name"].to_dict()
+    inst_coords = asyncio.run(geocode_all(unique_insts, id_to_name))
+
+    return pd.DataFrame(
+        [(iid, lat, lon) for iid, (lat, lon) in inst_coords.items()],
+        columns=["institution_id", "institution_lat", "institution_lon"],
+    )
 
 # ── LOAD & PREPARE HOSPITAL DATA ───────────────────────────────────────────
-print("Downloading hospital list…")
-hosp = pd.read_csv(HOSPITALS_URL)
-hosp.columns = hosp.columns.str.strip().str.lower()
-hosp = hosp.rename(columns={
-    "name":      "hospital_name",
-    "latitude":  "latitude",
-    "longitude": "longitude"
-})
-hosp = hosp[["hospital_name","latitude","longitude"]].dropna()
-hosp["latitude"]  = hosp["latitude"].astype(float)
-hosp["longitude"] = hosp["longitude"].astype(float)
-
-# ── BUILD BallTree for fast nearest-hospital lookup ────────────────────────
-hosp_rad = np.deg2rad(hosp[["latitude","longitude"]].values)
-tree = BallTree(hosp_rad, metric="haversine")
-
-# ── COMPUTE NEAREST HOSPITAL FOR EACH INSTITUTION ─────────────────────────
-nearest_map = {}
-print("Finding nearest hospital for each institution...")
-for i, (inst_id, (lat, lon)) in enumerate(inst_coords.items(), start=1):
-    if lat is None or lon is None:
-        nearest_map[inst_id] = {"closest_hospital":"","hospital_lat":"","hospital_lon":"","distance_km":""}
-    else:
-        inst_rad = np.deg2rad([[lat, lon]])
-        dist_rad, idx = tree.query(inst_rad, k=1)
-        idx0 = idx[0][0]
-        d_km = dist_rad[0][0] * 6371.0
-        rec = hosp.iloc[idx0]
-        nearest_map[inst_id] = {
-            "closest_hospital": rec.hospital_name,
-            "hospital_lat":     rec.latitude,
-            "hospital_lon":     rec.longitude,
-            "distance_km":      d_km
-        }
-    if i % 100 == 0 or i == len(inst_coords):
-        print(f"[Hospital {i}/{len(inst_coords)}]")
-
-# ── MERGE & SAVE FINAL PANEL ───────────────────────────────────────────────
-print("Merging nearest-hospital info into panel and saving...")
-out = df.copy()
-out["closest_hospital"] = out["institution_id"].map(lambda x: nearest_map.get(x, {}).get("closest_hospital",""))
-out["hospital_lat"]     = out["institution_id"].map(lambda x: nearest_map.get(x, {}).get("hospital_lat",""))
-out["hospital_lon"]     = out["institution_id"].map(lambda x: nearest_map.get(x, {}).get("hospital_lon",""))
-out["distance_km"]      = out["institution_id"].map(lambda x: nearest_map.get(x, {}).get("distance_km",""))
-
-out.to_csv(OUTPUT_CSV, index=False)
-print(f"✓ Done: wrote {len(out)} rows with nearest hospital info to {OUTPUT_CSV}")
+def load_hospitals():
+    print("Downloading hospital list…")
+    hosp = pd.read_csv(HOSPITALS_URL)
+    hosp.columns = hosp.columns.str.strip().str.lower()
+    hosp = hosp.rename(columns={
+        "name":      "hospital_name",
+        "latitude":  "latitude",
+        "longitude": "longitude"
+    })
+    hosp = hosp.dropna(subset=["latitude","longitude"]).reset_index(drop=True)
+    hosp_raw = hosp
+    hosp = hosp[["hospital_name","latitude","longitude"]].copy()
+    hosp["latitude"]  = hosp["latitude"].astype(float)
+    hosp["longitude"] = hosp["longitude"].astype(float)
+    hosp["open_year"]  = hospital_years(hosp_raw, HOSP_OPEN_COLS)
+    hosp["close_year"] = hospital_years(hosp_raw, HOSP_CLOSE_COLS)
+    return hosp
+
+def attach_nearest_hospital(df, coords, hosp):
+    # ── SPLIT HOSPITALS INTO OPERATING PERIODS ─────────────────────────────
+    # Every open/close year is a boundary; between two boundaries the set of
+    # operating hospitals is constant, so one BallTree per period answers every
+    # span that touches it. Without date columns this collapses to a single tree.
+    edges, trees = build_period_trees(hosp)
+    print(f"Built {len(trees)} hospital indexes across {len(edges)} operating periods")
+
+    # ── COMPUTE NEAREST OPERATING HOSPITAL FOR EACH SPAN ───────────────────
+    print("Finding nearest operating hospital for each institution-year span...")
+    inst_coords = {
+        iid: (None if pd.isna(lat) else lat, None if pd.isna(lon) else lon)
+        for iid, lat, lon in coords[["institution_id", "institution_lat", "institution_lon"]].itertuples(index=False)
+    }
+    nearest = nearest_operating_hospital(df, inst_coords, hosp, edges, trees)
+
+    # ── MERGE NEAREST-HOSPITAL INFO INTO PANEL ─────────────────────────────
+    out = df.copy()
+    out["institution_lat"] = out["institution_id"].map(lambda x: inst_coords.get(x, (None, None))[0])
+    out["institution_lon"] = out["institution_id"].map(lambda x: inst_coords.get(x, (None, None))[1])
+    for col in ["closest_hospital", "hospital_lat", "hospital_lon", "distance_km",
+                "hospital_open_year", "hospital_close_year"]:
+        out[col] = nearest[col].values
+    return out
+
+def main():
+    hosp = load_hospitals()
+    for slug in selected_slugs():
+        input_csv  = result_path(slug, "spans")
+        output_csv = result_path(slug, "hospital")
+        try:
+            df = pd.read_csv(input_csv, dtype=str)
+        except FileNotFoundError:
+            print(f"⚠ Skipping {slug.upper()}: {input_csv} not found.")
+            continue
+
+        coords = geocode_institutions(df)
+        out = attach_nearest_hospital(df, coords, hosp)
+
+        out.to_csv(output_csv, index=False)
+        print(f"✓ Done: wrote {len(out)} rows with nearest hospital info to {output_csv}")
+
+if __name__ == "__main__":
+    main()
@@ -3,43 +3,48 @@
 """
 enrich_with_birth_death.py
 
-Reads your `with_nearest_hospital_v4.csv`, looks up each researcher’s
+Reads each school's `<PREFIX>_with_nearest_hospital_v4.csv`, looks up each researcher’s
 date of birth (P569) and date of death (P570) on Wikidata (filtered to MIT affiliates),
-and writes out `with_nearest_hospital_v5.csv` with two new columns:
+and writes out `<PREFIX>_with_nearest_hospital_v5.csv` with two new columns:
     - date_of_birth (ISO format)
     - date_of_death (ISO format or blank)
 
 Dependencies:
-    pip install pandas SPARQLWrapper
+    pip install pandas aiohttp
 """
 
+import asyncio
 import pandas as pd
-import time
-from SPARQLWrapper import SPARQLWrapper, JSON
+import fastjson
+from endpoints import WIKIDATA_SPARQL
+from http_client import client_session, get_bytes
+from institutions import result_path, selected_slugs
+from singleflight import SingleFlight
 
 
-# Need to create to all schools
 # ── CONFIG ────────────────────────────────────────────────────────────────
-INPUT_CSV         = "/home/mm4958/openalex/results/with_nearest_hospital_v4.csv"
-OUTPUT_CSV        = "/home/mm4958/openalex/results/with_nearest_hospital_v5.csv"
 NAME_COL          = "name"           # column in your CSV with the researcher’s name
 MIT_WIKIDATA_QID  = "Q49117"         # Wikidata Q-ID for MIT
-REQUEST_DELAY_SEC = 1.0              # throttle ≤1 request/sec to Wikidata
+VITAL_COLS        = ["date_of_birth", "date_of_death", "ORCID", "loc_id", "affiliation"]
 
-# ── SET UP SPARQL CLIENT ─────────────────────────────────────────────────
-url = "https://query.wikidata.org/sparql"
-user_agent = "MITResearchScript/1.0 (mm4958@mit.edu)" #A header for the user agent is required to query
-sparql = SPARQLWrapper(url, agent= user_agent) 
-sparql.setReturnFormat(JSON)
+# ── SPARQL CLIENT ────────────────────────────────────────────────────────
+# Queries go over the shared aiohttp session, whose User-Agent carries the
+# contact address Wikidata requires.
+SPARQL_HEADERS = {"Accept": "application/sparql-results+json"}
+# EntitySearch ignores case and spacing, so names differing only in those share one query
+name_flight = SingleFlight("wikidata_names")
 
 #Not enough dob are being retrieved, consider fuzzy matching
-#Add code to get death dates via SSDI
+#SSDI death dates are matched in bulk against a local index afterwards (ssdi.py)
 #Previously, a condition was included in the Sparql query that required the person to be affiliated with MIT. 
 #This resulted in a missing dob/dod for most researchers as the Wikibase doesn't include much info on affiliations
 #To circumvent this issue, I excluded the MIT condition. I'm not too concerned about this given that we already confirmed affiliations via OpenAlex.
 #However, one issue is that we might match to the wrong person. To avoid this, we will also ask for a search to return ORCID, Library of Congress ID, and Affiliations. We will then compare these details to confirm
 #it's the right person.
-def fetch_dates_from_wikidata(label: str):
+async def fetch_dates_from_wikidata(session, label: str):
+    return await name_flight.do(" ".join(label.split()).casefold(), _query_wikidata, session, label)
+
+async def _query_wikidata(session, label: str):
     query = f'''
         SELECT ?dob ?dod ?orcid ?loc_id ?affiliationLabel WHERE {{
         SERVICE wikibase:mwapi {{
@@ -62,9 +67,10 @@ def fetch_dates_from_wikidata(label: str):
         }}
         LIMIT 1
     '''
-    sparql.setQuery(query)
     try:
-        results = sparql.query().convert()
+        body = await get_bytes(session, WIKIDATA_SPARQL, service="wikidata", stage="vital_dates",
+                               params={"query": query, "format": "json"}, headers=SPARQL_HEADERS)
+        results = fastjson.loads(body)
         bindings = results["results"]["bindings"]
         if not bindings:
             return None, None, None, None, None
@@ -79,36 +85,59 @@ def fetch_dates_from_wikidata(label: str):
         print(f"⚠ SPARQL lookup error for '{label}': {e}")
         return None, None, None, None, None
 
-def main():
-    # 1) Read your existing CSV
-    df = pd.read_csv(INPUT_CSV, dtype=str)
-    df.columns = df.columns.str.strip()
-    if NAME_COL not in df.columns:
-        raise KeyError(f"Column '{NAME_COL}' not found in {INPUT_CSV}. Available columns: {df.columns.tolist()}")
-
-    # 2) Get unique names
-    unique_names = df[NAME_COL].dropna().unique().tolist()
+async def query_names(unique_names):
+    # all lookups are queued at once; Wikidata's AIMD controller (ratelimit.py)
+    # keeps at most 5 queries in flight and backs off on 429s
+    done = 0
+    async def lookup(name):
+        nonlocal done
+        dob, dod, orcid, loc_id, affiliation = await fetch_dates_from_wikidata(session, name)
+        done += 1
+        print(f"[{done}/{len(unique_names)}] '{name}' → dob={dob!r}, dod={dod!r}, ORCID={orcid!r}, loc_id={loc_id!r}, affiliation={affiliation!r}")
+        return {NAME_COL: name, "date_of_birth": dob, "date_of_death": dod, "ORCID": orcid, "loc_id": loc_id, "affiliation": affiliation}
+
+    async with client_session() as session:
+        return list(await asyncio.gather(*(lookup(name) for name in unique_names)))
+
+def fetch_vital_dates(names):
+    """Query Wikidata once per unique name; one lookup row per name."""
+    unique_names = pd.Series(names).dropna().unique().tolist()
     print(f"→ {len(unique_names)} unique researcher names to query on Wikidata.")
-    
-    # 3) Query Wikidata for each name
-    lookup = {}
-    for i, name in enumerate(unique_names, start=1):
-        print(f"[{i}/{len(unique_names)}] Querying '{name}' …", end="", flush=True)
-        dob, dod, orcid, loc_id, affiliation = fetch_dates_from_wikidata(name)
-        lookup[name] = {"date_of_birth": dob, "date_of_death": dod, "ORCID": orcid, "loc_id": loc_id, "affiliation": affiliation}
-        print(f"  → dob={dob!r}, dod={dod!r}, ORCID={orcid!r}, loc_id={loc_id!r}, affiliation={affiliation!r} ")
-        time.sleep(REQUEST_DELAY_SEC)
-
-    # 4) Map results back into the DataFrame
-    df["date_of_birth"] = df[NAME_COL].map(lambda n: lookup.get(n, {}).get("date_of_birth"))
-    df["date_of_death" ] = df[NAME_COL].map(lambda n: lookup.get(n, {}).get("date_of_death"))
-    df["ORCID" ] = df[NAME_COL].map(lambda n: lookup.get(n, {}).get("ORCID"))
-    df["loc_id" ] = df[NAME_COL].map(lambda n: lookup.get(n, {}).get("loc_id"))
-    df["affiliation" ] = df[NAME_COL].map(lambda n: lookup.get(n, {}).get("affiliation"))
-
-    # 5) Save enriched CSV
-    df.to_csv(OUTPUT_CSV, index=False)
-    print(f"\n✓ Done! Wrote {len(df)} rows with birth/death dates to '{OUTPUT_CSV}'.")
+    rows = asyncio.run(query_names(unique_names))
+    return pd.DataFrame(rows, columns=[NAME_COL, *VITAL_COLS])
+
+def attach_vital_dates(df, lookup):
+    """Map the per-name lookup (Wikidata, plus ssdi.py's columns if filled) back onto every panel row."""
+    df = df.copy()
+    by_name = lookup.set_index(NAME_COL)
+    for col in by_name.columns:
+        df[col] = df[NAME_COL].map(by_name[col])
+    return df
+
+def main():
+    for slug in selected_slugs():
+        input_csv  = result_path(slug, "hospital")
+        output_csv = result_path(slug, "vital")
+
+        # 1) Read your existing CSV
+        try:
+            df = pd.read_csv(input_csv, dtype=str)
+        except FileNotFoundError:
+            print(f"⚠ Skipping {slug.upper()}: {input_csv} not found.")
+            continue
+        df.columns = df.columns.str.strip()
+        if NAME_COL not in df.columns:
+            raise KeyError(f"Column '{NAME_COL}' not found in {input_csv}. Available columns: {df.columns.tolist()}")
+
+        # 2) Query Wikidata for each unique name
+        lookup = fetch_vital_dates(df[NAME_COL])
+
+        # 3) Map results back into the DataFrame
+        df = attach_vital_dates(df, lookup)
+
+        # 4) Save enriched CSV
+        df.to_csv(output_csv, index=False)
+        print(f"\n✓ Done! Wrote {len(df)} rows with birth/death dates to '{output_csv}'.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,174 @@
+#This file tags each institution (and span) with whether it sits in a college town and how far the
+#nearest college town is. College towns come from misc/college_towns.xlsx (ranked universities plus
+#state schools); their zip codes are geocoded once via Nominatim (through the shared HTTP client and
+#its 1 req/sec limiter) and cached with the table.
+#A listed zip only counts as a college town when its town is known to be small: a local population of
+#at most MAX_TOWN_POPULATION. The ranked sheet gives the population of each school's town (its HSA
+#City); state schools carry none, so they take the population of a ranked school in the same town and
+#state, and a town whose population stays unknown is not tagged. Big metros (New York, Chicago,
+#Boston, ...) host universities but are not towns defined by them, so they never tag.
+import asyncio
+import pandas as pd
+import numpy as np
+from pathlib import Path
+from sklearn.neighbors import BallTree
+import fastjson
+from endpoints import NOMINATIM_URL
+from http_client import client_session, get_bytes
+from institutions import RESULTS_DIR, result_path, selected_slugs
+from ratelimit import nominatim_limiter
+
+# ── CONFIG ────────────────────────────────────────────────────────────────
+COLLEGE_TOWNS_XLSX = Path(__file__).parent / "misc" / "college_towns.xlsx"  # works from any cwd
+TOWNS_PARQUET      = RESULTS_DIR / "college_towns.parquet"
+EARTH_RADIUS_KM    = 6371.0
+COLLEGE_TOWN_RADIUS_KM = 10.0  # an institution this close to a college-town zip is "in" it
+MAX_TOWN_POPULATION    = 200_000  # above this a listed city is a metro (Birmingham, Richmond), not a college town
+
+# the ranked sheet abbreviates states, the state-school sheet spells them out (sometimes misspelt)
+STATE_ABBREVIATIONS = {
+    "alabama": "AL", "alaska": "AK", "arizona": "AZ", "arkansas": "AR", "california": "CA",
+    "colorado": "CO", "colorodo": "CO", "connecticut": "CT", "delaware": "DE",
+    "district of columbia": "DC", "florida": "FL", "georgia": "GA", "goergia": "GA", "hawaii": "HI",
+    "idaho": "ID", "illinois": "IL", "indiana": "IN", "iowa": "IA", "kansas": "KS", "kentucky": "KY",
+    "louisiana": "LA", "maine": "ME", "maryland": "MD", "massachusetts": "MA", "michigan": "MI",
+    "minnesota": "MN", "mississippi": "MS", "missouri": "MO", "montana": "MT", "nebraska": "NE",
+    "nevada": "NV", "new hampshire": "NH", "new jersey": "NJ", "new mexico": "NM", "new york": "NY",
+    "north carolina": "NC", "north dakota": "ND", "ohio": "OH", "oklahoma": "OK", "oregon": "OR",
+    "pennsylvania": "PA", "rhode island": "RI", "south carolina": "SC", "south dakota": "SD",
+    "tennessee": "TN", "texas": "TX", "utah": "UT", "vermont": "VT", "virginia": "VA",
+    "washington": "WA", "west virginia": "WV", "wisconsin": "WI", "wyoming": "WY",
+}
+
+# ── LOAD COLLEGE TOWNS ONCE ─────────────────────────────────────────────────
+def read_college_towns(xlsx_path):
+    """Collapse the ranked and state-school sheets into one row per college-town zip."""
+    sheets = pd.read_excel(xlsx_path, sheet_name=["Teaching Hospital Definition 1", "State Schools"])
+    ranked = sheets["Teaching Hospital Definition 1"].rename(columns={
+        "University Name":     "university",
+        "University Zip Code": "zip",
+        "HSA City":            "city",
+        "HSA State":           "state",
+        "Local Population":    "local_population",
+    })
+    state = sheets["State Schools"].rename(columns={
+        "School Name": "university",
+        "Zipcode":     "zip",
+        "City":        "city",
+        "State":       "state",
+    })
+    # HSA City is the town the ranked sheet's Local Population describes, the same key as City here
+    cols = ["university", "zip", "city", "state", "local_population"]
+    towns = pd.concat([ranked.reindex(columns=cols), state.reindex(columns=cols)], ignore_index=True)
+    towns = towns.dropna(subset=["zip"])
+    towns["zip"] = towns["zip"].astype(int).astype(str).str.zfill(5)
+    towns["local_population"] = pd.to_numeric(towns["local_population"], errors="coerce")
+    towns["state"] = normalise_states(towns["state"])
+    return towns.drop_duplicates("zip").reset_index(drop=True)
+
+def normalise_states(states):
+    """Two-letter abbreviations for either spelling of a state."""
+    s = states.astype("string").str.strip()
+    return s.str.lower().map(STATE_ABBREVIATIONS).fillna(s.str.upper())
+
+async def geocode_zip(session, zip_code):
+    """Nominatim postal-code lookup; (lat, lon), or NaNs when it fails or finds nothing."""
+    try:
+        body = await get_bytes(session, NOMINATIM_URL, service="nominatim", stage="college_towns", params={
+            "postalcode":   zip_code,
+            "countrycodes": "us",
+            "format":       "json",
+            "limit":        1
+        }, limiter=nominatim_limiter())
+        res = fastjson.loads(body)
+        if res:
+            return float(res[0]["lat"]), float(res[0]["lon"])
+    except Exception as e:
+        print(f"    → Error geocoding {zip_code}: {e}")
+    return np.nan, np.nan
+
+async def geocode_zips(zip_codes):
+    """Coordinates for each zip, one at a time as Nominatim asks."""
+    coords = []
+    async with client_session() as session:
+        for i, zip_code in enumerate(zip_codes, start=1):
+            coords.append(await geocode_zip(session, zip_code))
+            if i % 50 == 0 or i == len(zip_codes):
+                print(f"[Zip {i}/{len(zip_codes)}]")
+    return coords
+
+def load_college_towns():
+    """Compact college-town table with coordinates, built once and reused from Parquet."""
+    if TOWNS_PARQUET.exists():
+        return pd.read_parquet(TOWNS_PARQUET)
+
+    towns = read_college_towns(COLLEGE_TOWNS_XLSX)
+    print(f"Geocoding {len(towns)} college-town zip codes via Nominatim...")
+    coords = asyncio.run(geocode_zips(list(towns["zip"])))
+    towns["latitude"], towns["longitude"] = zip(*coords)
+    towns = towns.dropna(subset=["latitude", "longitude"]).reset_index(drop=True)
+    towns.to_parquet(TOWNS_PARQUET, index=False)
+    return towns
+
+def college_town_mask(towns):
+    """True for listed zips in towns known to be small enough to be college towns (see header)."""
+    town = pd.MultiIndex.from_arrays([towns["city"].astype("string").str.strip().str.lower(),
+                                      normalise_states(towns["state"])])
+    known = towns["local_population"].notna().to_numpy()
+    town_pop = pd.Series(towns["local_population"].to_numpy()[known], index=town[known]).groupby(level=[0, 1]).max()
+    pop = towns["local_population"].fillna(pd.Series(town_pop.reindex(town).to_numpy(), index=towns.index))
+    return pop.le(MAX_TOWN_POPULATION).fillna(False).astype(bool)
+
+# ── VECTORIZED NEAREST COLLEGE TOWN ─────────────────────────────────────────
+def tag_institutions(inst, towns):
+    """One BallTree query over the qualifying college towns for every institution with coordinates."""
+    towns = towns[college_town_mask(towns)].reset_index(drop=True)
+    tree = BallTree(np.deg2rad(towns[["latitude", "longitude"]].values), metric="haversine")
+    out = inst[["institution_id"]].copy()
+    out["college_town"] = pd.Series(pd.NA, index=out.index, dtype="string")
+    out["college_town_zip"] = pd.Series(pd.NA, index=out.index, dtype="string")
+    out["college_town_dist_km"] = np.nan
+
+    has_geo = inst["institution_lat"].notna() & inst["institution_lon"].notna()
+    if has_geo.any():
+        coords = np.deg2rad(inst.loc[has_geo, ["institution_lat", "institution_lon"]].astype(float).values)
+        dist_rad, idx = tree.query(coords, k=1)
+        nearest = towns.iloc[idx[:, 0]]
+        out.loc[has_geo, "college_town"]         = nearest["university"].values
+        out.loc[has_geo, "college_town_zip"]     = nearest["zip"].values
+        out.loc[has_geo, "college_town_dist_km"] = dist_rad[:, 0] * EARTH_RADIUS_KM
+    out["in_college_town"] = out["college_town_dist_km"] <= COLLEGE_TOWN_RADIUS_KM
+    return out
+
+def tag_panel(spans, towns):
+    """Institution-level tags plus the same tags joined onto every span."""
+    inst = spans.drop_duplicates("institution_id")[["institution_id", "institution_lat", "institution_lon"]]
+    inst = inst.astype({"institution_lat": float, "institution_lon": float})
+    tagged = tag_institutions(inst, towns)
+    span_tags = spans[["author_id", "institution_id", "year_start", "year_end"]].merge(
+        tagged, on="institution_id", how="left")
+    return tagged, span_tags
+
+def write_tags(slug, tagged, span_tags):
+    """Publish one school's institution and span tags to results/."""
+    tagged.to_parquet(result_path(slug, "inst_college_towns"), index=False)
+    print(f"✓ Tagged {len(tagged)} institutions ({int(tagged['in_college_town'].sum())} in college towns)")
+    span_tags.to_parquet(result_path(slug, "span_college_towns"), index=False)
+    print(f"✓ Tagged {len(span_tags)} spans")
+    return tagged
+
+def main():
+    towns = load_college_towns()
+    print(f"Loaded {len(towns)} listed zips ({int(college_town_mask(towns).sum())} qualify as college towns)")
+
+    for slug in selected_slugs():
+        input_csv = result_path(slug, "hospital")
+        try:
+            spans = pd.read_csv(input_csv, dtype=str)
+        except FileNotFoundError:
+            print(f"⚠ Skipping {slug.upper()}: {input_csv} not found.")
+            continue
+        write_tags(slug, *tag_panel(spans, towns))
+
+if __name__ == "__main__":
+    main()
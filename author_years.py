@@ -0,0 +1,178 @@
+#Streams the author×year panel the avoidable-healthcare analysis uses. Span rows are read in chunks
+#from the span-level panel ({prefix}_with_nearest_hospital_v5.csv) and expanded into one row per author,
+#institution and year. Each row gets the hospital nearest to the institution that was operating in that
+#year, plus birth/death years and whether the author was alive. Chunks go straight into a Parquet
+#dataset partitioned by school, so the full panel is never held in memory.
+#
+#   python author_years.py mit ou                   # writes results/author_year_panel/school=mit/...
+#   pd.read_parquet(AUTHOR_YEAR_DIR, filters=[("school", "==", "mit"), ("year", ">=", 1990)])
+import argparse
+import importlib
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from institutions import RESULTS_DIR, result_path, selected_slugs
+
+hosp_mod = importlib.import_module("4_get_hosp")
+
+# ── CONFIG ───────────────────────────────────────────────────────────────────
+AUTHOR_YEAR_DIR    = RESULTS_DIR / "author_year_panel"
+YEAR_MIN, YEAR_MAX = 1955, 2025
+CHUNK_SPANS        = 50_000     # span rows expanded per batch
+MAX_ROWS_PER_FILE  = 5_000_000
+ROWS_PER_GROUP     = 1_000_000
+
+SCHEMA = pa.schema([
+    ("author_id",        pa.string()),
+    ("name",             pa.string()),
+    ("year",             pa.int16()),
+    ("institution_id",   pa.string()),
+    ("institution_name", pa.string()),
+    ("stint_start",      pa.int16()),
+    ("stint_end",        pa.int16()),
+    ("institution_lat",  pa.float64()),
+    ("institution_lon",  pa.float64()),
+    ("closest_hospital", pa.string()),
+    ("distance_km",      pa.float64()),
+    ("birth_year",       pa.int16()),
+    ("death_year",       pa.int16()),
+    ("alive",            pa.bool_()),
+    ("school",           pa.string()),
+])
+
+# ── HOSPITAL BY YEAR ─────────────────────────────────────────────────────────
+def hospital_periods(inst_coords, hosp):
+    """Nearest operating hospital per (institution, operating period), and the period edges.
+
+    Operating hospitals only change at open/close years, so each institution
+    is queried once per period rather than once per year.
+    """
+    edges, trees = hosp_mod.build_period_trees(hosp)
+    ends = np.append(edges[1:], np.inf)
+    periods = np.flatnonzero((edges <= YEAR_MAX) & (ends > YEAR_MIN))
+    starts = np.maximum(edges[periods], YEAR_MIN)  # the first edge is -inf
+    grid = pd.DataFrame({
+        "institution_id": np.repeat(inst_coords["institution_id"].values, len(periods)),
+        "period":         np.tile(periods, len(inst_coords)),
+    })
+    grid["year_start"] = grid["year_end"] = np.tile(starts, len(inst_coords))
+    coords = {iid: (lat, lon) for iid, lat, lon in inst_coords.itertuples(index=False)}
+    nearest = hosp_mod.nearest_operating_hospital(grid, coords, hosp, edges, trees)
+    grid["closest_hospital"] = nearest["closest_hospital"].replace("", None).values
+    grid["distance_km"] = pd.to_numeric(nearest["distance_km"], errors="coerce").values
+    return grid[["institution_id", "period", "closest_hospital", "distance_km"]], edges
+
+def institution_coords(panel):
+    """Unique institution coordinates of the span panel."""
+    inst = panel[["institution_id", "institution_lat", "institution_lon"]].copy()
+    inst["institution_lat"] = pd.to_numeric(inst["institution_lat"], errors="coerce")
+    inst["institution_lon"] = pd.to_numeric(inst["institution_lon"], errors="coerce")
+    return inst.dropna().drop_duplicates("institution_id").reset_index(drop=True)
+
+# ── EXPANSION ────────────────────────────────────────────────────────────────
+def _year_of(dates):
+    return pd.to_numeric(dates.astype("string").str.extract(r"^(-?\d{1,4})", expand=False), errors="coerce")
+
+def expand_spans(spans, by_period, edges, school):
+    """Author-year rows for one chunk of span-panel rows, with hospital and vital attributes.
+
+    Only the years inside [YEAR_MIN, YEAR_MAX] are expanded; spans wholly
+    outside give no rows. stint_start/stint_end keep the span's own bounds.
+    """
+    stint_start = pd.to_numeric(spans["year_start"], errors="coerce")
+    stint_end   = pd.to_numeric(spans["year_end"], errors="coerce")
+    start = stint_start.clip(lower=YEAR_MIN)
+    end   = stint_end.clip(upper=YEAR_MAX)
+    counts = (end - start + 1).fillna(0).clip(lower=0).astype(int).to_numpy()
+    rows = np.repeat(np.arange(len(spans)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    text = lambda col: spans[col].to_numpy()[rows]
+    real = lambda values: pd.to_numeric(values, errors="coerce").to_numpy(float)[rows]
+    year = lambda values: pd.array(real(values), dtype="Int16")
+    out = pd.DataFrame({
+        "author_id":        text("author_id"),
+        "name":             text("name"),
+        "year":             (start.to_numpy()[rows] + offsets).astype("int16"),
+        "institution_id":   text("institution_id"),
+        "institution_name": text("institution_name"),
+        "stint_start":      year(stint_start),
+        "stint_end":        year(stint_end),
+        "institution_lat":  real(spans["institution_lat"]),
+        "institution_lon":  real(spans["institution_lon"]),
+        "birth_year":       year(_year_of(spans["date_of_birth"])),
+        "death_year":       year(_year_of(spans["date_of_death"])),
+    })
+
+    # hospital operating in that year
+    out["period"] = np.searchsorted(edges, out["year"].to_numpy(), "right") - 1
+    out = out.merge(by_period, on=["institution_id", "period"], how="left").drop(columns="period")
+
+    born = out["birth_year"]
+    alive = (out["year"] >= born) & (out["death_year"].isna() | (out["year"] <= out["death_year"]))
+    out["alive"] = alive.astype("boolean").mask(born.isna())
+    out["school"] = school
+    return out[SCHEMA.names]
+
+def author_year_batches(span_chunks, by_period, edges, school):
+    """Arrow record batches of the author-year panel, one per chunk of span rows."""
+    for spans in span_chunks:
+        panel = expand_spans(spans, by_period, edges, school)
+        if len(panel):
+            yield pa.RecordBatch.from_pandas(panel, schema=SCHEMA, preserve_index=False)
+
+def write_author_years(slug, panel, hosp, chunksize=CHUNK_SPANS):
+    """Stream one school's author-year panel into its partition of AUTHOR_YEAR_DIR.
+
+    `panel` is the span-level panel, either a DataFrame or the path of its
+    CSV, which is then read chunk by chunk as well.
+    """
+    if isinstance(panel, pd.DataFrame):
+        inst = institution_coords(panel)
+        span_chunks = (panel.iloc[i:i + chunksize] for i in range(0, len(panel), chunksize))
+    else:
+        inst = institution_coords(pd.read_csv(panel, usecols=["institution_id", "institution_lat", "institution_lon"], dtype=str))
+        span_chunks = pd.read_csv(panel, dtype=str, chunksize=chunksize)
+    by_period, edges = hospital_periods(inst, hosp)
+    rows = 0
+    def counted(batches):
+        nonlocal rows
+        for batch in batches:
+            rows += batch.num_rows
+            yield batch
+
+    ds.write_dataset(
+        counted(author_year_batches(span_chunks, by_period, edges, slug)),
+        AUTHOR_YEAR_DIR,
+        schema=SCHEMA,
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema([("school", pa.string())]), flavor="hive"),
+        existing_data_behavior="delete_matching",  # replaces this school's partition only
+        max_rows_per_file=MAX_ROWS_PER_FILE,
+        max_rows_per_group=ROWS_PER_GROUP,
+    )
+    print(f"✓ Wrote {rows} {slug.upper()} author-years → {AUTHOR_YEAR_DIR.name}/school={slug}")
+    return pd.DataFrame({"school": [slug], "rows": [rows]})
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream the author×year panel to partitioned Parquet.")
+    parser.add_argument("slugs", nargs="*", help="institution slugs (default: all registered)")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SPANS, help="span rows expanded per batch")
+    args = parser.parse_args()
+
+    hosp = hosp_mod.load_hospitals()
+    for slug in selected_slugs(args.slugs):
+        panel_csv = result_path(slug, "vital")
+        if not panel_csv.exists():
+            print(f"⚠ Skipping {slug.upper()}: {panel_csv} not found.")
+            continue
+        start = time.time()
+        write_author_years(slug, panel_csv, hosp, args.chunksize)
+        print(f"  done in {time.time() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#Decode-time benchmark for OpenAlex works pages. Builds a page from bench/fixtures/openalex_work.json
+#and times the stdlib decoder against fastjson (plain dicts and typed structs), reporting ms per page
+#and the memory each decoded page keeps alive.
+#
+#   python bench/decode_bench.py --per-page 200 --repeat 200
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import fastjson
+import mock_server
+
+def build_page(per_page):
+    work = mock_server.load_fixture("openalex_work.json")
+    results = []
+    for i in range(per_page):
+        w = json.loads(json.dumps(work))
+        w["id"] = f"https://openalex.org/W{4000000000 + i}"
+        results.append(w)
+    return json.dumps({"meta": {"count": per_page, "next_cursor": None, "per_page": per_page}, "results": results}).encode()
+
+def time_decoder(fn, body, repeat):
+    fn(body)  # warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(body)
+    per_page_ms = (time.perf_counter() - start) / repeat * 1000
+
+    tracemalloc.start()
+    kept = fn(body)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return per_page_ms, retained / 1024
+
+def main():
+    parser = argparse.ArgumentParser(description="Time OpenAlex works-page decoding.")
+    parser.add_argument("--per-page", type=int, default=200, help="works per page (OpenAlex max 200)")
+    parser.add_argument("--repeat", type=int, default=200, help="pages decoded per decoder")
+    args = parser.parse_args()
+
+    body = build_page(args.per_page)
+    decoders = [
+        ("stdlib json.loads", json.loads),
+        (f"fastjson.loads ({fastjson.BACKEND})", fastjson.loads),
+        (f"decode_works_page ({fastjson.STRUCT_BACKEND})", fastjson.decode_works_page),
+    ]
+    print(f"Page: {args.per_page} works, {len(body) / 1024:.0f} KB, {args.repeat} repeats")
+    baseline = None
+    for name, fn in decoders:
+        ms, kb = time_decoder(fn, body, args.repeat)
+        baseline = baseline or ms
+        print(f"  {name:<34} {ms:>8.2f} ms/page  {baseline / ms:>5.1f}x  {kb:>8.0f} KB kept")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+#Local stand-in for the OpenAlex and Wikidata APIs. Replays the recorded responses in bench/fixtures,
+#rewritten so ids, years and page counts follow the request, with configurable latency and 429s.
+#
+#   python bench/mock_server.py --port 8765 --latency-ms 80 --p429 0.02 --pages 5
+#
+#Point the scripts at it with OPENALEX_API=http://127.0.0.1:8765 WIKIDATA_SPARQL=http://127.0.0.1:8765/sparql.
+#GET /_stats returns request and 429 counts per route.
+import argparse
+import asyncio
+import bisect
+import copy
+import json
+import random
+import zlib
+from collections import Counter
+from pathlib import Path
+
+from aiohttp import web
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+def load_fixture(name):
+    return json.loads((FIXTURES / name).read_text())
+
+class MockAPI:
+    def __init__(self, latency_ms=50, jitter_ms=20, p429=0.0, pages=3, author_pool=500,
+                 max_works_per_author=60, home_inst="I63966007", seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.p429 = p429
+        self.pages = pages
+        self.author_pool = author_pool
+        self.max_works_per_author = max_works_per_author
+        self.home_inst = home_inst
+        self.rng = random.Random(seed)
+        self.stats = Counter()
+        self.work = load_fixture("openalex_work.json")
+        self.author = load_fixture("openalex_author.json")
+        self.institution = load_fixture("openalex_institution.json")
+        self.sparql = load_fixture("wikidata_sparql.json")
+
+    # ── shaping ─────────────────────────────────────────────────────────────
+    async def delay_or_429(self, route):
+        self.stats[f"{route}.requests"] += 1
+        await asyncio.sleep(max(0.0, self.latency_ms + self.rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000)
+        if self.rng.random() < self.p429:
+            self.stats[f"{route}.429"] += 1
+            return web.json_response({"error": "Too Many Requests"}, status=429)
+        return None
+
+    def works_count(self, author_id):
+        """Stable per-author works count, so profiles and works queries agree."""
+        return zlib.crc32(author_id.encode()) % self.max_works_per_author + 1
+
+    def make_work(self, n, year, inst_id=None, author_id=None):
+        work = copy.deepcopy(self.work)
+        work["id"] = f"https://openalex.org/W{9000000000 + n}"
+        work["publication_year"] = year
+        for i, auth in enumerate(work["authorships"]):
+            aid = author_id if (author_id and i == 0) else f"A{5000000000 + self.rng.randrange(self.author_pool)}"
+            auth["author"]["id"] = f"https://openalex.org/{aid}"
+            auth["author"]["display_name"] = f"Author {aid}"
+            if inst_id:
+                auth["institutions"][0]["id"] = f"https://openalex.org/{inst_id}"
+        return work
+
+    # ── routes ──────────────────────────────────────────────────────────────
+    async def works(self, request):
+        if (resp := await self.delay_or_429("works")) is not None:
+            return resp
+        filters = dict(f.split(":", 1) for f in request.query.get("filter", "").split(",") if ":" in f)
+        per_page = int(request.query.get("per_page", 25))
+
+        if "institutions.id" in filters and request.query.get("group_by") == "publication_year":
+            # count query: spread one year chunk's worth of pages (script 1 uses 100/page, 10 years/chunk)
+            y0, y1 = (int(y) for y in filters.get("publication_year", "2000-2000").split("-"))
+            groups = [{"key": str(y), "key_display_name": str(y), "count": self.pages * 10} for y in range(y0, y1 + 1)]
+            return web.json_response({"meta": {"count": sum(g["count"] for g in groups), "groups_count": len(groups)},
+                                      "results": [], "group_by": groups})
+
+        if "institutions.id" in filters:
+            # cursor paging over a year range
+            cursor = request.query.get("cursor", "*")
+            page = 0 if cursor == "*" else int(cursor)
+            y0, y1 = (int(y) for y in filters.get("publication_year", "2000-2000").split("-"))
+            results = [self.make_work(page * per_page + i, self.rng.randint(y0, y1), inst_id=filters["institutions.id"])
+                       for i in range(per_page)]
+            next_cursor = str(page + 1) if page + 1 < self.pages else None
+            return web.json_response({"meta": {"count": self.pages * per_page, "next_cursor": next_cursor},
+                                      "results": results})
+
+        # one (or several, pipe-joined) authors' works, by page or by cursor
+        author_ids = filters.get("authorships.author.id", "A0").split("|")
+        ends, total = [], 0
+        for aid in author_ids:
+            total += self.works_count(aid)
+            ends.append(total)
+        cursor = request.query.get("cursor")
+        page = (1 if cursor == "*" else int(cursor)) if cursor else int(request.query.get("page", 1))
+        first = (page - 1) * per_page
+        results = [self.make_work(n, self.rng.randint(1960, 2025), author_id=author_ids[bisect.bisect_right(ends, n)])
+                   for n in range(first, min(first + per_page, total))]
+        meta = {"count": total, "page": page}
+        if cursor:
+            meta["next_cursor"] = str(page + 1) if first + per_page < total else None
+        return web.json_response({"meta": meta, "results": results})
+
+    async def author_profile(self, request):
+        if (resp := await self.delay_or_429("authors")) is not None:
+            return resp
+        profile = copy.deepcopy(self.author)
+        profile["id"] = f"https://openalex.org/{request.match_info['oid']}"
+        profile["works_count"] = self.works_count(request.match_info["oid"])
+        # every replayed author also lists the school being benchmarked, so script 2 keeps them
+        profile["affiliations"].append({
+            "institution": {"id": f"https://openalex.org/{self.home_inst}", "display_name": "Benchmark School"},
+            "years": sorted(self.rng.sample(range(1970, 2025), 4), reverse=True),
+        })
+        return web.json_response(profile)
+
+    async def authors_list(self, request):
+        """Count queries only: every pool author counts as affiliated, with a few institutions each."""
+        if (resp := await self.delay_or_429("authors")) is not None:
+            return resp
+        return web.json_response({"meta": {"count": self.author_pool, "groups_count": self.author_pool * 3},
+                                  "results": [], "group_by": []})
+
+    async def institution_profile(self, request):
+        if (resp := await self.delay_or_429("institutions")) is not None:
+            return resp
+        inst = copy.deepcopy(self.institution)
+        inst["id"] = f"https://openalex.org/{request.match_info['iid']}"
+        return web.json_response(inst)
+
+    async def sparql_query(self, request):
+        if (resp := await self.delay_or_429("sparql")) is not None:
+            return resp
+        return web.json_response(self.sparql, content_type="application/sparql-results+json")
+
+    async def stats_view(self, request):
+        return web.json_response(dict(self.stats))
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/works", self.works)
+        app.router.add_get("/authors", self.authors_list)
+        app.router.add_get("/authors/{oid}", self.author_profile)
+        app.router.add_get("/institutions/{iid}", self.institution_profile)
+        app.router.add_route("*", "/sparql", self.sparql_query)
+        app.router.add_get("/_stats", self.stats_view)
+        return app
+
+def add_server_args(parser):
+    parser.add_argument("--latency-ms", type=float, default=50, help="mean response latency")
+    parser.add_argument("--jitter-ms", type=float, default=20, help="uniform latency jitter")
+    parser.add_argument("--p429", type=float, default=0.0, help="probability of answering 429")
+    parser.add_argument("--pages", type=int, default=3, help="cursor pages per institution year chunk")
+    parser.add_argument("--max-works", type=int, default=60, help="works per author are drawn from 1..max-works")
+    parser.add_argument("--author-pool", type=int, default=500, help="distinct author ids in generated works")
+    parser.add_argument("--home-inst", default="I63966007", help="institution id added to every author profile")
+    parser.add_argument("--seed", type=int, default=0)
+
+def mock_from_args(args):
+    return MockAPI(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, p429=args.p429,
+                   pages=args.pages, author_pool=args.author_pool, max_works_per_author=args.max_works, home_inst=args.home_inst, seed=args.seed)
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAlex/Wikidata server for offline benchmarks.")
+    parser.add_argument("--port", type=int, default=8765)
+    add_server_args(parser)
+    args = parser.parse_args()
+    web.run_app(mock_from_args(args).app(), host="127.0.0.1", port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#Offline throughput benchmark. Starts bench/mock_server.py in a separate process, points the fetchers
+#at it, and runs stages 1-3 and 5 on a small slice of authors, reporting requests/sec, wall time,
+#peak RSS and how many 429s (retries) each stage absorbed.
+#
+#   python bench/run_bench.py --authors 200 --latency-ms 80 --p429 0.02 --rps 50
+#   python bench/run_bench.py --json bench_output.txt   # keep the numbers for comparison
+import argparse
+import asyncio
+import importlib
+import json
+import multiprocessing as mp
+import os
+import resource
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import mock_server
+
+def serve(args, port):
+    from aiohttp import web
+    web.run_app(mock_server.mock_from_args(args).app(), host="127.0.0.1", port=port, print=None)
+
+def wait_for_server(base, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            return fetch_stats(base)
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"mock server did not come up at {base}")
+
+def fetch_stats(base):
+    with urllib.request.urlopen(f"{base}/_stats") as resp:
+        return json.load(resp)
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+
+def run_stage(name, route, base, fn):
+    before = fetch_stats(base)
+    start = time.time()
+    out = fn()
+    wall = time.time() - start
+    after = fetch_stats(base)
+    requests = after.get(f"{route}.requests", 0) - before.get(f"{route}.requests", 0)
+    retries  = after.get(f"{route}.429", 0) - before.get(f"{route}.429", 0)
+    row = {
+        "stage":        name,
+        "rows":         len(out),
+        "requests":     requests,
+        "wall_s":       round(wall, 3),
+        "req_per_s":    round(requests / wall, 2) if wall > 0 else 0.0,
+        "retries_429":  retries,
+        "peak_rss_mb":  round(peak_rss_mb(), 1),
+    }
+    print(f"  {name:<13} {row['rows']:>7} rows  {requests:>6} req  {wall:>8.2f}s  "
+          f"{row['req_per_s']:>8.2f} req/s  {retries:>4} 429s  {row['peak_rss_mb']:>7.1f} MB")
+    return row, out
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the fetchers against a local mock API.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--authors", type=int, default=100, help="authors carried into stages 2, 3 and 5")
+    parser.add_argument("--rps", type=float, default=None, help="override the OpenAlex rate limit (default: production)")
+    parser.add_argument("--crawl-works", action="store_true", help="build spans from the works crawl instead of profile affiliation years")
+    parser.add_argument("--json", help="also write the results as JSON to this path")
+    mock_server.add_server_args(parser)
+    args = parser.parse_args()
+
+    base = f"http://127.0.0.1:{args.port}"
+    os.environ["OPENALEX_API"] = base
+    os.environ["WIKIDATA_SPARQL"] = f"{base}/sparql"
+
+    server = mp.Process(target=serve, args=(args, args.port), daemon=True)
+    server.start()
+    try:
+        wait_for_server(base)
+
+        # import only now, so endpoints.py picks up the mock URLs
+        import institutions
+        import ratelimit
+        institutions.RESULTS_DIR = Path(tempfile.mkdtemp(prefix="bench_results_"))
+        if args.rps:
+            ratelimit.install(ratelimit.SharedRateLimiter(args.rps))
+        affiliations_mod = importlib.import_module("1_allschoolaffiliations")
+        profiles_mod     = importlib.import_module("2_checkaffiliations")
+        spans_mod        = importlib.import_module("3_eachschoolyears")
+        vital_mod        = importlib.import_module("5_get_years")
+
+        slug = "mit"
+        print(f"Benchmarking against {base} (latency {args.latency_ms}ms, p429 {args.p429}, {args.pages} pages/chunk)")
+        results = []
+        row, aff = run_stage("affiliations", "works", base, lambda: asyncio.run(
+            affiliations_mod.harvest_institution(institutions.INSTITUTIONS[slug]["oa_id"])))
+        results.append(row)
+        aff = aff[aff.author_id.isin(aff.author_id.drop_duplicates().head(args.authors))].astype(str)
+        years = {}
+        def enrich():
+            profiles, years["df"] = asyncio.run(profiles_mod.enrich_institution(aff, slug))
+            return profiles
+        row, profiles = run_stage("profiles", "authors", base, enrich)
+        results.append(row)
+        row, spans = run_stage("spans", "works", base, lambda: spans_mod.build_spans(
+            profiles, affiliation_years=None if args.crawl_works else years["df"]))
+        results.append(row)
+        row, _ = run_stage("vital_dates", "sparql", base, lambda: vital_mod.fetch_vital_dates(
+            spans[vital_mod.NAME_COL].drop_duplicates().head(args.authors)))
+        results.append(row)
+    finally:
+        server.terminate()
+        server.join()
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({"config": vars(args), "stages": results}, indent=2))
+        print(f"✓ Wrote results to {args.json}")
+
+if __name__ == "__main__":
+    main()
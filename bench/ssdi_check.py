@@ -0,0 +1,50 @@
+#Match check for ssdi.py against bench/fixtures/ssdi_sample.csv. Builds a throwaway index from the
+#fixture, matches a handful of researchers (apostrophe and hyphenated surnames, initial-only names,
+#ambiguous namesakes) and compares the filled death dates with the expected ones. Exits 1 on a mismatch.
+#
+#   python bench/ssdi_check.py
+import sys
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
+
+import ssdi
+
+FIXTURE = Path(__file__).resolve().parent / "fixtures" / "ssdi_sample.csv"
+
+# name, first affiliation year, last affiliation year, expected SSDI death date (None: must not match)
+CASES = [
+    ("Mary O'Brien",        1965, 2004, "2005-05-05"),
+    ("Mary T. O’Brien",     1965, 2004, "2005-05-05"),
+    ("Jose Garcia-Lopez",   1980, 2007, "2008-09-19"),
+    ("Jose A Garcia-Lopez", 1980, 2007, "2008-09-19"),
+    ("Ada M. Lovelace",     1950, 2000, "2009-03"),
+    ("Kenji Nakamura",      1975, 2009, "2010-07-07"),
+    ("B. Abi",              1990, 2012, None),   # Brian or Bruce: a tie is left blank
+    ("Dana Scott",          1995, 2011, None),   # two Dana Scotts in overlapping windows
+]
+
+def main():
+    spans = pd.DataFrame([(n, str(a), str(b)) for n, a, b, _ in CASES], columns=[ssdi.NAME_COL, "year_start", "year_end"])
+    lookup = pd.DataFrame({ssdi.NAME_COL: spans[ssdi.NAME_COL], "date_of_birth": None, "date_of_death": None})
+    with tempfile.TemporaryDirectory() as tmp:
+        index_dir = Path(tmp) / "ssdi_index"
+        ssdi.build_index(FIXTURE, index_dir)
+        filled = ssdi.fill_death_dates(spans, lookup, index_dir).set_index(ssdi.NAME_COL)
+
+    failed = 0
+    for name, _, _, expected in CASES:
+        got = filled.at[name, "date_of_death"]
+        got = None if pd.isna(got) else got
+        ok = got == expected
+        failed += not ok
+        print(f"  {'✓' if ok else '❌'} {name:<22} expected {expected}, got {got}")
+    print(f"{len(CASES) - failed}/{len(CASES)} cases match")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#Persistent dead-letter store for lookups that failed, kept across runs in SQLite. Each entry remembers
+#the input row, the error class/status and how many times it has failed, so a later `--retry-failed`
+#run can replay just those ids and merge the results into the existing output.
+import json
+import sqlite3
+from datetime import datetime, timezone
+
+from institutions import RESULTS_DIR
+
+DEAD_LETTER_DB = RESULTS_DIR / "dead_letters.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dead_letters (
+    stage        TEXT NOT NULL,
+    slug         TEXT NOT NULL,
+    key          TEXT NOT NULL,
+    error_class  TEXT,
+    status       INTEGER,
+    message      TEXT,
+    attempts     INTEGER NOT NULL DEFAULT 1,
+    first_failed TEXT NOT NULL,
+    last_failed  TEXT NOT NULL,
+    payload      TEXT,
+    PRIMARY KEY (stage, slug, key)
+)
+"""
+
+def _connect():
+    conn = sqlite3.connect(DEAD_LETTER_DB)
+    conn.execute(SCHEMA)
+    return conn
+
+def record_failures(stage, slug, failures):
+    """Upsert failures given as dicts with key, error_class, status, message and payload."""
+    now = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    rows = [(stage, slug, f["key"], f.get("error_class"), f.get("status"), f.get("message"),
+             now, now, json.dumps(f.get("payload", {}), default=str)) for f in failures]
+    with _connect() as conn:
+        conn.executemany("""
+            INSERT INTO dead_letters (stage, slug, key, error_class, status, message, first_failed, last_failed, payload)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (stage, slug, key) DO UPDATE SET
+                error_class = excluded.error_class,
+                status      = excluded.status,
+                message     = excluded.message,
+                attempts    = attempts + 1,
+                last_failed = excluded.last_failed
+        """, rows)
+    conn.close()
+
+def resolve(stage, slug, keys):
+    """Drop entries that have since succeeded."""
+    with _connect() as conn:
+        conn.executemany("DELETE FROM dead_letters WHERE stage = ? AND slug = ? AND key = ?",
+                         [(stage, slug, k) for k in keys])
+    conn.close()
+
+def pending(stage, slug, max_attempts=None):
+    """Entries still failing for this stage/school, oldest first, payloads decoded."""
+    query = "SELECT key, error_class, status, message, attempts, payload FROM dead_letters WHERE stage = ? AND slug = ?"
+    params = [stage, slug]
+    if max_attempts is not None:
+        query += " AND attempts < ?"
+        params.append(max_attempts)
+    with _connect() as conn:
+        rows = conn.execute(query + " ORDER BY first_failed", params).fetchall()
+    conn.close()
+    return [{"key": k, "error_class": e, "status": s, "message": m, "attempts": a, "payload": json.loads(p or "{}")}
+            for k, e, s, m, a, p in rows]
@@ -0,0 +1,203 @@
+#This file merges authors that OpenAlex split across several A... ids. Candidate pairs come from two
+#blocks: a shared ORCID, and the same normalized name key (last name + first initial) at the same
+#institution with overlapping years. A name pair also needs a second signal: the two ids share another
+#institution, or one of them is a small fragment (few works). Blocks crowded with same-key authors
+#("J. Wang" at a big school) never merge on name. Accepted pairs are joined with union-find. Two
+#clusters holding different ORCIDs are never joined. Each cluster keeps one canonical id, and spans are
+#collapsed onto it.
+#
+#   python disambiguate.py mit ou        # writes {prefix}_author_clusters.csv and merged spans
+import argparse
+import importlib
+import re
+import time
+import unicodedata
+
+import pandas as pd
+
+from institutions import result_path, selected_slugs
+from stints import segment_stints
+
+spans_mod = importlib.import_module("3_eachschoolyears")
+
+# ── CONFIG ───────────────────────────────────────────────────────────────────
+MAX_YEAR_GAP       = 2   # name-block pairs need their years at the shared institution this close
+MAX_BLOCK_AUTHORS  = 4   # a name+institution block with more distinct ids than this is too common to merge
+MAX_FRAGMENT_WORKS = 5   # an id with at most this many works reads as a split-off fragment
+NAME_SUFFIXES      = {"jr", "sr", "ii", "iii", "iv", "phd", "md"}
+
+# ── UNION-FIND ───────────────────────────────────────────────────────────────
+class UnionFind:
+    """Union by size with path halving over integer ids 0..n-1.
+
+    Each root remembers the ORCID of its cluster, and union() refuses to join
+    two clusters whose ORCIDs differ.
+    """
+    def __init__(self, n, orcids=None):
+        self.parent = list(range(n))
+        self.size   = [1] * n
+        self.orcid  = list(orcids) if orcids is not None else [None] * n
+
+    def find(self, x):
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra == rb:
+            return True
+        oa, ob = self.orcid[ra], self.orcid[rb]
+        if oa and ob and oa != ob:
+            return False
+        if self.size[ra] < self.size[rb]:
+            ra, rb = rb, ra
+        self.parent[rb] = ra
+        self.size[ra] += self.size[rb]
+        self.orcid[ra] = oa or ob
+        return True
+
+    def roots(self):
+        return [self.find(x) for x in range(len(self.parent))]
+
+# ── NAME BLOCKING ────────────────────────────────────────────────────────────
+def name_tokens(name):
+    """Lowercase, accent-free tokens with punctuation and suffixes dropped."""
+    name = unicodedata.normalize("NFKD", str(name)).encode("ascii", "ignore").decode()
+    tokens = re.sub(r"[^a-z\s-]", " ", name.lower()).replace("-", " ").split()
+    return [t for t in tokens if t not in NAME_SUFFIXES]
+
+def name_key(tokens):
+    return f"{tokens[-1]} {tokens[0][0]}" if len(tokens) >= 2 else None
+
+def _consecutive(cand, by):
+    """Pair each row with the previous one in its group (groups pre-sorted by first year)."""
+    prev = cand.groupby(by, sort=False)[["author_id", "year_start", "year_end"]].shift(1)
+    pairs = cand.assign(other=prev["author_id"], other_start=prev["year_start"], other_end=prev["year_end"])
+    return pairs[pairs["other"].notna()]
+
+def name_block_pairs(profiles, spans):
+    """Candidate pairs: same name key at the same institution with overlapping years.
+
+    Full first names only pair with the same full first name. Initial-only
+    names ("B. Abi") pair with every stint of the block's full-name authors
+    when the block has exactly one full first name, and with each other when
+    it has none, so "B." is never guessed between a Brian and a Bruce. Blocks
+    with more than MAX_BLOCK_AUTHORS ids are skipped, and every pair must
+    pass second_signal().
+    """
+    tokens = profiles.drop_duplicates("author_id").set_index("author_id")["name"].map(name_tokens)
+    keys = tokens.map(name_key).dropna()
+    cand = spans[spans["author_id"].isin(keys.index)][["author_id", "institution_id", "year_start", "year_end"]].copy()
+    cand["key"]   = cand["author_id"].map(keys)
+    cand["first"] = cand["author_id"].map(tokens.str[0])
+    cand["year_start"] = pd.to_numeric(cand["year_start"])
+    cand["year_end"]   = pd.to_numeric(cand["year_end"])
+    cand = cand.sort_values(["key", "institution_id", "year_start"])
+    block = ["key", "institution_id"]
+
+    full, initial = cand[cand["first"].str.len() > 1], cand[cand["first"].str.len() == 1]
+    n_full = full.groupby(block)["first"].nunique()
+    initial_block = pd.MultiIndex.from_frame(initial[block])
+
+    anchors = full[full.set_index(block).index.isin(n_full.index[n_full == 1])]
+    anchored = initial.merge(anchors[block + ["author_id", "year_start", "year_end"]].rename(columns={
+        "author_id": "other", "year_start": "other_start", "year_end": "other_end"}), on=block)
+
+    pairs = pd.concat([
+        _consecutive(full, block + ["first"]),
+        _consecutive(initial[~initial_block.isin(n_full.index)], block),
+        anchored,
+    ], ignore_index=True)
+    pairs = pairs[pairs["other"] != pairs["author_id"]]
+    overlap = (pairs["year_start"] <= pairs["other_end"] + MAX_YEAR_GAP) & \
+              (pairs["other_start"] <= pairs["year_end"] + MAX_YEAR_GAP)
+    block_size = cand.groupby(block)["author_id"].nunique()
+    small = pd.MultiIndex.from_frame(pairs[block]).isin(block_size.index[block_size <= MAX_BLOCK_AUTHORS])
+    pairs = pairs.loc[overlap & small, ["author_id", "other", "institution_id"]].drop_duplicates()
+    return pairs[second_signal(pairs, profiles, spans)][["author_id", "other"]].drop_duplicates()
+
+def second_signal(pairs, profiles, spans):
+    """True where a name pair is backed by more than the name: a shared second institution, or a small fragment."""
+    held = spans[["author_id", "institution_id"]].drop_duplicates()
+    shared = pairs.merge(held.rename(columns={"institution_id": "via"}), on="author_id") \
+                  .merge(held.rename(columns={"author_id": "other", "institution_id": "via"}), on=["other", "via"])
+    shared = shared[shared["via"] != shared["institution_id"]]
+    key = pd.MultiIndex.from_frame(pairs[["author_id", "other"]])
+    has_shared = key.isin(pd.MultiIndex.from_frame(shared[["author_id", "other"]]))
+
+    works = profiles.drop_duplicates("author_id").set_index("author_id")["works_count"] if "works_count" in profiles else pd.Series(dtype=float)
+    works = pd.to_numeric(works, errors="coerce")
+    fewest = pd.concat([pairs["author_id"].map(works), pairs["other"].map(works)], axis=1).min(axis=1)
+    return has_shared | (fewest <= MAX_FRAGMENT_WORKS).to_numpy()
+
+# ── CLUSTERING ───────────────────────────────────────────────────────────────
+def cluster_authors(profiles, spans):
+    """author_id -> cluster_id for every author in `profiles`.
+
+    The canonical id of a cluster is the member with the most institution
+    spans (ties go to the smallest id), so merged rows keep the best-covered id.
+    """
+    ids = profiles["author_id"].drop_duplicates().reset_index(drop=True)
+    code = pd.Series(ids.index, index=ids)
+    orcids = profiles.drop_duplicates("author_id").set_index("author_id")["orcid"] if "orcid" in profiles else pd.Series(dtype=str)
+    orcids = [o.strip() if isinstance(o, str) and o.strip() else None for o in orcids.reindex(ids)]
+    uf = UnionFind(len(ids), orcids)
+
+    merges = {"orcid": 0, "name+institution": 0, "orcid conflict": 0}
+    with_orcid = pd.DataFrame({"code": code.values, "orcid": orcids}).dropna()
+    anchor = with_orcid.groupby("orcid")["code"].transform("first")
+    joined = anchor != with_orcid["code"]
+    for a, b in zip(anchor[joined], with_orcid["code"][joined]):
+        uf.union(a, b)
+        merges["orcid"] += 1
+
+    pairs = name_block_pairs(profiles, spans[spans["author_id"].isin(code.index)])
+    for a, b in zip(code[pairs["author_id"]], code[pairs["other"]]):
+        if uf.find(a) != uf.find(b):
+            if uf.union(a, b):
+                merges["name+institution"] += 1
+            else:
+                merges["orcid conflict"] += 1
+
+    out = pd.DataFrame({"author_id": ids, "root": uf.roots()})
+    out["n_spans"] = out["author_id"].map(spans["author_id"].value_counts()).fillna(0)
+    canon = out.sort_values(["root", "n_spans", "author_id"], ascending=[True, False, True]).drop_duplicates("root")
+    out["cluster_id"] = out["root"].map(canon.set_index("root")["author_id"])
+    out["cluster_size"] = out.groupby("root")["author_id"].transform("size")
+    print(f"Clustered {len(ids)} author ids into {out['cluster_id'].nunique()} authors "
+          f"({merges['orcid']} ORCID merges, {merges['name+institution']} name+institution merges, "
+          f"{merges['orcid conflict']} blocked by ORCID conflicts)")
+    return out[["author_id", "cluster_id", "cluster_size"]]
+
+def collapse_spans(spans, clusters):
+    """Re-key spans to each author's canonical id and merge the members' stints at each institution."""
+    spans = spans.copy()
+    spans["author_id"] = spans["author_id"].map(clusters.set_index("author_id")["cluster_id"]).fillna(spans["author_id"])
+    return segment_stints(spans, ["author_id", "institution_id"], first=["name", "institution_name"])[spans_mod.SPAN_COLUMNS]
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge OpenAlex author ids that belong to the same person.")
+    parser.add_argument("slugs", nargs="*", help="institution slugs (default: all registered)")
+    args = parser.parse_args()
+
+    for slug in selected_slugs(args.slugs):
+        try:
+            profiles = pd.read_csv(result_path(slug, "profiles"), dtype=str)
+            spans    = pd.read_csv(result_path(slug, "spans"), dtype=str)
+        except FileNotFoundError as e:
+            print(f"⚠ Skipping {slug.upper()}: {e.filename} not found.")
+            continue
+
+        start = time.time()
+        print(f"\n--- Disambiguating {slug.upper()} ({len(profiles)} author ids) ---")
+        clusters = cluster_authors(profiles, spans)
+        merged = collapse_spans(spans, clusters)
+        clusters.to_csv(result_path(slug, "clusters"), index=False)
+        merged.to_csv(result_path(slug, "merged_spans"), index=False)
+        print(f"✓ Done for {slug.upper()} in {time.time() - start:.1f}s: {len(spans)} spans → {len(merged)}")
+
+if __name__ == "__main__":
+    main()
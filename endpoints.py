@@ -0,0 +1,7 @@
+#Base URLs for every upstream API. Each can be overridden from the environment, which is how the
+#offline benchmark (bench/) points the scripts at its local mock server.
+import os
+
+OPENALEX_API    = os.environ.get("OPENALEX_API", "https://api.openalex.org").rstrip("/")
+WIKIDATA_SPARQL = os.environ.get("WIKIDATA_SPARQL", "https://query.wikidata.org/sparql")
+NOMINATIM_URL   = os.environ.get("NOMINATIM_URL", "https://nominatim.openstreetmap.org/search")
@@ -0,0 +1,132 @@
+#This file decodes OpenAlex responses. It uses msgspec or orjson when installed and
+#falls back to the stdlib json module otherwise. Works pages and institution records
+#decode straight into slotted structs holding only the fields the pipeline reads.
+#Everything else (author profiles, SPARQL, Nominatim) comes back as plain dicts via loads().
+#Nested objects and lists that OpenAlex sometimes sends as null ("geo": null, "author": null, ...)
+#decode to their empty values with either backend, so a sparse record never fails a whole page.
+import json
+from dataclasses import dataclass
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND        = "orjson" if orjson else "msgspec" if msgspec else "json"  # what loads() uses
+STRUCT_BACKEND = "msgspec" if msgspec else BACKEND                          # what the decode_* functions use
+
+def loads(data):
+    """Parse a JSON body (bytes or str) into plain Python objects."""
+    if orjson is not None:
+        return orjson.loads(data)
+    if msgspec is not None:
+        return msgspec.json.decode(data)
+    return json.loads(data)
+
+# ── STRUCTS ──────────────────────────────────────────────────────────────────
+@dataclass(slots=True)
+class InstitutionRef:
+    id:           str | None = None
+    display_name: str | None = "Unknown"
+
+@dataclass(slots=True)
+class AuthorRef:
+    id:           str | None = None
+    display_name: str | None = "Unknown"
+
+@dataclass(slots=True)
+class Authorship:
+    author:       AuthorRef | None = None
+    institutions: list[InstitutionRef] | None = None
+
+    def __post_init__(self):
+        if self.author is None:
+            self.author = AuthorRef()
+        if self.institutions is None:
+            self.institutions = []
+
+@dataclass(slots=True)
+class Work:
+    publication_year: int | None = None
+    authorships:      list[Authorship] | None = None
+
+    def __post_init__(self):
+        if self.authorships is None:
+            self.authorships = []
+
+@dataclass(slots=True)
+class Meta:
+    count:       int | None = None
+    next_cursor: str | None = None
+
+@dataclass(slots=True)
+class WorksPage:
+    meta:    Meta | None = None
+    results: list[Work] | None = None
+
+    def __post_init__(self):
+        if self.meta is None:
+            self.meta = Meta()
+        if self.results is None:
+            self.results = []
+
+@dataclass(slots=True)
+class Geo:
+    latitude:  float | None = None
+    longitude: float | None = None
+
+@dataclass(slots=True)
+class Institution:
+    id:           str | None = None
+    display_name: str | None = None
+    geo:          Geo | None = None
+
+    def __post_init__(self):
+        if self.geo is None:
+            self.geo = Geo()
+
+# ── DECODERS ─────────────────────────────────────────────────────────────────
+if msgspec is not None:
+    _works_decoder = msgspec.json.Decoder(WorksPage)
+    _work_decoder  = msgspec.json.Decoder(Work)
+    _inst_decoder  = msgspec.json.Decoder(Institution)
+
+    def decode_works_page(data):
+        return _works_decoder.decode(data)
+
+    def decode_work(data):
+        return _work_decoder.decode(data)
+
+    def decode_institution(data):
+        return _inst_decoder.decode(data)
+
+else:
+    def _institution_ref(d):
+        return InstitutionRef(d.get("id"), d.get("display_name", "Unknown"))
+
+    def _work(d):
+        return Work(d.get("publication_year"), [
+            Authorship(
+                AuthorRef(a.get("id"), a.get("display_name", "Unknown")) if (a := auth.get("author")) else AuthorRef(),
+                [_institution_ref(i) for i in auth.get("institutions") or ()],
+            )
+            for auth in d.get("authorships") or ()
+        ])
+
+    def decode_work(data):
+        return _work(loads(data))
+
+    def decode_works_page(data):
+        d = loads(data)
+        meta = d.get("meta") or {}
+        return WorksPage(Meta(meta.get("count"), meta.get("next_cursor")),
+                         [_work(w) for w in d.get("results") or ()])
+
+    def decode_institution(data):
+        d = loads(data)
+        geo = d.get("geo") or {}
+        return Institution(d.get("id"), d.get("display_name"), Geo(geo.get("latitude"), geo.get("longitude")))
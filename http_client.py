@@ -0,0 +1,86 @@
+#This file builds the HTTP client every stage shares. Sessions come with per-host connection limits,
+#keep-alive, a DNS cache, gzip and timeouts. They also send the mailto User-Agent that puts OpenAlex
+#requests in the polite pool. aiohttp only speaks HTTP/1.1, so connection reuse comes from
+#keep-alive rather than HTTP/2 multiplexing.
+import asyncio
+import os
+import time
+import aiohttp
+import metrics
+import response_archive
+from ratelimit import controller_for
+
+MAILTO     = os.environ.get("OPENALEX_MAILTO", "mm4958@mit.edu")
+USER_AGENT = f"MyResearchScraper/1.0 (mailto:{MAILTO})"
+HEADERS    = {"User-Agent": USER_AGENT, "Accept-Encoding": "gzip, deflate"}
+# optional; OpenAlex premium filters such as from_updated_date only work with a key
+OPENALEX_API_KEY = os.environ.get("OPENALEX_API_KEY") or None
+
+# ── CONFIG ───────────────────────────────────────────────────────────────────
+MAX_CONNECTIONS      = 100  # across all hosts
+MAX_PER_HOST         = 20   # open connections to any one API
+DNS_CACHE_TTL        = 300  # seconds
+KEEPALIVE_TIMEOUT    = 30   # seconds an idle connection stays open
+TIMEOUT              = aiohttp.ClientTimeout(total=60, connect=10, sock_read=30)
+RETRY_STATUSES       = {429, 500, 502, 503, 504}
+NO_RESPONSE          = 599  # status recorded when the connection itself failed
+
+def client_session(headers=None, per_host=MAX_PER_HOST, timeout=TIMEOUT):
+    """A pooled aiohttp session. Use it as `async with client_session() as session:`."""
+    connector = aiohttp.TCPConnector(
+        limit=MAX_CONNECTIONS,
+        limit_per_host=per_host,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, headers={**HEADERS, **(headers or {})}, timeout=timeout)
+
+async def get_bytes(session, url, *, service, stage="", params=None, headers=None, limiter=None,
+                    max_retries=3, backoff=1.0):
+    """GET url and return the raw body.
+
+    429s, 5xx and dropped connections are retried with exponential backoff
+    (1s, 2s, 4s, ... like urllib3's Retry), and each attempt is recorded in
+    metrics. Once retries run out, the last error is raised: a
+    ClientResponseError for HTTP errors. Requests in flight per host are
+    governed by that host's AIMD controller. Successful bodies go to the
+    response archive, and in replay mode come back from it without a request.
+    OpenAlex requests carry OPENALEX_API_KEY when it is set; the archive
+    keys them without it.
+    """
+    if response_archive.REPLAY:
+        return response_archive.replay(service, url, params)
+    send_params = params
+    if service == "openalex" and OPENALEX_API_KEY:
+        send_params = {**(params or {}), "api_key": OPENALEX_API_KEY}
+    controller = controller_for(url)
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            await limiter.wait_async()
+        await controller.acquire()
+        start = time.time()
+        try:
+            async with session.get(url, params=send_params, headers=headers) as resp:
+                body = await resp.read()
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            controller.release(ok=False)
+            metrics.record_request(service, time.time() - start, status=NO_RESPONSE, stage=stage)
+            if attempt == max_retries:
+                raise
+            metrics.record_retry(service, stage=stage)
+            await asyncio.sleep(backoff * 2 ** attempt)
+            continue
+        except BaseException:
+            controller.release()  # cancelled mid-request: free the slot, learn nothing
+            raise
+
+        seconds = time.time() - start
+        controller.release(ok=resp.status not in RETRY_STATUSES, seconds=seconds)
+        metrics.record_request(service, seconds, len(body), resp.status, stage=stage)
+        if resp.status in RETRY_STATUSES and attempt < max_retries:
+            metrics.record_retry(service, stage=stage)
+            await asyncio.sleep(backoff * 2 ** attempt)
+            continue
+        resp.raise_for_status()
+        response_archive.record(service, url, body, params, resp.status)
+        return body
@@ -0,0 +1,50 @@
+#Shared registry of the schools we harvest and where each stage reads/writes its files. Every numbered
+#script and pipeline.py look institutions up here instead of keeping their own INSTITUTIONS dict.
+import sys
+from pathlib import Path
+
+RESULTS_DIR = Path("/home/mm4958/openalex/results")
+
+# slug → OpenAlex id, lowercase display name, and the prefix used in file/column names
+INSTITUTIONS = {
+    "mit":       {"oa_id": "I63966007",  "display": "massachusetts institute of technology", "prefix": "MIT"},
+    "ou":        {"oa_id": "I8692664",   "display": "university of oklahoma",                "prefix": "OU"},
+    "osu":       {"oa_id": "I115475287", "display": "oklahoma state university",             "prefix": "OSU"},
+    "dartmouth": {"oa_id": "I107672454", "display": "dartmouth college",                     "prefix": "DART"},
+    "cornell":   {"oa_id": "I205783295", "display": "cornell university",                    "prefix": "CORN"},
+    "harvard":   {"oa_id": "I136199984", "display": "harvard university",                    "prefix": "HARV"},
+}
+
+# per-school outputs, one entry per stage
+FILES = {
+    "affiliations":       "{slug}_only_affiliations.csv",
+    "changed_authors":    "{slug}_changed_authors.csv",
+    "profiles":           "{prefix}_author_profiles_extended_f.csv",
+    "errors":             "{prefix}_errors.csv",
+    "affiliation_years":  "{prefix}_author_affiliation_years.csv",
+    "clusters":           "{prefix}_author_clusters.csv",
+    "merged_spans":       "{prefix}_author_institution_year_spans_merged.csv",
+    "spans":              "{prefix}_author_institution_year_spans.csv",
+    "hospital":           "{prefix}_with_nearest_hospital_v4.csv",
+    "vital":              "{prefix}_with_nearest_hospital_v5.csv",
+    "panel":              "{prefix}_with_nearest_hospital_v6.csv",
+    "inst_college_towns": "{prefix}_institution_college_towns.parquet",
+    "span_college_towns": "{prefix}_span_college_towns.parquet",
+}
+
+def oa_url(slug):
+    return f"https://openalex.org/{INSTITUTIONS[slug]['oa_id']}"
+
+def prefix(slug):
+    return INSTITUTIONS[slug]["prefix"]
+
+def result_path(slug, kind):
+    return RESULTS_DIR / FILES[kind].format(slug=slug, prefix=prefix(slug))
+
+def selected_slugs(argv=None):
+    """Slugs named on the command line, or every registered school."""
+    argv = sys.argv[1:] if argv is None else argv
+    unknown = [s for s in argv if s not in INSTITUTIONS]
+    if unknown:
+        raise SystemExit(f"Unknown institution(s): {', '.join(unknown)}. Known: {', '.join(INSTITUTIONS)}")
+    return list(argv) or list(INSTITUTIONS)
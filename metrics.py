@@ -0,0 +1,195 @@
+#In-process counters and latency histograms for every fetcher and stage. Snapshots go out as JSON lines
+#(one object per interval) or Prometheus text, chosen by file extension:
+#
+#   METRICS_OUT=results/metrics.jsonl python 2_checkaffiliations.py mit
+#   python pipeline.py mit --metrics results/metrics.prom --metrics-interval 30
+#
+#Histograms use fixed log-spaced buckets, so memory stays constant however long the run is.
+import atexit
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+# 1ms … ~65s, doubling, plus +Inf
+LATENCY_BUCKETS = [0.001 * 2 ** i for i in range(17)] + [float("inf")]
+
+class Histogram:
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q):
+        """Approximate percentile, interpolating linearly inside the bucket."""
+        if not self.count:
+            return 0.0
+        target, seen, lower = q * self.count, 0, 0.0
+        for bound, n in zip(self.bounds, self.counts):
+            if n and seen + n >= target:
+                upper = min(bound, self.max)
+                return lower + (upper - lower) * (target - seen) / n
+            seen += n
+            lower = bound
+        return self.max
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def value(self, name, **labels):
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    # ── exporters ───────────────────────────────────────────────────────────
+    def snapshot(self):
+        with self.lock:
+            elapsed = time.time() - self.started
+            counters = [{"name": n, "labels": dict(l), "value": v} for (n, l), v in self.counters.items()]
+            histograms = [{
+                "name": n, "labels": dict(l), "count": h.count, "sum": round(h.sum, 6),
+                "p50": round(h.percentile(0.50), 6), "p90": round(h.percentile(0.90), 6),
+                "p99": round(h.percentile(0.99), 6), "max": round(h.max, 6),
+            } for (n, l), h in self.histograms.items()]
+            # rates over wall time, not summed latencies, so they stay right under concurrency
+            rates = {
+                _fmt_key(n, l): round(v / elapsed, 3) if elapsed > 0 else 0.0
+                for (n, l), v in self.counters.items() if n == "http_requests_total"
+            }
+            rows_per_sec = {}
+            for (n, l), v in self.counters.items():
+                if n == "stage_rows_total":
+                    secs = self.counters.get(("stage_seconds_total", l), 0)
+                    rows_per_sec[dict(l)["stage"]] = round(v / secs, 3) if secs else 0.0
+        return {"ts": time.time(), "pid": os.getpid(), "elapsed_s": round(elapsed, 3), "counters": counters,
+                "histograms": histograms, "requests_per_sec": rates, "rows_per_sec": rows_per_sec}
+
+    def prometheus_text(self):
+        lines = []
+        with self.lock:
+            for name in sorted({n for n, _ in self.counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (n, l), v in self.counters.items():
+                    if n == name:
+                        lines.append(f"{_fmt_key(n, l)} {v:g}")
+            for name in sorted({n for n, _ in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (n, l), h in self.histograms.items():
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for bound, c in zip(h.bounds, h.counts):
+                        cumulative += c
+                        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        lines.append(f"{_fmt_key(n + '_bucket', l + (('le', le),))} {cumulative}")
+                    lines.append(f"{_fmt_key(n + '_sum', l)} {h.sum:g}")
+                    lines.append(f"{_fmt_key(n + '_count', l)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Append a JSON-lines snapshot, or overwrite a .prom file with Prometheus text."""
+        path = str(path)
+        if path.endswith(".prom"):
+            with open(path, "w") as f:
+                f.write(self.prometheus_text())
+        else:
+            with open(path, "a") as f:
+                f.write(json.dumps(self.snapshot()) + "\n")
+
+def _fmt_key(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+REGISTRY = Registry()
+inc      = REGISTRY.inc
+observe  = REGISTRY.observe
+value    = REGISTRY.value
+
+# ── helpers used by the fetchers and the pipeline ───────────────────────────
+def record_request(service, seconds, nbytes=0, status=200, stage=""):
+    inc("http_requests_total", service=service, stage=stage)
+    inc("http_response_bytes_total", nbytes, service=service, stage=stage)
+    observe("http_request_seconds", seconds, service=service, stage=stage)
+    if status == 429:
+        inc("http_429_total", service=service, stage=stage)
+    elif status >= 400:
+        inc("http_errors_total", service=service, stage=stage, status=status)
+
+def record_retry(service, stage=""):
+    inc("http_retries_total", service=service, stage=stage)
+
+def record_cache(cache, hit):
+    inc("cache_hits_total" if hit else "cache_misses_total", cache=cache)
+
+def record_coalesced(flight, shared):
+    inc("coalesced_total" if shared else "flights_total", flight=flight)
+
+def record_stage(stage, rows, seconds):
+    inc("stage_rows_total", rows, stage=stage)
+    inc("stage_seconds_total", seconds, stage=stage)
+
+# ── periodic reporting ──────────────────────────────────────────────────────
+_reporter = None
+
+def start_reporter(path, interval=60.0):
+    """Write a snapshot every `interval` seconds and once more at exit."""
+    global _reporter
+    if _reporter is not None:
+        return
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            REGISTRY.write(path)
+
+    _reporter = threading.Thread(target=loop, daemon=True)
+    _reporter.start()
+    atexit.register(lambda: (stop.set(), REGISTRY.write(path)))
+
+def worker_init(path=None, interval=60.0):
+    """Start clean in a worker process: drop counters inherited from the parent and report on our own.
+
+    .prom files get the pid appended so workers don't overwrite each other;
+    JSON-lines snapshots carry the pid already and share one file.
+    """
+    global _reporter
+    REGISTRY.__init__()
+    _reporter = None
+    if path:
+        path = worker_path(path)
+        start_reporter(path, interval)
+    return path
+
+def worker_path(path):
+    path = str(path)
+    return f"{path[:-5]}.{os.getpid()}.prom" if path.endswith(".prom") else path
+
+if os.environ.get("METRICS_OUT"):
+    start_reporter(os.environ["METRICS_OUT"], float(os.environ.get("METRICS_INTERVAL", 60)))
@@ -0,0 +1,102 @@
+#Publishes the finished panel ({prefix}_with_nearest_hospital_v6.csv) into one SQLite database for
+#analysts. All schools share a `panel` table, keyed by a `school` column and indexed on author,
+#institution and year range (with and without the school), so filtered queries read a few pages
+#instead of the whole CSV. Connections opened here memory-map the file and wait out each other's locks,
+#so per-school publishes can run in parallel.
+#
+#   python panel_db.py mit ou                              # (re)publish these schools
+#   python panel_db.py --overlap 1990 2000 --school mit --within-km 5
+import argparse
+import sqlite3
+import time
+from contextlib import closing
+
+import pandas as pd
+
+from institutions import RESULTS_DIR, result_path, selected_slugs
+
+PANEL_DB  = RESULTS_DIR / "panel.sqlite"
+MMAP_SIZE = 1 << 30  # bytes of the file SQLite may memory-map per connection
+BUSY_TIMEOUT_MS = 120_000  # how long a writer waits for another school's publish to release the lock
+
+INT_COLS  = ["year_start", "year_end", "hospital_open_year", "hospital_close_year"]
+REAL_COLS = ["institution_lat", "institution_lon", "hospital_lat", "hospital_lon", "distance_km"]
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS panel_author      ON panel (author_id)",
+    "CREATE INDEX IF NOT EXISTS panel_institution ON panel (institution_id)",
+    "CREATE INDEX IF NOT EXISTS panel_years       ON panel (school, year_start, year_end)",
+    "CREATE INDEX IF NOT EXISTS panel_span        ON panel (year_start, year_end)",
+    "CREATE INDEX IF NOT EXISTS panel_distance    ON panel (school, distance_km)",
+]
+
+def connect(readonly=False):
+    if readonly:
+        conn = sqlite3.connect(f"file:{PANEL_DB}?mode=ro", uri=True)
+    else:
+        conn = sqlite3.connect(PANEL_DB)
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    if not readonly:
+        conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    return conn
+
+def publish(slug, panel):
+    """Replace one school's rows in the panel table and refresh the indexes."""
+    df = panel.assign(school=slug)
+    for col in INT_COLS:
+        if col in df:
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype("Int64")
+    for col in REAL_COLS:
+        if col in df:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+
+    with closing(connect()) as conn, conn:
+        conn.execute("BEGIN IMMEDIATE")  # take the write lock before reading the schema another publish may create
+        existing = [row[1] for row in conn.execute("PRAGMA table_info(panel)")]
+        if existing:
+            for col in df.columns.difference(existing):
+                conn.execute(f'ALTER TABLE panel ADD COLUMN "{col}"')
+            conn.execute("DELETE FROM panel WHERE school = ?", (slug,))
+        df.to_sql("panel", conn, if_exists="append", index=False)
+        for ddl in INDEXES:
+            conn.execute(ddl)
+        conn.execute("ANALYZE")
+    print(f"✓ Published {len(df)} {slug.upper()} panel rows to {PANEL_DB.name}")
+    return pd.DataFrame({"school": [slug], "rows": [len(df)]})
+
+def overlapping(year_from, year_to, school=None, within_km=None):
+    """Panel rows whose span overlaps [year_from, year_to], optionally for one school / near a hospital."""
+    sql = "SELECT * FROM panel WHERE year_start <= :year_to AND year_end >= :year_from"
+    if school:
+        sql += " AND school = :school"
+    if within_km is not None:
+        sql += " AND distance_km <= :within_km"
+    params = {"year_from": year_from, "year_to": year_to, "school": school, "within_km": within_km}
+    with closing(connect(readonly=True)) as conn:
+        return pd.read_sql_query(sql, conn, params=params)
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish the panel to SQLite, or query it.")
+    parser.add_argument("slugs", nargs="*", help="institution slugs to publish (default: all registered)")
+    parser.add_argument("--overlap", nargs=2, type=int, metavar=("FROM", "TO"), help="query spans overlapping these years instead of publishing")
+    parser.add_argument("--school", help="with --overlap: only this school")
+    parser.add_argument("--within-km", type=float, help="with --overlap: only institutions this close to a hospital")
+    args = parser.parse_args()
+
+    if args.overlap:
+        start = time.time()
+        rows = overlapping(*args.overlap, school=args.school, within_km=args.within_km)
+        print(rows.to_string(max_rows=20))
+        print(f"{len(rows)} rows in {(time.time() - start) * 1000:.1f} ms")
+        return
+
+    for slug in selected_slugs(args.slugs):
+        try:
+            panel = pd.read_csv(result_path(slug, "panel"), dtype=str)
+        except FileNotFoundError as e:
+            print(f"⚠ Skipping {slug.upper()}: {e.filename} not found.")
+            continue
+        publish(slug, panel)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+#Single-process runner for the whole pipeline. Stages are declared as a DAG, pass DataFrames to each
+#other in memory, and are cached by content hash so a stage only re-runs when its code or inputs change.
+#Stages whose inputs are ready run concurrently (e.g. hospital geocoding next to the Wikidata lookups).
+#
+#   python pipeline.py mit                        # full run for one school
+#   python pipeline.py mit --until spans          # stop after the span builder
+#   python pipeline.py mit --refresh affiliations # re-run a stage; downstream re-runs only if its output changed
+#   python pipeline.py --processes 6              # every school in its own worker process
+#   python pipeline.py mit ou --plan              # estimate requests/time and exit (see planner.py)
+#   python pipeline.py mit ou --replay            # rebuild every stage from archived responses, no network
+import argparse
+import asyncio
+import hashlib
+import importlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+
+import pandas as pd
+
+import author_years
+import disambiguate
+import metrics
+import panel_db
+import ratelimit
+import response_archive
+import ssdi
+from institutions import INSTITUTIONS, RESULTS_DIR, result_path, selected_slugs
+
+# ── CONFIG ───────────────────────────────────────────────────────────────────
+CACHE_DIR   = RESULTS_DIR / ".pipeline_cache"
+MAX_WORKERS = 4   # stages running at once
+
+# numbered scripts are not valid identifiers, so import them by name
+affiliations_mod = importlib.import_module("1_allschoolaffiliations")
+profiles_mod     = importlib.import_module("2_checkaffiliations")
+spans_mod        = importlib.import_module("3_eachschoolyears")
+hosp_mod         = importlib.import_module("4_get_hosp")
+vital_mod        = importlib.import_module("5_get_years")
+match_mod        = importlib.import_module("6_check_fuzzy_match")
+towns_mod        = importlib.import_module("7_college_towns")
+
+def _enrich_profiles(slug, aff):
+    """Profiles stage; the per-year affiliations ride along on disk for the span builder."""
+    profiles, years_df = asyncio.run(profiles_mod.enrich_institution(aff.astype(str), slug))
+    years_df.to_csv(result_path(slug, "affiliation_years"), index=False)
+    return profiles
+
+# ── STAGES ───────────────────────────────────────────────────────────────────
+# run(slug, *dep_frames) -> DataFrame. "output" is the institutions.FILES kind
+# each stage also publishes, matching what the standalone scripts write.
+STAGES = {
+    "affiliations": {
+        "deps":   [],
+        "module": affiliations_mod,
+        "run":    lambda slug: asyncio.run(
+            affiliations_mod.harvest_institution(INSTITUTIONS[slug]["oa_id"])),
+        "output": "affiliations",
+    },
+    "profiles": {
+        "deps":   ["affiliations"],
+        "module": profiles_mod,
+        "run":    lambda slug, aff: _enrich_profiles(slug, aff),
+        "output": "profiles",
+    },
+    "spans": {
+        "deps":   ["profiles"],
+        "module": spans_mod,
+        "run":    lambda slug, profiles: spans_mod.build_spans(
+            profiles, affiliation_years=spans_mod.load_affiliation_years(slug)),
+        "output": "spans",
+    },
+    "clusters": {
+        "deps":   ["profiles", "spans"],
+        "module": disambiguate,
+        "run":    lambda slug, profiles, spans: disambiguate.cluster_authors(profiles, spans),
+        "output": "clusters",
+    },
+    "merged_spans": {
+        "deps":   ["spans", "clusters"],
+        "module": disambiguate,
+        "run":    lambda slug, spans, clusters: disambiguate.collapse_spans(spans, clusters),
+        "output": "merged_spans",
+    },
+    "hospitals": {
+        "deps":   [],
+        "module": hosp_mod,
+        "run":    lambda slug: hosp_mod.load_hospitals(),
+    },
+    "geocode": {
+        "deps":   ["merged_spans"],
+        "module": hosp_mod,
+        "run":    lambda slug, spans: hosp_mod.geocode_institutions(spans),
+    },
+    "vital_dates": {
+        "deps":   ["merged_spans"],
+        "module": vital_mod,
+        "run":    lambda slug, spans: vital_mod.fetch_vital_dates(spans[vital_mod.NAME_COL]),
+    },
+    "death_dates": {
+        "deps":   ["merged_spans", "vital_dates"],
+        "module": ssdi,
+        "run":    lambda slug, spans, lookup: ssdi.fill_death_dates(spans, lookup),
+    },
+    "nearest_hospital": {
+        "deps":   ["merged_spans", "geocode", "hospitals"],
+        "module": hosp_mod,
+        "run":    lambda slug, spans, coords, hosp: hosp_mod.attach_nearest_hospital(spans, coords, hosp),
+        "output": "hospital",
+    },
+    "vital_panel": {
+        "deps":   ["nearest_hospital", "death_dates"],
+        "module": vital_mod,
+        "run":    lambda slug, panel, lookup: vital_mod.attach_vital_dates(panel, lookup),
+        "output": "vital",
+    },
+    "checked_panel": {
+        "deps":   ["profiles", "vital_panel"],
+        "module": match_mod,
+        "run":    lambda slug, profiles, panel: match_mod.check_matches(profiles, panel),
+        "output": "panel",
+    },
+    "panel_db": {
+        "deps":   ["checked_panel"],
+        "module": panel_db,
+        "run":    lambda slug, panel: panel_db.publish(slug, panel),
+    },
+    "author_years": {
+        "deps":   ["vital_panel", "hospitals"],
+        "module": author_years,
+        "run":    lambda slug, panel, hosp: author_years.write_author_years(slug, panel, hosp),
+    },
+    "college_towns": {
+        "deps":   ["nearest_hospital"],
+        "module": towns_mod,
+        "run":    lambda slug, panel: towns_mod.write_tags(slug, *towns_mod.tag_panel(panel, towns_mod.load_college_towns())),
+    },
+}
+
+# ── CONTENT HASHING ──────────────────────────────────────────────────────────
+def frame_hash(df):
+    h = hashlib.sha256(",".join(map(str, df.columns)).encode())
+    h.update(pd.util.hash_pandas_object(df.astype(str), index=False).values.tobytes())
+    return h.hexdigest()
+
+def module_hash(module):
+    return hashlib.sha256(Path(module.__file__).read_bytes()).hexdigest()
+
+def stage_key(slug, name, dep_hashes):
+    h = hashlib.sha256(f"{slug}:{name}:{module_hash(STAGES[name]['module'])}".encode())
+    for dh in dep_hashes:
+        h.update(dh.encode())
+    return h.hexdigest()
+
+# ── RUNNER ───────────────────────────────────────────────────────────────────
+def run_stage(slug, name, results, hashes, force):
+    """Run one stage, or load its cached output if code and inputs are unchanged."""
+    stage = STAGES[name]
+    key = stage_key(slug, name, [hashes[d] for d in stage["deps"]])
+    cache_fn = CACHE_DIR / f"{slug}_{name}.pkl"
+    key_fn   = CACHE_DIR / f"{slug}_{name}.key"
+
+    if not force and cache_fn.exists() and key_fn.exists() and key_fn.read_text() == key:
+        print(f"[{slug}:{name}] inputs unchanged, using cached output")
+        df = pd.read_pickle(cache_fn)
+        return df, frame_hash(df)
+
+    start = time.time()
+    print(f"[{slug}:{name}] running…")
+    df = stage["run"](slug, *[results[d] for d in stage["deps"]])
+    metrics.record_stage(name, len(df), time.time() - start)
+
+    # pickle keeps dtypes exactly, so a cached run sees the same frames as a fresh one
+    df.to_pickle(cache_fn)
+    key_fn.write_text(key)
+    if stage.get("output"):
+        out_fn = result_path(slug, stage["output"])
+        df.to_csv(out_fn, index=False)
+        print(f"[{slug}:{name}] wrote {len(df)} rows → {out_fn.name}")
+    print(f"[{slug}:{name}] done in {time.time() - start:.1f}s")
+    return df, frame_hash(df)
+
+def upstream(names):
+    """All stages needed to produce `names`, including themselves."""
+    seen, stack = set(), list(names)
+    while stack:
+        name = stack.pop()
+        if name not in seen:
+            seen.add(name)
+            stack.extend(STAGES[name]["deps"])
+    return seen
+
+def run_pipeline(slug, until=None, refresh=(), max_workers=MAX_WORKERS):
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    pending = upstream(until or STAGES)
+    forced  = set(refresh)
+    results, hashes, running = {}, {}, {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            for name in sorted(pending):
+                if all(d in results for d in STAGES[name]["deps"]):
+                    pending.discard(name)
+                    fut = pool.submit(run_stage, slug, name, results, hashes, name in forced)
+                    running[fut] = name
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                name = running.pop(fut)
+                results[name], hashes[name] = fut.result()
+    return results
+
+def _init_worker(limiter, metrics_path, metrics_interval):
+    ratelimit.install(limiter)
+    metrics.worker_init(metrics_path, metrics_interval)
+
+def _run_school(slug, metrics_path=None, **kwargs):
+    # results stay in the worker; only the CSVs/cache it wrote matter to the parent
+    try:
+        run_pipeline(slug, **kwargs)
+    finally:
+        response_archive.flush()
+        if metrics_path:
+            # pool workers exit without running atexit, so flush here
+            metrics.REGISTRY.write(metrics.worker_path(metrics_path))
+
+def run_schools_in_processes(slugs, processes, metrics_path=None, metrics_interval=60.0, **kwargs):
+    """Run each school's full pipeline in its own worker process.
+
+    Workers share one OpenAlex rate limiter, so the combined request rate stays
+    at ratelimit.OPENALEX_MAX_RPS no matter how many schools run at once.
+    """
+    limiter = ratelimit.SharedRateLimiter(ratelimit.OPENALEX_MAX_RPS)
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                             initargs=(limiter, metrics_path, metrics_interval)) as pool:
+        futures = {pool.submit(_run_school, slug, metrics_path, **kwargs): slug for slug in slugs}
+        for fut in futures:
+            slug = futures[fut]
+            try:
+                fut.result()
+                print(f"✓ [{slug}] pipeline finished")
+            except Exception as e:
+                print(f"❌ [{slug}] pipeline failed: {e}")
+                raise
+
+# ── ENTRYPOINT ───────────────────────────────────────────────────────────────
+def main():
+    parser = argparse.ArgumentParser(description="Run the OpenAlex appointments pipeline.")
+    parser.add_argument("slugs", nargs="*", help="institution slugs, e.g. mit ou (default: all registered)")
+    parser.add_argument("--until", nargs="*", choices=list(STAGES), help="only build these stages (and their inputs)")
+    parser.add_argument("--refresh", nargs="*", default=[], choices=list(STAGES), help="re-run these stages even if cached")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="stages to run concurrently")
+    parser.add_argument("--processes", type=int, default=1, help="schools to run side by side, one process each")
+    parser.add_argument("--metrics", help="write metrics here (.jsonl appends snapshots, .prom writes Prometheus text)")
+    parser.add_argument("--metrics-interval", type=float, default=60.0, help="seconds between metrics snapshots")
+    parser.add_argument("--plan", action="store_true", help="only estimate the run's requests, bytes and time")
+    parser.add_argument("--replay", action="store_true", help="serve every API call from the response archive and re-run all stages")
+    args = parser.parse_args()
+    if args.plan:
+        import planner  # planner imports this module for STAGES
+        costs, budget_df = planner.plan(selected_slugs(args.slugs), args.until, args.refresh)
+        planner.print_plan(costs, budget_df)
+        return
+    if args.metrics:
+        metrics.start_reporter(args.metrics, args.metrics_interval)
+
+    start_time = time.time()
+    slugs = selected_slugs(args.slugs)
+    kwargs = {"until": args.until, "refresh": args.refresh, "max_workers": args.workers}
+    if args.replay:
+        response_archive.enable_replay()
+        # everything but the hospital download, which isn't an API response; schools in parallel
+        kwargs["refresh"] = args.refresh or [name for name in STAGES if name != "hospitals"]
+        if args.processes == 1:
+            args.processes = min(len(slugs), os.cpu_count() or 1)
+    if args.processes > 1:
+        run_schools_in_processes(slugs, args.processes, args.metrics, args.metrics_interval, **kwargs)
+    else:
+        for slug in slugs:
+            run_pipeline(slug, **kwargs)
+
+    elapsed_time = time.time() - start_time
+    print(f"\n Finished in {elapsed_time/60:.2f} minutes ({elapsed_time:.2f} seconds)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+#Dry-run planner: estimates what a pipeline run will cost before it is launched. A few cheap count
+#queries per school (meta.count and group_by, one page each) are combined with whatever the local
+#caches already hold, giving requests, bytes and wall time per school and stage at the configured
+#rates. The daily OpenAlex request budget is then split across the schools.
+#
+#   python planner.py mit ou                      # plan a full run
+#   python planner.py mit --refresh profiles      # as if these stages were forced to re-run
+#   python pipeline.py mit ou --plan              # same, from the runner
+import argparse
+import asyncio
+import importlib
+import math
+
+import pandas as pd
+
+import fastjson
+import pipeline
+from endpoints import OPENALEX_API
+from http_client import client_session, get_bytes
+from institutions import INSTITUTIONS, result_path, selected_slugs
+from ratelimit import AIMD_LIMITS, NOMINATIM_MAX_RPS, OPENALEX_MAX_RPS, openalex_limiter
+
+affiliations_mod = importlib.import_module("1_allschoolaffiliations")
+spans_mod        = importlib.import_module("3_eachschoolyears")
+
+# ── CONFIG ───────────────────────────────────────────────────────────────────
+OPENALEX_DAILY_BUDGET = 100_000  # requests/day OpenAlex allows one polite-pool client
+# typical response sizes, uncompressed
+BYTES_PER_WORK        = 6_000
+BYTES_PER_AUTHOR      = 4_000
+BYTES_PER_INSTITUTION = 3_000
+BYTES_PER_SPARQL      = 1_500
+BYTES_PER_NOMINATIM   = 1_000
+SPARQL_LATENCY_S      = 1.0   # Wikidata queries are slow; AIMD keeps at most 5 in flight
+UNCOVERED_SHARE       = 0.10  # authors whose profiles list no affiliation years (their works get crawled)
+NO_GEO_SHARE          = 0.05  # institutions OpenAlex has no coordinates for (Nominatim fallback)
+STAGE                 = "plan"  # metrics label
+
+# ── COUNT QUERIES ────────────────────────────────────────────────────────────
+async def count_query(session, path, params):
+    body = await get_bytes(session, f"{OPENALEX_API}/{path}", service="openalex", stage=STAGE,
+                           params=params, limiter=openalex_limiter())
+    return fastjson.loads(body)
+
+async def school_counts(session, slug):
+    """Works per publication year, authors ever affiliated and their distinct institutions."""
+    oa_id = INSTITUTIONS[slug]["oa_id"]
+    years = f"{affiliations_mod.YEAR_MIN}-{affiliations_mod.YEAR_MAX}"
+    works, authors = await asyncio.gather(
+        count_query(session, "works", {"filter": f"institutions.id:{oa_id},publication_year:{years}",
+                                       "group_by": "publication_year"}),
+        count_query(session, "authors", {"filter": f"affiliations.institution.id:{oa_id}",
+                                         "group_by": "affiliations.institution.id"}),
+    )
+    by_year = {int(g["key"]): g["count"] for g in works.get("group_by") or ()}
+    meta = authors.get("meta") or {}
+    return {"works_by_year": by_year, "authors": meta.get("count") or 0, "institutions": meta.get("groups_count")}
+
+async def all_counts(slugs):
+    async with client_session() as session:
+        return dict(zip(slugs, await asyncio.gather(*(school_counts(session, slug) for slug in slugs))))
+
+def local_counts(slug, counts):
+    """Prefer exact sizes from earlier runs' files over the API estimates."""
+    counts = dict(counts)
+    try:
+        # one row per stint since affiliations kept every stint; count the people
+        counts["authors"] = pd.read_csv(result_path(slug, "affiliations"), usecols=["author_id"], dtype=str)["author_id"].nunique()
+    except FileNotFoundError:
+        pass
+    for kind in ("merged_spans", "spans"):
+        try:
+            spans = pd.read_csv(result_path(slug, kind), usecols=["institution_id", "name"], dtype=str)
+        except FileNotFoundError:
+            continue
+        counts["institutions"], counts["names"] = spans["institution_id"].nunique(), spans["name"].nunique()
+        break
+    if counts.get("institutions") is None:
+        counts["institutions"] = counts["authors"]  # no group count: about one institution per author
+    counts.setdefault("names", counts["authors"])
+    return counts
+
+# ── COST MODEL ───────────────────────────────────────────────────────────────
+def affiliation_pages(by_year):
+    """Cursor pages script 1 walks: every year chunk costs at least one request."""
+    pages = 0
+    for start in range(affiliations_mod.YEAR_MIN, affiliations_mod.YEAR_MAX + 1, affiliations_mod.CHUNK_SIZE):
+        end = min(start + affiliations_mod.CHUNK_SIZE - 1, affiliations_mod.YEAR_MAX)
+        works = sum(by_year.get(y, 0) for y in range(start, end + 1))
+        pages += max(1, math.ceil(works / affiliations_mod.PER_PAGE))
+    return pages
+
+def crawl_pages(slug, n_authors):
+    """Works pages the span builder needs for authors without profile affiliation years."""
+    try:
+        profiles = pd.read_csv(result_path(slug, "profiles"), dtype=str)
+        covered  = pd.read_csv(result_path(slug, "affiliation_years"), usecols=["author_id"], dtype=str)["author_id"]
+    except (FileNotFoundError, ValueError):
+        n = round(n_authors * UNCOVERED_SHARE)
+        works = n * spans_mod.DEFAULT_WORKS_COUNT
+        return math.ceil(works / spans_mod.PER_PAGE) + math.ceil(n / spans_mod.MAX_IDS_PER_QUERY), works
+    profiles = profiles[~profiles["author_id"].isin(covered)]
+    counts = pd.to_numeric(profiles["works_count"], errors="coerce") if "works_count" in profiles \
+        else pd.Series(float("nan"), index=profiles.index)
+    works_counts = dict(zip(profiles["author_id"], counts.fillna(spans_mod.DEFAULT_WORKS_COUNT)))
+    groups = spans_mod.pack_authors(works_counts)
+    pages = sum(max(1, math.ceil(sum(works_counts[a] for a in g) / spans_mod.PER_PAGE)) for g in groups)
+    return pages, int(sum(works_counts.values()))
+
+def stage_costs(slug, counts):
+    """(stage, service, requests, bytes, seconds) for every stage that calls an API."""
+    n_works = sum(counts["works_by_year"].values())
+    pages = affiliation_pages(counts["works_by_year"])
+    crawl, crawl_works = crawl_pages(slug, counts["authors"])
+    wikidata_rps = AIMD_LIMITS["query.wikidata.org"][1] / SPARQL_LATENCY_S
+    no_geo = round(counts["institutions"] * NO_GEO_SHARE)
+    rows = [
+        ("affiliations", "openalex", pages, n_works * BYTES_PER_WORK, pages / OPENALEX_MAX_RPS),
+        ("profiles", "openalex", counts["authors"], counts["authors"] * BYTES_PER_AUTHOR, counts["authors"] / OPENALEX_MAX_RPS),
+        ("spans", "openalex", crawl, crawl_works * BYTES_PER_WORK, crawl / OPENALEX_MAX_RPS),
+        ("geocode", "openalex", counts["institutions"], counts["institutions"] * BYTES_PER_INSTITUTION,
+         counts["institutions"] / OPENALEX_MAX_RPS),
+        ("geocode", "nominatim", no_geo, no_geo * BYTES_PER_NOMINATIM, no_geo / NOMINATIM_MAX_RPS),
+        ("vital_dates", "wikidata", counts["names"], counts["names"] * BYTES_PER_SPARQL, counts["names"] / wikidata_rps),
+    ]
+    return pd.DataFrame(rows, columns=["stage", "service", "requests", "bytes", "seconds"])
+
+def cached_stages(slug, refresh=()):
+    """Stages the runner would load from its cache: cached output, not forced, and no upstream stage re-running."""
+    cached = set()
+    for name in _topological(pipeline.STAGES):
+        deps = pipeline.STAGES[name]["deps"]
+        if name not in refresh and (pipeline.CACHE_DIR / f"{slug}_{name}.pkl").exists() and all(d in cached for d in deps):
+            cached.add(name)
+    return cached
+
+def _topological(stages):
+    order, seen = [], set()
+    def visit(name):
+        if name not in seen:
+            seen.add(name)
+            for d in stages[name]["deps"]:
+                visit(d)
+            order.append(name)
+    for name in stages:
+        visit(name)
+    return order
+
+# ── BUDGET ───────────────────────────────────────────────────────────────────
+def allocate_budget(needs, budget=OPENALEX_DAILY_BUDGET):
+    """Split one day's requests across schools by max-min fairness.
+
+    Schools needing less than an equal share get all they need. What they
+    leave is shared equally among the rest, repeated until the budget is
+    spent, so small schools finish today and large ones get an even split.
+    """
+    alloc = {slug: 0 for slug in needs}
+    left = {slug: n for slug, n in needs.items() if n > 0}
+    while left and budget > 0:
+        share = budget // len(left)
+        if share == 0:
+            break
+        for slug, need in sorted(left.items(), key=lambda kv: kv[1]):
+            give = min(need, share)
+            alloc[slug] += give
+            budget -= give
+            left[slug] -= give
+        left = {slug: n for slug, n in left.items() if n > 0}
+    return alloc
+
+def plan(slugs, until=None, refresh=(), budget=OPENALEX_DAILY_BUDGET):
+    """Per-school, per-stage estimates and the day's OpenAlex allocation."""
+    counts = asyncio.run(all_counts(slugs))
+    wanted = pipeline.upstream(until or pipeline.STAGES)
+    frames = []
+    for slug in slugs:
+        costs = stage_costs(slug, local_counts(slug, counts[slug]))
+        costs = costs[costs["stage"].isin(wanted)]
+        costs.loc[costs["stage"].isin(cached_stages(slug, refresh)), ["requests", "bytes", "seconds"]] = 0
+        frames.append(costs.assign(school=slug))
+    costs = pd.concat(frames, ignore_index=True)[["school", "stage", "service", "requests", "bytes", "seconds"]]
+
+    needs = costs[costs["service"] == "openalex"].groupby("school")["requests"].sum().reindex(slugs, fill_value=0)
+    alloc = allocate_budget(needs.to_dict(), budget)
+    budget_df = pd.DataFrame({"school": slugs, "openalex_requests": needs.values,
+                              "allocated_today": [alloc[s] for s in slugs]})
+    budget_df["days"] = [math.ceil(n / a) if a else (0 if n == 0 else math.inf)
+                         for n, a in zip(budget_df["openalex_requests"], budget_df["allocated_today"])]
+    return costs, budget_df
+
+def print_plan(costs, budget_df, budget=OPENALEX_DAILY_BUDGET):
+    shown = costs.assign(MB=(costs["bytes"] / 1e6).round(1), minutes=(costs["seconds"] / 60).round(1))
+    print(shown.drop(columns=["bytes", "seconds"]).to_string(index=False))
+
+    over = costs[(costs["stage"] == "affiliations") & (costs["requests"] > affiliations_mod.MAX_REQUESTS)]
+    for slug in over["school"]:
+        print(f"⚠ {slug.upper()}: affiliations needs more than MAX_REQUESTS = {affiliations_mod.MAX_REQUESTS} pages and would stop early")
+
+    # stages of one school run concurrently but share one OpenAlex rate, so the OpenAlex part is serial
+    per_school = costs.groupby(["school", "service"])["seconds"].sum().groupby("school").max()
+    print(f"\nOpenAlex budget {budget:,} requests/day")
+    print(budget_df.assign(hours=budget_df["school"].map(per_school / 3600).round(2)).to_string(index=False))
+    total = int(budget_df["openalex_requests"].sum())
+    if total > budget:
+        print(f"⚠ {total:,} OpenAlex requests in total: about {math.ceil(total / budget)} days at this budget")
+    else:
+        print(f"✓ {total:,} OpenAlex requests in total, within one day's budget")
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate requests, bytes and time for a pipeline run.")
+    parser.add_argument("slugs", nargs="*", help="institution slugs (default: all registered)")
+    parser.add_argument("--until", nargs="*", choices=list(pipeline.STAGES), help="plan only these stages (and their inputs)")
+    parser.add_argument("--refresh", nargs="*", default=[], choices=list(pipeline.STAGES), help="plan as if these stages were forced")
+    parser.add_argument("--budget", type=int, default=OPENALEX_DAILY_BUDGET, help="OpenAlex requests per day to allocate")
+    args = parser.parse_args()
+
+    costs, budget_df = plan(selected_slugs(args.slugs), args.until, args.refresh, args.budget)
+    print_plan(costs, budget_df, args.budget)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#Rate limiter shared across processes, so several schools harvesting at once stay inside OpenAlex's
+#polite-pool limit together rather than each taking the full budget. Also the per-host adaptive
+#(AIMD) concurrency controllers that every HTTP client in a process goes through.
+import asyncio
+import collections
+import multiprocessing as mp
+import threading
+import time
+from urllib.parse import urlsplit
+
+OPENALEX_MAX_RPS  = 10   # combined requests/sec to api.openalex.org across all workers
+NOMINATIM_MAX_RPS = 1    # Nominatim's usage policy: at most one request per second
+
+class SharedRateLimiter:
+    """Hands out evenly spaced request slots from a counter in shared memory.
+
+    Pass the limiter to worker processes (e.g. through a pool initializer) and
+    every process draws from the same schedule.
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next_slot = mp.Value("d", 0.0)
+
+    def reserve(self):
+        """Claim the next slot and return how long to wait for it."""
+        with self._next_slot.get_lock():
+            now = time.time()
+            slot = max(now, self._next_slot.value)
+            self._next_slot.value = slot + self.interval
+        return slot - now
+
+    def wait(self):
+        time.sleep(self.reserve())
+
+    async def wait_async(self):
+        await asyncio.sleep(self.reserve())
+
+_openalex_limiter = None
+_nominatim_limiter = None
+
+def install(limiter):
+    """Use `limiter` for OpenAlex calls in this process (pool initializer)."""
+    global _openalex_limiter
+    _openalex_limiter = limiter
+
+def openalex_limiter():
+    global _openalex_limiter
+    if _openalex_limiter is None:
+        _openalex_limiter = SharedRateLimiter(OPENALEX_MAX_RPS)
+    return _openalex_limiter
+
+def nominatim_limiter():
+    global _nominatim_limiter
+    if _nominatim_limiter is None:
+        _nominatim_limiter = SharedRateLimiter(NOMINATIM_MAX_RPS)
+    return _nominatim_limiter
+
+# ── ADAPTIVE CONCURRENCY ─────────────────────────────────────────────────────
+# Per-host (initial, max) requests in flight. Wikidata's query service allows 5
+# parallel queries per client and Nominatim's usage policy allows 1.
+AIMD_LIMITS = {
+    "api.openalex.org":            (4, 32),
+    "query.wikidata.org":          (1, 5),
+    "nominatim.openstreetmap.org": (1, 1),
+}
+AIMD_DEFAULT  = (4, 32)
+AIMD_DECREASE = 0.5    # limit multiplier on 429/5xx/timeouts
+AIMD_COOLDOWN = 2.0    # seconds; one cut per burst of failures from the same window
+AIMD_SLOW     = 3.0    # latency above this multiple of the best seen holds the limit steady
+
+class AIMDController:
+    """Concurrency limit for one upstream host, tuned like TCP congestion control.
+
+    Every healthy response raises the limit by 1/limit, i.e. by about one slot
+    per round of requests. A 429, 5xx or dropped connection halves it, at most
+    once per cooldown. Responses much slower than the best latency seen hold
+    the limit where it is. Waiters can sit on different event loops (pipeline
+    stages run in threads), so they are woken with call_soon_threadsafe.
+    """
+    def __init__(self, host, initial, max_limit, min_limit=1):
+        self.host = host
+        self.limit = float(initial)
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.in_flight = 0
+        self.best_latency = None
+        self._last_cut = 0.0
+        self._lock = threading.Lock()
+        self._waiters = collections.deque()
+
+    async def acquire(self):
+        with self._lock:
+            if self.in_flight < int(self.limit) and not self._waiters:
+                self.in_flight += 1
+                return
+            loop = asyncio.get_running_loop()
+            fut = loop.create_future()
+            self._waiters.append((loop, fut))
+        try:
+            await fut  # the slot is handed over by release()
+        except asyncio.CancelledError:
+            with self._lock:
+                if (loop, fut) in self._waiters:
+                    self._waiters.remove((loop, fut))
+                    raise
+                self._free()  # handed over just as we were cancelled
+            raise
+
+    def release(self, ok=None, seconds=None):
+        """Free a slot and adapt: ok=False for 429/5xx/connection errors, None to just free it."""
+        with self._lock:
+            now = time.time()
+            if ok:
+                if seconds is not None:
+                    self.best_latency = seconds if self.best_latency is None else min(self.best_latency, seconds)
+                if seconds is None or seconds <= AIMD_SLOW * self.best_latency:
+                    self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            elif ok is False and now - self._last_cut > AIMD_COOLDOWN:
+                old, self.limit = self.limit, max(self.min_limit, self.limit * AIMD_DECREASE)
+                self._last_cut = now
+                print(f"⚠ {self.host}: backing off, concurrency {int(old)} → {int(self.limit)}")
+            self._free()
+
+    def _free(self):
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < int(self.limit):
+            loop, fut = self._waiters.popleft()
+            self.in_flight += 1
+            loop.call_soon_threadsafe(_hand_over, fut)
+
+def _hand_over(fut):
+    if not fut.done():
+        fut.set_result(None)
+
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+def controller_for(url):
+    """The AIMD controller for url's host, shared by every client in this process."""
+    host = urlsplit(url).hostname or ""
+    with _controllers_lock:
+        if host not in _controllers:
+            initial, max_limit = AIMD_LIMITS.get(host, AIMD_DEFAULT)
+            _controllers[host] = AIMDController(host, initial, max_limit)
+        return _controllers[host]
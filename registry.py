@@ -0,0 +1,110 @@
+#Cross-institution author registry. Schools share many authors (OU and OSU overlap heavily through
+#big collaborations), so instead of every school's run fetching the same profiles, works, coordinates
+#and Wikidata records again, this unions the schools' affiliation files and does each external
+#lookup once per unique author (or institution, or name). The results are then fanned back out
+#into each school's usual result files.
+#
+#   python registry.py ou osu                # stages 2-5 once for both schools
+#   python registry.py --registry-only       # just write results/author_registry.csv
+import argparse
+import asyncio
+import importlib
+import time
+
+import pandas as pd
+
+import ssdi
+from institutions import RESULTS_DIR, result_path, selected_slugs
+
+REGISTRY_CSV = RESULTS_DIR / "author_registry.csv"
+SLUG_SEP     = "|"
+
+profiles_mod = importlib.import_module("2_checkaffiliations")
+spans_mod    = importlib.import_module("3_eachschoolyears")
+hosp_mod     = importlib.import_module("4_get_hosp")
+vital_mod    = importlib.import_module("5_get_years")
+
+# ── REGISTRY ─────────────────────────────────────────────────────────────────
+def build_registry(affiliations):
+    """One row per unique author id with the schools that list it.
+
+    `affiliations` maps slug -> that school's *_only_affiliations frame.
+    """
+    frames = [df[["author_id", "name"]].assign(slug=slug) for slug, df in affiliations.items()]
+    both = pd.concat(frames, ignore_index=True)
+    return both.groupby("author_id", as_index=False, sort=False).agg(
+        name=("name", "first"),
+        slugs=("slug", lambda s: SLUG_SEP.join(dict.fromkeys(s))),
+    )
+
+def load_affiliations(slugs):
+    affiliations = {}
+    for slug in slugs:
+        fn = result_path(slug, "affiliations")
+        if fn.exists():
+            affiliations[slug] = pd.read_csv(fn, dtype=str)
+        else:
+            print(f"⚠ Skipping {slug.upper()}: {fn} not found.")
+    return affiliations
+
+# ── SHARED RUN ───────────────────────────────────────────────────────────────
+def run_shared(affiliations, registry):
+    """Stages 2-5 for several schools, one external lookup per unique author/institution/name.
+
+    Results fan back out by school: each school's spans, hospital and vital
+    files hold exactly the authors its own profile match kept.
+    """
+    slugs = list(affiliations)
+
+    # 2: fetch every profile once, then match per school straight from the cache
+    asyncio.run(profiles_mod.prefetch_profiles(registry["author_id"]))
+    profiles, years = {}, []
+    for slug in slugs:
+        profiles[slug], years_df = asyncio.run(profiles_mod.enrich_institution(affiliations[slug], slug))
+        profiles_mod.save_profiles(slug, profiles[slug], years_df)
+        years.append(years_df)
+
+    # 3: spans don't depend on the school, so crawl the union of authors once
+    all_profiles = pd.concat(profiles.values(), ignore_index=True).drop_duplicates("author_id")
+    all_years = pd.concat(years, ignore_index=True).drop_duplicates()
+    spans = spans_mod.build_spans(all_profiles, affiliation_years=all_years)
+    school_spans = {slug: spans[spans["author_id"].isin(profiles[slug]["author_id"])] for slug in slugs}
+    for slug, df in school_spans.items():
+        df.to_csv(result_path(slug, "spans"), index=False)
+
+    # 4: geocode each institution once across all schools
+    hosp = hosp_mod.load_hospitals()
+    coords = hosp_mod.geocode_institutions(spans)
+    with_hosp = {}
+    for slug, df in school_spans.items():
+        with_hosp[slug] = hosp_mod.attach_nearest_hospital(df, coords, hosp)
+        with_hosp[slug].to_csv(result_path(slug, "hospital"), index=False)
+
+    # 5: one Wikidata query per unique name, then SSDI death dates for the rest
+    lookup = ssdi.fill_death_dates(spans, vital_mod.fetch_vital_dates(spans[vital_mod.NAME_COL]))
+    for slug, df in with_hosp.items():
+        out = vital_mod.attach_vital_dates(df, lookup)
+        out.to_csv(result_path(slug, "vital"), index=False)
+        print(f"✓ {slug.upper()}: {len(profiles[slug])} profiles, {len(out)} panel rows")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run stages 2-5 once per unique author across schools.")
+    parser.add_argument("slugs", nargs="*", help="institution slugs (default: all registered)")
+    parser.add_argument("--registry-only", action="store_true", help="write the registry and stop")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    affiliations = load_affiliations(selected_slugs(args.slugs))
+    registry = build_registry(affiliations)
+    registry.to_csv(REGISTRY_CSV, index=False)
+    total = sum(len(df) for df in affiliations.values())
+    shared = registry["slugs"].str.contains(SLUG_SEP, regex=False).sum()
+    print(f"✓ Registry: {len(registry)} unique authors from {total} school rows ({shared} listed by several schools)")
+
+    if not args.registry_only:
+        run_shared(affiliations, registry)
+    elapsed_time = time.time() - start_time
+    print(f"\n Finished in {elapsed_time/60:.2f} minutes ({elapsed_time:.2f} seconds)")
+
+if __name__ == "__main__":
+    main()
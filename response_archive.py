@@ -0,0 +1,191 @@
+#Append-only archive of every raw API response, so derived tables can be rebuilt without the network.
+#Each process appends zstd frames of JSON lines ({key, service, url, status, fetched_at, body}) to its
+#own file under results/response_archive/, named by host, pid and a random suffix so queue workers on
+#several machines (workqueue.py) never share one. A SQLite index maps each request key to the file, the frame
+#offset and the line holding the latest response. In replay mode the fetchers read from the archive
+#instead of the network, so a change to process(), the span builder or script 1's authorship loop
+#re-runs in minutes of CPU:
+#
+#   python pipeline.py mit ou --replay                  # rebuild every school's outputs from the archive
+#   python response_archive.py                          # responses and bytes per service
+#
+#Set RESPONSE_ARCHIVE=0 to stop recording. Without the zstandard package frames are gzip'd instead.
+import argparse
+import atexit
+import gzip
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from institutions import RESULTS_DIR
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# ── CONFIG ───────────────────────────────────────────────────────────────────
+ARCHIVE_DIR   = RESULTS_DIR / "response_archive"
+INDEX_DB      = ARCHIVE_DIR / "index.sqlite"
+RECORDING     = os.environ.get("RESPONSE_ARCHIVE", "1") != "0"
+REPLAY        = os.environ.get("RESPONSE_ARCHIVE_REPLAY") == "1"
+FRAME_RECORDS = 256   # responses per compressed frame
+ZSTD_LEVEL    = 10
+FRAME_CACHE   = 64    # decompressed frames kept in memory while replaying
+SUFFIX        = ".jsonl.zst" if zstandard else ".jsonl.gz"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key        TEXT PRIMARY KEY,
+    service    TEXT NOT NULL,
+    file       TEXT NOT NULL,
+    offset     INTEGER NOT NULL,
+    size       INTEGER NOT NULL,
+    line       INTEGER NOT NULL,
+    fetched_at REAL NOT NULL
+)
+"""
+
+class NotArchived(LookupError):
+    """Replay asked for a request the archive has no response for."""
+
+def request_key(service, url, params=None):
+    """Stable key for a GET: service, path and the sorted query (URL and params merged).
+
+    The host is left out, so an archive recorded against one endpoint (see
+    endpoints.py) replays under another.
+    """
+    parts = urlsplit(url)
+    query = sorted(parse_qsl(parts.query, keep_blank_values=True) + [(k, str(v)) for k, v in (params or {}).items()])
+    return hashlib.sha1(f"{service}:{parts.path}?{urlencode(query)}".encode()).hexdigest()
+
+def _connect():
+    ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(INDEX_DB, timeout=60)
+    # rollback journal, not WAL: the results directory may be a network filesystem shared by several
+    # hosts. Set explicitly, since an index created in WAL mode stays in it.
+    conn.execute("PRAGMA journal_mode=DELETE")
+    conn.execute(SCHEMA)
+    return conn
+
+def _compress(data):
+    if zstandard:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return gzip.compress(data)
+
+def _decompress(file, data):
+    if file.endswith(".zst"):
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+# ── RECORDING ────────────────────────────────────────────────────────────────
+_lock = threading.Lock()
+_pending = []  # (key, service, fetched_at, json line)
+
+def record(service, url, body, params=None, status=200):
+    """Queue one response; every FRAME_RECORDS responses are written out as one frame."""
+    if not RECORDING or REPLAY:
+        return
+    key, now = request_key(service, url, params), time.time()
+    line = json.dumps({"key": key, "service": service, "url": url, "params": params,
+                       "status": status, "fetched_at": now, "body": body.decode("utf-8", "replace")})
+    with _lock:
+        _pending.append((key, service, now, line))
+        if len(_pending) >= FRAME_RECORDS:
+            _write_frame()
+
+def flush():
+    """Write out queued responses. Pool workers must call this; they skip atexit."""
+    with _lock:
+        if _pending:
+            _write_frame()
+
+_writer = (None, None)  # (pid, file name); a forked child gets a file of its own
+
+def _archive_file():
+    global _writer
+    if _writer[0] != os.getpid():
+        _writer = (os.getpid(), f"responses-{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}{SUFFIX}")
+    return _writer[1]
+
+def _write_frame():
+    # caller holds _lock
+    batch = _pending[:]
+    _pending.clear()
+    frame = _compress(("\n".join(line for *_, line in batch) + "\n").encode())
+    ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    file = _archive_file()
+    with open(ARCHIVE_DIR / file, "ab") as fh:
+        offset = fh.tell()
+        fh.write(frame)
+    with _connect() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO responses (key, service, file, offset, size, line, fetched_at) VALUES (?,?,?,?,?,?,?)",
+            [(key, service, file, offset, len(frame), i, ts) for i, (key, service, ts, _) in enumerate(batch)],
+        )
+    conn.close()
+
+atexit.register(flush)
+
+# ── REPLAY ───────────────────────────────────────────────────────────────────
+_local = threading.local()
+_frames = OrderedDict()  # (file, offset) -> list of json lines, least recently used first
+
+def enable_replay():
+    """Serve every fetch from the archive, here and in worker processes started later."""
+    global REPLAY
+    REPLAY = True
+    os.environ["RESPONSE_ARCHIVE_REPLAY"] = "1"
+
+def _index():
+    if getattr(_local, "conn", None) is None:
+        _local.conn = _connect()
+    return _local.conn
+
+def _frame(file, offset, size):
+    with _lock:
+        lines = _frames.get((file, offset))
+        if lines is not None:
+            _frames.move_to_end((file, offset))
+            return lines
+    with open(ARCHIVE_DIR / file, "rb") as fh:
+        fh.seek(offset)
+        lines = _decompress(file, fh.read(size)).decode().splitlines()
+    with _lock:
+        _frames[(file, offset)] = lines
+        while len(_frames) > FRAME_CACHE:
+            _frames.popitem(last=False)
+    return lines
+
+def replay(service, url, params=None):
+    """The archived body for this request; NotArchived if it was never fetched."""
+    row = _index().execute("SELECT file, offset, size, line FROM responses WHERE key = ?",
+                           (request_key(service, url, params),)).fetchone()
+    if row is None:
+        raise NotArchived(f"no archived response for {url}")
+    file, offset, size, line = row
+    return json.loads(_frame(file, offset, size)[line])["body"].encode()
+
+def stats():
+    with _connect() as conn:
+        rows = conn.execute("SELECT service, COUNT(*) FROM responses GROUP BY service").fetchall()
+    conn.close()
+    files = sorted(ARCHIVE_DIR.glob("responses-*.jsonl.*"))
+    return dict(rows), sum(f.stat().st_size for f in files), len(files)
+
+def main():
+    argparse.ArgumentParser(description="Summarise the raw-response archive (replay it with pipeline.py --replay).").parse_args()
+    counts, nbytes, nfiles = stats()
+    for service, n in sorted(counts.items()):
+        print(f"{service:10s} {n:>10,} responses")
+    print(f"{sum(counts.values()):,} responses in {nfiles} files, {nbytes / 1e6:.1f} MB compressed")
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,14 @@
 #!/bin/bash
-
-# Run 1.py
-echo "Running checkaffiliations2.py..."
-python /home/mm4958/openalex/checkaffiliations2.py
-
-# Check if 1.py succeeded
-if [ $? -ne 0 ]; then
-    echo "❌ checkaffiliations2.py failed. Exiting."
-    exit 1
+# Run every stage for the given schools (default: mit). See pipeline.py for options,
+# e.g. ./run_all.sh mit ou --refresh affiliations
+if [ $# -eq 0 ]; then
+    set -- mit
 fi
 
-# Run 2.pyu (assuming it's a typo and should be 2.py, or it's a valid script)
-echo "Running get_years5.py"
-python /home/mm4958/openalex/get_years5.py
+python "$(dirname "$0")/pipeline.py" "$@"
 
-# Check if 2.pyu succeeded
 if [ $? -ne 0 ]; then
-    echo "❌  get_years5.py failed."
+    echo "❌ pipeline failed."
     exit 1
 fi
 
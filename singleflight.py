@@ -0,0 +1,43 @@
+#Request coalescing for lookups that many coroutines can ask for at once. The first caller for a key
+#starts the fetch. Anyone asking for the same key while it is in flight awaits that same task instead
+#of sending another request, so duplicates cost nothing even before a cache has been filled.
+#
+#   profiles = SingleFlight("author_profiles")
+#   profile = await profiles.do(oid, fetch, session, oid)
+import asyncio
+import threading
+
+import metrics
+
+class SingleFlight:
+    """One in-flight task per key; concurrent callers for the key share its result.
+
+    Keys are forgotten as soon as their task finishes, so this only merges
+    overlapping calls. Results worth keeping belong in the caller's cache.
+    Tasks are tied to the event loop that started them. A caller on another
+    loop (pipeline stages run in threads) gets its own fetch.
+    """
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    async def do(self, key, fn, *args):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            call = self._calls.get(key)
+            shared = call is not None and call[0] is loop
+            if not shared:
+                task = loop.create_task(fn(*args))
+                self._calls[key] = (loop, task)
+                task.add_done_callback(lambda t: self._forget(key, t))
+            else:
+                task = call[1]
+        metrics.record_coalesced(self.name, shared)
+        # shielded so one cancelled caller doesn't cancel the fetch for the others
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        with self._lock:
+            if self._calls.get(key, (None, None))[1] is task:
+                del self._calls[key]
@@ -0,0 +1,151 @@
+#Offline harvest from a local OpenAlex snapshot instead of the API. Works and authors partitions
+#(data/<entity>/updated_date=*/part_*.gz, gzipped JSON lines) are streamed and filtered across a
+#process pool. The output is the same set of files scripts 1-3 write (affiliations, profiles,
+#affiliation years and spans), so a multi-school build runs at disk speed with zero API calls.
+#
+#   python snapshot.py mit ou --snapshot /data/openalex-snapshot --processes 8
+#   python snapshot.py mit --snapshot bench/fixtures/snapshot   # tiny fixture
+import argparse
+import asyncio
+import gzip
+import importlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+import fastjson
+from institutions import INSTITUTIONS, oa_url, result_path, selected_slugs
+from stints import segment_stints
+
+affiliations_mod = importlib.import_module("1_allschoolaffiliations")
+profiles_mod     = importlib.import_module("2_checkaffiliations")
+spans_mod        = importlib.import_module("3_eachschoolyears")
+
+# ── CONFIG ───────────────────────────────────────────────────────────────────
+SNAPSHOT_DIR   = Path(os.environ.get("OPENALEX_SNAPSHOT", "/home/mm4958/openalex/openalex-snapshot"))
+PROCESSES      = os.cpu_count() or 4
+# author fields the profile matcher reads; the rest of each record is dropped in the worker
+PROFILE_FIELDS = ("id", "display_name", "orcid", "ids", "works_count", "last_known_institutions", "affiliations")
+
+def partitions(root, entity):
+    return sorted((Path(root) / "data" / entity).glob("*/*.gz"))
+
+# ── WORKERS ──────────────────────────────────────────────────────────────────
+_wanted_authors = frozenset()
+
+def _init_author_scan(author_ids):
+    global _wanted_authors
+    _wanted_authors = frozenset(author_ids)
+
+def scan_works(path, inst_urls):
+    """(institution, author) -> [name, inst id, inst name, {years}] for one partition.
+
+    Lines that don't mention any of the institutions are skipped before parsing.
+    """
+    needles = [url.encode() for url in inst_urls]
+    wanted = {url.lower() for url in inst_urls}
+    year_min, year_max = affiliations_mod.YEAR_MIN, affiliations_mod.YEAR_MAX
+    found = {}
+    with gzip.open(path, "rb") as fh:
+        for line in fh:
+            if not any(n in line for n in needles):
+                continue
+            work = fastjson.decode_work(line)
+            year = work.publication_year
+            if not isinstance(year, int) or not (year_min <= year <= year_max):
+                continue
+            for auth in work.authorships:
+                aid = auth.author.id
+                if not aid:
+                    continue
+                for inst in auth.institutions:
+                    if inst.id and inst.id.lower() in wanted:
+                        found.setdefault((inst.id.lower(), aid),
+                                         [auth.author.display_name, inst.id, inst.display_name, set()])[3].add(year)
+    return found
+
+def scan_authors(path):
+    """Slim author records for the ids this worker was initialised with."""
+    found = {}
+    with gzip.open(path, "rb") as fh:
+        for line in fh:
+            author = fastjson.loads(line)
+            if author.get("id") in _wanted_authors:
+                found[author["id"]] = {k: author[k] for k in PROFILE_FIELDS if k in author}
+    return found
+
+# ── HARVEST ──────────────────────────────────────────────────────────────────
+def harvest_affiliations(root, slugs, processes=PROCESSES):
+    """Per-school frames shaped like 1_allschoolaffiliations.harvest_institution's output."""
+    inst_urls = [oa_url(slug) for slug in slugs]
+    parts = partitions(root, "works")
+    print(f"Scanning {len(parts)} works partitions for {len(slugs)} institutions")
+    merged = {}
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        for found in pool.map(scan_works, parts, [inst_urls] * len(parts)):
+            for key, (name, iid, iname, years) in found.items():
+                merged.setdefault(key, [name, iid, iname, set()])[3].update(years)
+
+    columns = affiliations_mod.AFFILIATION_COLUMNS
+    out = {}
+    for slug, url in zip(slugs, inst_urls):
+        occ = pd.DataFrame([(aid, name, iid, iname, year) for (inst, aid), (name, iid, iname, years) in merged.items()
+                            if inst == url.lower() for year in years], columns=columns[:-1])
+        occ["year_end_1"] = occ["year_start_1"]
+        out[slug] = segment_stints(occ, ["author_id"], start="year_start_1", end="year_end_1",
+                                   first=["name", "inst_1_id", "inst_1_name"])[columns]
+    return out
+
+def load_author_records(root, author_ids, processes=PROCESSES):
+    parts = partitions(root, "authors")
+    print(f"Scanning {len(parts)} authors partitions for {len(author_ids)} authors")
+    records = {}
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_author_scan, initargs=(author_ids,)) as pool:
+        for found in pool.map(scan_authors, parts):
+            records.update(found)
+    return records
+
+def build_school(slug, affiliations):
+    """Profiles, affiliation years and spans for one school from the primed author cache."""
+    profiles, years_df = asyncio.run(profiles_mod.enrich_institution(affiliations.astype(str), slug))
+    profiles = profiles_mod.save_profiles(slug, profiles, years_df)
+    # only the snapshot's affiliation years: authors without any get no spans rather than a works crawl
+    spans = spans_mod.spans_from_affiliation_years(profiles, years_df)
+    spans.to_csv(result_path(slug, "spans"), index=False)
+    return profiles, spans
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the harvest tables from a local OpenAlex snapshot.")
+    parser.add_argument("slugs", nargs="*", help="institution slugs (default: all registered)")
+    parser.add_argument("--snapshot", default=SNAPSHOT_DIR, type=Path, help="snapshot root holding data/works and data/authors")
+    parser.add_argument("--processes", type=int, default=PROCESSES, help="partitions scanned in parallel")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    slugs = selected_slugs(args.slugs)
+    affiliations = harvest_affiliations(args.snapshot, slugs, args.processes)
+    for slug, df in affiliations.items():
+        df.to_csv(result_path(slug, "affiliations"), index=False)
+        print(f"[{slug}] Saved {df['author_id'].nunique()} authors ({len(df)} stints) → {result_path(slug, 'affiliations')}")
+
+    author_ids = set().union(*(df["author_id"] for df in affiliations.values()))
+    records = load_author_records(args.snapshot, author_ids, args.processes)
+    # prime script 2's cache so the matcher runs without a single request
+    for aid in author_ids:
+        oid = aid.rsplit("/", 1)[-1]
+        profiles_mod.author_cache[oid] = records.get(aid) or {
+            "_error": "NotInSnapshot", "status": None, "message": "author missing from snapshot", "author_id": oid,
+        }
+
+    for slug in slugs:
+        profiles, spans = build_school(slug, affiliations[slug])
+        print(f"✓ {INSTITUTIONS[slug]['display']}: {len(profiles)} profiles, {len(spans)} spans")
+
+    elapsed_time = time.time() - start_time
+    print(f"\n Finished in {elapsed_time/60:.2f} minutes ({elapsed_time:.2f} seconds)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+#Death dates from a local Social Security Death Index extract. Wikidata only knows when famous
+#researchers died, while the SSDI lists most US deaths from 1962 to 2014. The extract is ingested
+#once into a blocked Parquet index: one row per record, keyed by surname, first initial and a
+#birth-year bucket. Researchers are then matched in bulk. Each name is expanded into the blocks its
+#plausible birth years cover, joined against the index, and the candidates are scored with array
+#operations. Only a unique best match fills a blank date, with no per-name network queries.
+#
+#   python ssdi.py --build ssdi_extract.csv          # ingest an extract (CSV or the fixed-width DMF file)
+#   python ssdi.py mit ou                            # fill death dates in each school's _v5 panel
+#   python pipeline.py mit                           # the "death_dates" stage does the same in the runner
+#   python bench/ssdi_check.py                       # match check against bench/fixtures/ssdi_sample.csv
+import argparse
+import importlib
+import re
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from disambiguate import name_tokens
+from institutions import RESULTS_DIR, result_path, selected_slugs
+
+vital_mod = importlib.import_module("5_get_years")
+NAME_COL  = vital_mod.NAME_COL
+
+# ── CONFIG ───────────────────────────────────────────────────────────────────
+SSDI_INDEX       = RESULTS_DIR / "ssdi_index"
+INGEST_CHUNK     = 1_000_000  # extract rows normalised per batch
+BIRTH_BUCKET     = 5          # years per birth-year block
+MIN_AGE_AT_START = 20         # age at the first affiliation year, when no birth date is known
+MAX_AGE_AT_START = 45
+DOB_TOLERANCE    = 1          # years either side of a Wikidata birth year
+POSTHUMOUS_YEARS = 2          # works keep appearing for a year or two after a death
+SSDI_FIRST_LEN   = 15         # first names are truncated to 15 characters in the DMF file
+NAME_JOINERS     = re.compile(r"(?<=\w)['’‘`-](?=\w)")  # O'BRIEN, GARCIA-LOPEZ stay one surname token
+
+# score parts; a match needs at least MIN_SCORE and no other candidate on the same score
+FIRST_EXACT      = 3
+FIRST_INITIAL    = 1
+MIDDLE_AGREES    = 1
+MIDDLE_CONFLICTS = -2
+BIRTH_YEAR_EXACT = 2
+MIN_SCORE        = FIRST_EXACT
+
+# Death Master File layout: 1-based (start, end) columns
+DMF_COLUMNS = {
+    "last_name":   (11, 30),
+    "first_name":  (35, 49),
+    "middle_name": (50, 64),
+    "death_date":  (66, 73),
+    "birth_date":  (74, 81),
+}
+
+INDEX_SCHEMA = pa.schema([
+    ("surname",     pa.string()),
+    ("initial",     pa.string()),
+    ("bucket",      pa.int16()),
+    ("first",       pa.string()),
+    ("middle",      pa.string()),
+    ("birth_year",  pa.int16()),
+    ("birth_date",  pa.string()),
+    ("death_date",  pa.string()),
+    ("death_year",  pa.int16()),
+])
+PARTITIONED_SCHEMA = INDEX_SCHEMA.append(pa.field("letter", pa.string()))
+
+# ── INGEST ───────────────────────────────────────────────────────────────────
+def read_extract(path, chunksize=INGEST_CHUNK):
+    """Chunks of an SSDI extract with last/first/middle name and birth/death dates.
+
+    CSV extracts need those five columns (any case); anything else is read as
+    the fixed-width Death Master File.
+    """
+    if str(path).lower().endswith(".csv"):
+        for chunk in pd.read_csv(path, dtype=str, chunksize=chunksize, keep_default_na=False):
+            chunk.columns = chunk.columns.str.strip().str.lower()
+            yield chunk[list(DMF_COLUMNS)]
+    else:
+        colspecs = [(start - 1, end) for start, end in DMF_COLUMNS.values()]
+        yield from pd.read_fwf(path, colspecs=colspecs, names=list(DMF_COLUMNS), dtype=str,
+                               chunksize=chunksize, keep_default_na=False)
+
+def iso_dates(dates):
+    """ISO dates from YYYY-MM-DD or the DMF's MMDDYYYY; unknown day or month ("00") is dropped."""
+    s = dates.fillna("").astype(str).str.strip()
+    dmf = s.str.fullmatch(r"\d{8}")
+    year  = s.str[:4].where(~dmf, s.str[4:])
+    month = s.str[5:7].where(~dmf, s.str[:2])
+    day   = s.str[8:10].where(~dmf, s.str[2:4])
+    iso = year.where(month.isin(["", "00"]), year + "-" + month)
+    iso = iso.where(month.isin(["", "00"]) | day.isin(["", "00"]), iso + "-" + day)
+    return iso.where(year.str.fullmatch(r"\d{4}"))
+
+def ssdi_tokens(name):
+    """name_tokens with apostrophes and hyphens inside a name joined, so "O'Brien" is one token, not "o brien"."""
+    return name_tokens(NAME_JOINERS.sub("", str(name)))
+
+def _tokens(names):
+    """ssdi_tokens for each value, computed once per distinct value."""
+    names = names.fillna("").astype(str)
+    uniq = names.unique()
+    return names.map(dict(zip(uniq, map(ssdi_tokens, uniq))))
+
+def normalise_extract(raw):
+    """Index rows for one chunk of extract records; records without a birth year are dropped."""
+    last  = _tokens(raw["last_name"])
+    first = _tokens(raw["first_name"])
+    birth, death = iso_dates(raw["birth_date"]), iso_dates(raw["death_date"])
+    out = pd.DataFrame({
+        "surname":    last.str[-1],
+        "first":      first.str[0].fillna("").str[:SSDI_FIRST_LEN],
+        "middle":     _tokens(raw["middle_name"]).str[0].fillna("").str[:1],
+        "birth_year": pd.to_numeric(birth.str[:4], errors="coerce"),
+        "birth_date": birth,
+        "death_date": death,
+        "death_year": pd.to_numeric(death.str[:4], errors="coerce"),
+    })
+    out = out[out["surname"].notna() & (out["first"] != "") & out["birth_year"].notna()]
+    out["initial"] = out["first"].str[0]
+    out["bucket"]  = out["birth_year"] // BIRTH_BUCKET
+    return out[INDEX_SCHEMA.names]
+
+def build_index(extract, index_dir=SSDI_INDEX, chunksize=INGEST_CHUNK):
+    """Ingest an extract into a Parquet dataset, hive-partitioned on the surname's first letter."""
+    rows = 0
+    def batches():
+        nonlocal rows
+        for raw in read_extract(extract, chunksize):
+            chunk = normalise_extract(raw).sort_values(["surname", "initial", "bucket"])
+            chunk["letter"] = chunk["surname"].str[0]
+            rows += len(chunk)
+            yield pa.RecordBatch.from_pandas(chunk, schema=PARTITIONED_SCHEMA, preserve_index=False)
+
+    if index_dir.exists():
+        shutil.rmtree(index_dir)  # a rebuild replaces the whole index
+    ds.write_dataset(
+        batches(), index_dir, schema=PARTITIONED_SCHEMA, format="parquet",
+        partitioning=ds.partitioning(pa.schema([("letter", pa.string())]), flavor="hive"),
+    )
+    print(f"✓ Indexed {rows:,} SSDI records → {index_dir}")
+    return rows
+
+def load_blocks(surnames, index_dir=SSDI_INDEX):
+    """Index rows for these surnames only; None if no index has been built."""
+    if not index_dir.exists():
+        return None
+    surnames = sorted(set(surnames))
+    letters = sorted({s[0] for s in surnames})
+    dataset = ds.dataset(index_dir, format="parquet", partitioning="hive")
+    table = dataset.to_table(columns=INDEX_SCHEMA.names,
+                             filter=pc.field("letter").isin(letters) & pc.field("surname").isin(surnames))
+    return table.to_pandas()
+
+# ── MATCHING ─────────────────────────────────────────────────────────────────
+def researchers(spans, lookup):
+    """One row per name still missing a death date, with its name parts and birth-year window.
+
+    The window is the Wikidata birth year give or take DOB_TOLERANCE, or else
+    the ages MIN_AGE_AT_START to MAX_AGE_AT_START at the first affiliation year.
+    """
+    years = spans.assign(year_start=pd.to_numeric(spans["year_start"], errors="coerce"),
+                         year_end=pd.to_numeric(spans["year_end"], errors="coerce"))
+    people = years.groupby(NAME_COL)[["year_start", "year_end"]].agg({"year_start": "min", "year_end": "max"})
+    people.columns = ["first_year", "last_year"]
+    known = lookup.set_index(NAME_COL)
+    people = people[~people.index.isin(known.index[known["date_of_death"].notna()])]
+    people["dob_year"] = pd.to_numeric(
+        people.index.map(known["date_of_birth"]).astype("string").str[:4], errors="coerce")
+
+    tokens = _tokens(people.index.to_series())
+    people = people[tokens.str.len() >= 2]
+    tokens = tokens[people.index]
+    people["surname"] = tokens.str[-1]
+    people["first"]   = tokens.str[0].str[:SSDI_FIRST_LEN]
+    # only a token strictly between the first name and the (joined) surname is a middle name
+    people["middle"]  = tokens.map(lambda t: t[1][0] if len(t) > 2 else "")
+    people["initial"] = people["first"].str[0]
+    has_dob = people["dob_year"].notna()
+    people["birth_lo"] = people["dob_year"].sub(DOB_TOLERANCE).where(has_dob, people["first_year"] - MAX_AGE_AT_START)
+    people["birth_hi"] = people["dob_year"].add(DOB_TOLERANCE).where(has_dob, people["first_year"] - MIN_AGE_AT_START)
+    return people.dropna(subset=["birth_lo"]).rename_axis(NAME_COL).reset_index()
+
+def candidate_pairs(people, blocks):
+    """Index records sharing a block with each researcher, inside the birth window and alive while publishing.
+
+    A full first name is joined on that name and on the records that only give
+    its initial; an initial-only researcher is joined on the initial. Records
+    whose first names disagree never become pairs, so a common surname costs
+    no more than its namesakes.
+    """
+    lo = (people["birth_lo"] // BIRTH_BUCKET).astype(int).to_numpy()
+    counts = (people["birth_hi"] // BIRTH_BUCKET).astype(int).to_numpy() - lo + 1
+    rows = np.repeat(np.arange(len(people)), counts)
+    keys = people[["surname", "initial", "first"]].iloc[rows].reset_index(drop=True)
+    keys["bucket"] = lo[rows] + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    keys["person"] = rows
+
+    blocks = blocks.astype({"bucket": int})
+    full = keys[keys["first"].str.len() > 1].drop(columns="initial")
+    cand = pd.concat([
+        full.merge(blocks, on=["surname", "first", "bucket"]),
+        full.assign(first=full["first"].str[0]).merge(blocks, on=["surname", "first", "bucket"]),
+        keys[keys["first"].str.len() == 1].drop(columns="first").merge(blocks, on=["surname", "initial", "bucket"]),
+    ], ignore_index=True)
+    p = people.iloc[cand["person"]].reset_index(drop=True)
+    cand = cand.join(p[[NAME_COL, "dob_year", "birth_lo", "birth_hi", "last_year"]]) \
+               .join(p[["first", "middle"]].add_prefix("r_"))
+    alive = cand["last_year"].isna() | (cand["death_year"] >= cand["last_year"] - POSTHUMOUS_YEARS)
+    born  = cand["birth_year"].between(cand["birth_lo"], cand["birth_hi"])
+    return cand[alive & born & cand["death_year"].notna()].reset_index(drop=True)
+
+def score_candidates(cand):
+    """Score each pair: first name, middle initial and, where Wikidata has one, the birth year.
+
+    Full first names that agree score FIRST_EXACT; an initial on either side
+    only tells us the initial agrees and scores FIRST_INITIAL.
+    """
+    r_first, s_first = cand["r_first"].to_numpy(str), cand["first"].to_numpy(str)
+    initial_only = (np.char.str_len(r_first) == 1) | (np.char.str_len(s_first) == 1)
+    exact = r_first == s_first
+    score = np.where(exact & ~initial_only, FIRST_EXACT, np.where(initial_only, FIRST_INITIAL, -1))
+
+    r_mid, s_mid = cand["r_middle"].to_numpy(str), cand["middle"].fillna("").to_numpy(str)
+    both = (r_mid != "") & (s_mid != "")
+    score += np.where(both & (r_mid == s_mid), MIDDLE_AGREES, np.where(both, MIDDLE_CONFLICTS, 0))
+    score += np.where(cand["birth_year"].to_numpy(float) == cand["dob_year"].to_numpy(float), BIRTH_YEAR_EXACT, 0)
+    out = cand.assign(score=score)
+    return out[out["score"] > 0]
+
+def best_matches(scored):
+    """Each name's top-scoring record, kept only when it scores MIN_SCORE and has no tie."""
+    top = scored.groupby(NAME_COL)["score"].transform("max")
+    ties = (scored["score"] == top).groupby(scored[NAME_COL]).transform("sum")
+    best = scored[(scored["score"] == top) & (ties == 1) & (top >= MIN_SCORE)]
+    return best.set_index(NAME_COL)[["birth_date", "death_date", "score"]]
+
+def fill_death_dates(spans, lookup, index_dir=SSDI_INDEX):
+    """The per-name vital lookup with blank death (and birth) dates filled from the SSDI index.
+
+    `ssdi_match` marks the names whose dates came from the index.
+    """
+    start = time.time()
+    lookup = lookup.copy()
+    lookup["ssdi_match"] = False
+    people = researchers(spans, lookup)
+    blocks = load_blocks(people["surname"], index_dir)
+    if blocks is None:
+        print(f"⚠ No SSDI index at {index_dir}; build one with `python ssdi.py --build <extract>`.")
+        return lookup
+    best = best_matches(score_candidates(candidate_pairs(people, blocks)))
+
+    # names in the spans that Wikidata never returned still get a lookup row
+    missing = best.index.difference(lookup[NAME_COL])
+    lookup = pd.concat([lookup, pd.DataFrame({NAME_COL: missing, "ssdi_match": False})], ignore_index=True)
+    hit = lookup[NAME_COL].isin(best.index) & lookup["date_of_death"].isna()
+    names = lookup.loc[hit, NAME_COL]
+    lookup.loc[hit, "date_of_death"] = names.map(best["death_date"]).values
+    lookup.loc[hit, "date_of_birth"] = lookup.loc[hit, "date_of_birth"].fillna(names.map(best["birth_date"]))
+    lookup.loc[hit, "ssdi_match"] = True
+    print(f"✓ SSDI: {hit.sum()} of {len(people)} names without a death date matched "
+          f"({len(blocks):,} index records searched) in {time.time() - start:.1f}s")
+    return lookup
+
+def main():
+    parser = argparse.ArgumentParser(description="Match researchers to a local SSDI extract for death dates.")
+    parser.add_argument("slugs", nargs="*", help="institution slugs (default: all registered)")
+    parser.add_argument("--build", metavar="EXTRACT", help="ingest this SSDI extract into the index first")
+    args = parser.parse_args()
+
+    if args.build:
+        build_index(args.build)
+        if not args.slugs:
+            return
+    for slug in selected_slugs(args.slugs):
+        panel_csv = result_path(slug, "vital")
+        try:
+            panel = pd.read_csv(panel_csv, dtype=str)
+        except FileNotFoundError:
+            print(f"⚠ Skipping {slug.upper()}: {panel_csv} not found.")
+            continue
+        cols = [NAME_COL, *vital_mod.VITAL_COLS]
+        lookup = fill_death_dates(panel, panel[cols].drop_duplicates(NAME_COL).dropna(subset=[NAME_COL]))
+        panel = vital_mod.attach_vital_dates(panel.drop(columns=vital_mod.VITAL_COLS + ["ssdi_match"], errors="ignore"), lookup)
+        panel.to_csv(panel_csv, index=False)
+        print(f"✓ {slug.upper()}: {panel['ssdi_match'].sum()} panel rows with SSDI dates → {panel_csv.name}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+#Splits each author–institution relationship into stints. Someone at MIT 1980–82 and again 2010–15 is
+#two appointments, not one 35-year span. Year occurrences (or earlier stints) are sorted once, and a
+#new stint starts wherever the gap since the group's latest year exceeds MAX_GAP_YEARS. Everything is
+#NumPy over the whole table, so the multi-school occurrence table segments in seconds.
+import numpy as np
+import pandas as pd
+
+MAX_GAP_YEARS = 3  # missing years tolerated inside one stint; a longer gap starts a new one
+
+def segment_stints(occ, keys, start="year_start", end="year_end", first=(), max_gap=MAX_GAP_YEARS):
+    """One row per stint of each `keys` group.
+
+    Rows of `occ` are year ranges: a single year has start == end, and the
+    stints of an earlier run can be fed back in with new years. Ranges that
+    overlap or sit at most `max_gap` missing years apart merge. Columns in
+    `first` keep their value from the stint's earliest range. Returns the
+    keys, `first`, start, end and `stint` (1, 2, ... within each group).
+    Rows without years are dropped.
+    """
+    keys, first = list(keys), list(first)
+    s = pd.to_numeric(occ[start], errors="coerce").to_numpy(float)
+    e = pd.to_numeric(occ[end], errors="coerce").to_numpy(float)
+    valid = ~(np.isnan(s) | np.isnan(e))
+    frame = occ.loc[valid, keys + first]
+    s, e = s[valid], e[valid]
+    if not len(frame):
+        return pd.DataFrame(columns=keys + first + [start, end, "stint"])
+
+    codes = frame.groupby(keys, sort=False, dropna=False).ngroup().to_numpy()
+    order = np.lexsort((s, codes))
+    codes, s, e = codes[order], s[order], e[order]
+    # furthest year reached so far in each group; groups are contiguous after the sort
+    reach = pd.Series(e).groupby(codes).cummax().to_numpy()
+    new = np.ones(len(codes), dtype=bool)
+    new[1:] = (codes[1:] != codes[:-1]) | (s[1:] > reach[:-1] + max_gap + 1)
+    heads = np.flatnonzero(new)
+
+    out = frame.iloc[order[heads]].reset_index(drop=True)
+    out[start] = s[heads].astype(int)
+    out[end]   = np.maximum.reduceat(e, heads).astype(int)
+    out["stint"] = pd.Series(codes[heads]).groupby(codes[heads]).cumcount().to_numpy() + 1
+    return out
@@ -0,0 +1,30 @@
+#Bookkeeping for incremental refreshes: when each stage last synced each school, so the next run only
+#asks OpenAlex for works that changed since then.
+import json
+from datetime import datetime, timezone
+
+from http_client import OPENALEX_API_KEY
+from institutions import RESULTS_DIR
+
+SYNC_STATE_JSON = RESULTS_DIR / "sync_state.json"
+# OpenAlex only honours from_updated_date for API-key users (set OPENALEX_API_KEY);
+# without a key, from_created_date works for everyone but only picks up newly added works.
+UPDATED_FILTER = "from_updated_date" if OPENALEX_API_KEY else "from_created_date"
+
+def _load():
+    if SYNC_STATE_JSON.exists():
+        return json.loads(SYNC_STATE_JSON.read_text())
+    return {}
+
+def last_sync(slug, stage):
+    """ISO date of the last successful `stage` run for `slug`, or None."""
+    return _load().get(slug, {}).get(stage)
+
+def record_sync(slug, stage, when):
+    state = _load()
+    state.setdefault(slug, {})[stage] = when
+    SYNC_STATE_JSON.write_text(json.dumps(state, indent=2, sort_keys=True))
+
+def sync_started():
+    """Today's date in UTC; taken before fetching so nothing updated mid-run is skipped next time."""
+    return datetime.now(timezone.utc).date().isoformat()
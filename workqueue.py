@@ -0,0 +1,354 @@
+#Coordinator/worker mode for harvesting one school across several machines. A coordinator splits
+#scripts 1-3 into shards: institution × year range for the affiliation harvest, then author-id batches
+#for profiles and spans. Shards go into a SQLite queue on the shared results disk. Workers on any node
+#lease a shard, keep the lease alive with heartbeats while they run it, and commit the result file.
+#A worker that dies stops heartbeating. Its lease expires and another worker picks the shard up.
+#Each run writes its result under the shard id and its lease token, and only the current lease
+#holder can commit. A worker that lost its lease has its commit refused and deletes its file, so a
+#late or duplicate run never replaces a published result. When every shard of a phase is done, the
+#coordinator merges the results into the usual CSVs and queues the next phase.
+#
+#   python workqueue.py coordinator mit ou          # queue the shards and merge phases as they finish
+#   python workqueue.py worker                      # on each node (OPENALEX_MAILTO per node), until idle
+#   python workqueue.py status                      # shards per school, phase and state
+#   python workqueue.py retry                       # put failed shards back in the queue
+#
+#Once a school's spans are merged, continue with disambiguate.py, 4_get_hosp.py, ... as usual.
+#The results directory must be shared by all nodes (NFS or similar). SQLite's WAL mode needs shared
+#memory, which network filesystems lack, so the queue uses the rollback journal and BEGIN IMMEDIATE.
+import argparse
+import asyncio
+import importlib
+import json
+import math
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+import planner
+import response_archive
+from institutions import INSTITUTIONS, RESULTS_DIR, result_path, selected_slugs
+
+affiliations_mod = importlib.import_module("1_allschoolaffiliations")
+profiles_mod     = importlib.import_module("2_checkaffiliations")
+spans_mod        = importlib.import_module("3_eachschoolyears")
+
+# ── CONFIG ───────────────────────────────────────────────────────────────────
+QUEUE_DB          = RESULTS_DIR / "work_queue.sqlite"
+SHARD_DIR         = RESULTS_DIR / "shards"
+PAGES_PER_SHARD   = 200    # affiliation harvest: works pages per year-range shard
+YEARS_PER_SHARD   = 5      # ... or years per shard when the works count query fails
+AUTHORS_PER_SHARD = 2_000  # profiles and spans: authors per shard
+LEASE_SECONDS     = 300    # a shard whose lease runs out goes back to the queue
+HEARTBEAT_SECONDS = 60
+MAX_ATTEMPTS      = 3      # leases per shard before it is marked failed
+POLL_SECONDS      = 10
+IDLE_EXIT_SECONDS = 900    # workers stop after this long without work
+PHASES            = ["affiliations", "profiles", "spans"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shards (
+    id            TEXT PRIMARY KEY,
+    slug          TEXT NOT NULL,
+    phase         TEXT NOT NULL,
+    payload       TEXT NOT NULL,
+    state         TEXT NOT NULL DEFAULT 'pending',  -- pending, leased, done, failed
+    worker        TEXT,
+    token         TEXT,
+    lease_expires REAL,
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    error         TEXT,
+    result        TEXT,
+    created_at    REAL NOT NULL,
+    finished_at   REAL
+)
+"""
+
+def _connect():
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(QUEUE_DB, timeout=60, isolation_level=None)  # transactions are explicit
+    conn.execute(SCHEMA)
+    return conn
+
+def enqueue(conn, slug, phase, payloads):
+    """Add one shard per payload; shard ids are deterministic, so re-queueing is a no-op."""
+    now = time.time()
+    rows = [(f"{slug}/{phase}/{i:05d}", slug, phase, json.dumps(p), now) for i, p in enumerate(payloads)]
+    conn.execute("BEGIN IMMEDIATE")
+    conn.executemany("INSERT OR IGNORE INTO shards (id, slug, phase, payload, created_at) VALUES (?,?,?,?,?)", rows)
+    conn.execute("COMMIT")
+    return len(rows)
+
+# ── LEASES ───────────────────────────────────────────────────────────────────
+def lease(conn, worker):
+    """Claim the oldest pending (or expired) shard: (id, slug, phase, payload, token), or None."""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("UPDATE shards SET state = 'failed', error = 'lease expired' "
+                     "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?", (now, MAX_ATTEMPTS))
+        row = conn.execute("SELECT id, slug, phase, payload FROM shards "
+                           "WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?) "
+                           "ORDER BY created_at, id LIMIT 1", (now,)).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        token = uuid.uuid4().hex
+        conn.execute("UPDATE shards SET state = 'leased', worker = ?, token = ?, lease_expires = ?, "
+                     "attempts = attempts + 1 WHERE id = ?", (worker, token, now + LEASE_SECONDS, row[0]))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    shard_id, slug, phase, payload = row
+    return shard_id, slug, phase, json.loads(payload), token
+
+class Heartbeat(threading.Thread):
+    """Extends a lease every HEARTBEAT_SECONDS until stopped; notes it if the lease was lost."""
+    def __init__(self, shard_id, token):
+        super().__init__(daemon=True)
+        self.shard_id, self.token = shard_id, token
+        self.stopped = threading.Event()
+        self.lost = False
+
+    def run(self):
+        conn = _connect()
+        while not self.stopped.wait(HEARTBEAT_SECONDS):
+            cur = conn.execute("UPDATE shards SET lease_expires = ? WHERE id = ? AND token = ? AND state = 'leased'",
+                               (time.time() + LEASE_SECONDS, self.shard_id, self.token))
+            if cur.rowcount == 0 and not self.lost:
+                self.lost = True
+                print(f"⚠ [{self.shard_id}] lease lost; another worker may finish it too")
+        conn.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def commit(conn, shard_id, token, result):
+    """Mark the shard done with its result file; False if the lease has passed to another worker."""
+    cur = conn.execute("UPDATE shards SET state = 'done', result = ?, error = NULL, finished_at = ? "
+                       "WHERE id = ? AND token = ? AND state = 'leased'", (str(result), time.time(), shard_id, token))
+    return cur.rowcount == 1
+
+def fail(conn, shard_id, token, error):
+    """Give the shard back (or fail it after MAX_ATTEMPTS), unless our lease has passed to someone else."""
+    conn.execute("UPDATE shards SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                 "error = ?, lease_expires = NULL WHERE id = ? AND token = ? AND state = 'leased'",
+                 (MAX_ATTEMPTS, error, shard_id, token))
+
+# ── SHARD WORK ───────────────────────────────────────────────────────────────
+def run_affiliations(slug, payload):
+    # shards are sized by page count, so the harvest's own request cap is off
+    df = asyncio.run(affiliations_mod.harvest_institution(INSTITUTIONS[slug]["oa_id"], years=tuple(payload["years"]),
+                                                          max_requests=None))
+    if not df.attrs.get("complete", True):
+        raise RuntimeError(f"harvest of {payload['years']} stopped early")
+    return df
+
+def run_profiles(slug, payload):
+    aff = pd.read_csv(result_path(slug, "affiliations"), dtype=str)
+    batch = aff[aff["author_id"].isin(payload["author_ids"])]
+    # errors come back with the result; merge_phase records them once for the school
+    profiles, years_df = asyncio.run(profiles_mod.enrich_institution(batch, slug, save_errors=False))
+    errors = profiles.attrs.pop("errors")
+    return {"profiles": profiles, "years": years_df, **errors}
+
+def run_spans(slug, payload):
+    profiles = pd.read_csv(result_path(slug, "profiles"), dtype=str)
+    batch = profiles[profiles["author_id"].isin(payload["author_ids"])]
+    spans = spans_mod.build_spans(batch, affiliation_years=spans_mod.load_affiliation_years(slug))
+    if not spans.attrs.get("complete", True):
+        raise RuntimeError("some works queries failed")
+    return spans
+
+SHARD_RUNNERS = {"affiliations": run_affiliations, "profiles": run_profiles, "spans": run_spans}
+
+def shard_file(shard_id, token):
+    return SHARD_DIR / f"{shard_id.replace('/', '__')}.{token}.pkl"
+
+def run_shard(shard_id, slug, phase, payload, token):
+    """Run one shard and write its result to a file of this lease's own; commit() publishes it."""
+    result = SHARD_RUNNERS[phase](slug, payload)
+    out = shard_file(shard_id, token)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_name(out.name + ".tmp")
+    pd.to_pickle(result, tmp)
+    os.replace(tmp, out)  # never a half-written file under the final name
+    response_archive.flush()
+    return out
+
+def work(worker=None, idle_exit=IDLE_EXIT_SECONDS):
+    """Lease and run shards until nothing has been available for `idle_exit` seconds."""
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    conn = _connect()
+    idle_since, done = time.time(), 0
+    while True:
+        claimed = lease(conn, worker)
+        if claimed is None:
+            if time.time() - idle_since > idle_exit:
+                break
+            time.sleep(POLL_SECONDS)
+            continue
+        shard_id, slug, phase, payload, token = claimed
+        print(f"[{worker}] {shard_id} leased")
+        heartbeat = Heartbeat(shard_id, token)
+        heartbeat.start()
+        start = time.time()
+        try:
+            out = run_shard(shard_id, slug, phase, payload, token)
+        except BaseException as e:
+            # Ctrl-C hands the shard back too, rather than leaving it until the lease runs out
+            fail(conn, shard_id, token, f"{type(e).__name__}: {e}")
+            if not isinstance(e, Exception):
+                raise
+            print(f"❌ [{worker}] {shard_id} failed: {e}")
+        else:
+            if commit(conn, shard_id, token, out):
+                done += 1
+                print(f"✓ [{worker}] {shard_id} done in {time.time() - start:.1f}s")
+            else:
+                out.unlink(missing_ok=True)
+                print(f"⚠ [{worker}] {shard_id} lease passed to another worker; result discarded")
+        finally:
+            heartbeat.stop()
+        idle_since = time.time()
+    conn.close()
+    print(f"[{worker}] idle for {idle_exit}s, exiting after {done} shards")
+
+# ── COORDINATOR ──────────────────────────────────────────────────────────────
+def affiliation_payloads(slug):
+    """Year ranges of about PAGES_PER_SHARD works pages each, from the works-per-year count query.
+
+    A single year with more pages than that is still one shard.
+    """
+    year_min, year_max = affiliations_mod.YEAR_MIN, affiliations_mod.YEAR_MAX
+    try:
+        by_year = asyncio.run(planner.all_counts([slug]))[slug]["works_by_year"]
+    except Exception as e:
+        print(f"⚠ [{slug}] works count query failed ({e}); {YEARS_PER_SHARD}-year shards instead")
+        return [{"years": [start, min(start + YEARS_PER_SHARD - 1, year_max)]}
+                for start in range(year_min, year_max + 1, YEARS_PER_SHARD)]
+    payloads, start, pages = [], year_min, 0
+    for year in range(year_min, year_max + 1):
+        year_pages = math.ceil(by_year.get(year, 0) / affiliations_mod.PER_PAGE)
+        if pages and pages + year_pages > PAGES_PER_SHARD:
+            payloads.append({"years": [start, year - 1]})
+            start, pages = year, 0
+        pages += year_pages
+    payloads.append({"years": [start, year_max]})
+    return payloads
+
+def author_payloads(author_ids):
+    ids = sorted(pd.unique(author_ids))
+    return [{"author_ids": ids[i:i + AUTHORS_PER_SHARD]} for i in range(0, len(ids), AUTHORS_PER_SHARD)]
+
+def _results(conn, slug, phase):
+    rows = conn.execute("SELECT result FROM shards WHERE slug = ? AND phase = ? ORDER BY id", (slug, phase)).fetchall()
+    return [pd.read_pickle(r) for (r,) in rows]
+
+def merge_phase(conn, slug, phase):
+    """Fold a finished phase's shard results into the school's CSVs; the next phase's payloads."""
+    results = _results(conn, slug, phase)
+    if phase == "affiliations":
+        # stints that cross a shard's year boundary are joined up again here
+        aff = affiliations_mod.merge_affiliations(results[0], pd.concat(results[1:], ignore_index=True)) \
+            if len(results) > 1 else results[0]
+        aff.to_csv(result_path(slug, "affiliations"), index=False)
+        print(f"✓ [{slug}] merged {len(results)} affiliation shards: {aff['author_id'].nunique()} authors")
+        return author_payloads(aff["author_id"])
+    if phase == "profiles":
+        profiles = pd.concat([r["profiles"] for r in results], ignore_index=True)
+        years_df = pd.concat([r["years"] for r in results], ignore_index=True)
+        profiles_mod.save_profiles(slug, profiles, years_df)
+        failed = pd.concat([r["failed"] for r in results], ignore_index=True)
+        profiles_mod.record_errors(slug, failed, [a for r in results for a in r["resolved"]], results[0]["input_columns"])
+        print(f"✓ [{slug}] merged {len(results)} profile shards: {profiles['author_id'].nunique()} authors")
+        return author_payloads(profiles["author_id"])
+    spans = pd.concat(results, ignore_index=True)
+    spans.to_csv(result_path(slug, "spans"), index=False)
+    print(f"✓ [{slug}] merged {len(results)} span shards: {len(spans)} spans → {result_path(slug, 'spans').name}")
+    return None
+
+def progress(conn, slug):
+    """{phase: {state: shards}} for one school."""
+    out = {}
+    for phase, state, n in conn.execute("SELECT phase, state, COUNT(*) FROM shards WHERE slug = ? GROUP BY phase, state", (slug,)):
+        out.setdefault(phase, {})[state] = n
+    return out
+
+def advance(conn, slug):
+    """Merge and queue whatever is ready for one school; True once its spans are merged."""
+    counts = progress(conn, slug)
+    if not counts:
+        enqueue(conn, slug, "affiliations", affiliation_payloads(slug))
+        return False
+    current = [p for p in PHASES if p in counts][-1]  # phases are queued in order
+    states = counts[current]
+    if states.get("failed"):
+        print(f"❌ [{slug}] {states['failed']} {current} shards failed; `python workqueue.py retry` re-queues them")
+        return False
+    if set(states) != {"done"}:
+        return False
+    payloads = merge_phase(conn, slug, current)
+    if payloads is None:
+        return True
+    nxt = PHASES[PHASES.index(current) + 1]
+    if not payloads:
+        print(f"⚠ [{slug}] no authors left for {nxt}")
+        return True
+    print(f"[{slug}] queued {enqueue(conn, slug, nxt, payloads)} {nxt} shards")
+    return False
+
+def coordinate(slugs):
+    """Queue every school's shards and merge phases as they complete, until all spans are merged."""
+    conn = _connect()
+    pending = list(slugs)
+    while pending:
+        pending = [slug for slug in pending if not advance(conn, slug)]
+        if pending:
+            time.sleep(POLL_SECONDS)
+    conn.close()
+
+def status():
+    conn = _connect()
+    rows = conn.execute("SELECT slug, phase, state, COUNT(*), SUM(attempts) FROM shards "
+                        "GROUP BY slug, phase, state ORDER BY slug, phase, state").fetchall()
+    conn.close()
+    return pd.DataFrame(rows, columns=["school", "phase", "state", "shards", "attempts"])
+
+def retry_failed():
+    conn = _connect()
+    n = conn.execute("UPDATE shards SET state = 'pending', attempts = 0, lease_expires = NULL "
+                     "WHERE state = 'failed'").rowcount
+    conn.close()
+    return n
+
+def main():
+    parser = argparse.ArgumentParser(description="Shard scripts 1-3 over a shared work queue.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    coord = sub.add_parser("coordinator", help="queue shards and merge finished phases")
+    coord.add_argument("slugs", nargs="*", help="institution slugs (default: all registered)")
+    worker = sub.add_parser("worker", help="lease and run shards")
+    worker.add_argument("--id", help="worker name (default: host:pid)")
+    worker.add_argument("--idle-exit", type=float, default=IDLE_EXIT_SECONDS, help="seconds without work before exiting")
+    sub.add_parser("status", help="shards per school, phase and state")
+    sub.add_parser("retry", help="re-queue failed shards")
+    args = parser.parse_args()
+
+    if args.command == "coordinator":
+        coordinate(selected_slugs(args.slugs))
+    elif args.command == "worker":
+        work(args.id, args.idle_exit)
+    elif args.command == "status":
+        print(status().to_string(index=False))
+    else:
+        print(f"✓ {retry_failed()} failed shards re-queued")
+
+if __name__ == "__main__":
+    main()